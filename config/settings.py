@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'leanledger.ledger.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,13 +78,70 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Django's SQLite backend, with serialized write transactions (see leanledger/ledger/sqlite)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'leanledger.ledger.sqlite',
+        'NAME': os.environ.get('LEDGER_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
+# PRAGMAs run on every new SQLite connection
+LEDGER_SQLITE_PRAGMAS = {}
+
+# LEDGER_DB_PROFILE=production: WAL journaling, tuned PRAGMAs and persistent connections
+if os.environ.get('LEDGER_DB_PROFILE') == 'production':
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    LEDGER_SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'mmap_size': 256 * 1024 * 1024,
+        # In KiB when negative
+        'cache_size': -64 * 1024,
+        # Milliseconds to wait for the write lock
+        'busy_timeout': 5000,
+        'temp_store': 'memory',
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache of account trees and JSON payloads, see leanledger/ledger/cache.py
+LEDGER_CACHE = 'default'
+
+
+# SQL instrumentation, see leanledger/ledger/middleware.py
+
+# Fraction of the requests that are instrumented
+LEDGER_SQL_SAMPLE_RATE = 1.0
+# Slowest queries of each request to log
+LEDGER_SQL_SLOWEST = 3
+# Raise when a view goes over its query budget, instead of logging a warning
+LEDGER_SQL_BUDGET_STRICT = False
+
+# Every instrumented request is logged at INFO, requests over their budget at WARNING
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'leanledger.sql': {
+            'handlers': ['console'],
+            'level': os.environ.get('LEDGER_SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -1,7 +1,9 @@
 """
 WSGI config for leanledger project.
 
-It exposes the WSGI callable as a module-level variable named ``application``.
+It exposes the WSGI callable as a module-level variable named ``application``. Serve it with a
+thread per request (or a pool of them), so slow exports and reports don't hold up the small JSON
+requests of the record editor: ``manage.py benchmark --load`` compares it with a single thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
@@ -11,6 +13,6 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'leanledger.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
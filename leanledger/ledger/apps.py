@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class LedgerConfig(AppConfig):
     name = 'leanledger.ledger'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .sqlite import configure_connection
+
+        connection_created.connect(configure_connection)
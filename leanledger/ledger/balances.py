@@ -0,0 +1,85 @@
+"""
+Incremental maintenance of what the write paths report: stored balances and checkpoints, record
+imbalances and versions, ledger versions and the search index, written once per
+``deferred_balance_updates`` block, in a ``write_transaction``.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .sqlite import write_transaction
+
+_state = threading.local()
+
+
+def _pending():
+    return getattr(_state, 'pending', None)
+
+
+@contextmanager
+def deferred_balance_updates():
+    if _pending() is not None:
+        # Nested block: the outermost one writes everything
+        yield
+        return
+
+    _state.pending = (defaultdict(int), set(), set(), set(), {})
+    try:
+        with write_transaction():
+            yield
+            pending, _state.pending = _state.pending, None
+            _write(*pending)
+    finally:
+        _state.pending = None
+
+
+def add_delta(account_pk, amount, record_pk=None):
+    """``record_pk`` is the record of the variation, the checkpoints from its date are stale."""
+    changes = {(account_pk, record_pk)} if record_pk is not None else set()
+    pending = _pending()
+    if pending is None:
+        with write_transaction():
+            _write({account_pk: amount}, (), (), changes, {})
+    else:
+        pending[0][account_pk] += amount
+        pending[3].update(changes)
+
+
+def touch_record(record_pk):
+    pending = _pending()
+    if pending is None:
+        with write_transaction():
+            _write({}, {record_pk}, (), (), {})
+    else:
+        pending[1].add(record_pk)
+
+
+def move_record(record_pk, date):
+    """``record_pk`` was dated ``date`` before this write (it moved or it's being deleted)."""
+    pending = _pending()
+    if pending is None:
+        with write_transaction():
+            _write({}, (), (), (), {record_pk: date})
+    else:
+        moved = pending[4]
+        moved[record_pk] = min(date, moved.get(record_pk, date))
+
+
+def touch_ledger(ledger_pk):
+    pending = _pending()
+    if pending is None:
+        with write_transaction():
+            _write({}, (), {ledger_pk}, (), {})
+    else:
+        pending[2].add(ledger_pk)
+
+
+def _write(deltas, record_pks, ledger_pks, changes, moved):
+    from . import search
+    from .models import AccountBalance, BalanceCheckpoint, Ledger, Record
+
+    AccountBalance.objects.apply_deltas(deltas)
+    BalanceCheckpoint.objects.invalidate(changes, moved)
+    Record.objects.refresh(record_pks)
+    search.index(set(record_pks) | set(moved))
+    Ledger.objects.bump_versions(ledger_pks, record_pks)
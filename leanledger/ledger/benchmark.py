@@ -0,0 +1,482 @@
+"""
+Benchmarks of the hot paths (``run``, ``run_concurrent``, ``run_load``) against synthetic ledgers
+made by ``generate_ledger`` through the bulk write paths.
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, WSGIServer
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache
+from .core import CREDIT, DEBIT
+from .importer import BATCH_SIZE, write_batch
+from .models import (
+    Account, AccountBalance, Ledger, Record, Variation, bulk_create_with_pks,
+)
+from .pagination import records_page
+
+
+def generate_accounts(ledger, depth, fanout):
+    """
+    Create two trees of ``depth`` levels and ``fanout`` children per account (and ``fanout``
+    roots), one per account type. Returns the leaf accounts.
+    """
+    level = [(type_, None) for type_ in (Account.DESTINATION, Account.ORIGIN)]
+    with transaction.atomic():
+        for number in range(depth):
+            accounts = [
+                Account(
+                    ledger=ledger,
+                    type=type_,
+                    parent=parent,
+                    name='{}{}-{}'.format(type_, number, index),
+                    path=parent.children_path if parent is not None else '',
+                )
+                for type_, parent in level
+                for index in range(fanout)
+            ]
+            bulk_create_with_pks(Account.objects, accounts)
+            AccountBalance.objects.bulk_create(
+                AccountBalance(account=account) for account in accounts)
+            level = [(account.type, account) for account in accounts]
+        Ledger.objects.bump_versions([ledger.pk], accounts=True)
+    return [account for _, account in level]
+
+
+def _amount(account, type_, cents):
+    return cents if Variation.is_increase(account, type_) else -cents
+
+
+def generate_records(ledger, leaves, records, variations, start, days, rng):
+    """
+    Create ``records`` balanced records on ``leaves``: one debit and ``variations - 1`` credits
+    each, on random accounts, in batches.
+    """
+    by_type = {
+        type_: [account for account in leaves if account.type == type_]
+        for type_ in (Account.DESTINATION, Account.ORIGIN)
+    }
+    batch = []
+    for number in range(records):
+        cents = rng.randint(100 * variations, 100000 * variations)
+        debit = rng.choice(leaves)
+        record_variations = [(debit, _amount(debit, DEBIT, cents))]
+        # Split the credit in ``variations - 1`` parts of at least a cent
+        cuts = sorted(rng.sample(range(1, cents), variations - 2))
+        for part in (end - start for start, end in zip([0] + cuts, cuts + [cents])):
+            credit = rng.choice(by_type[rng.choice(list(by_type))])
+            record_variations.append((credit, _amount(credit, CREDIT, part)))
+
+        record = Record(
+            date=start + timedelta(days=number * days // records),
+            description='Record {}'.format(number),
+        )
+        batch.append((record, record_variations))
+        if len(batch) >= BATCH_SIZE:
+            write_batch(ledger.pk, batch)
+            batch = []
+    if batch:
+        write_batch(ledger.pk, batch)
+
+
+def generate_ledger(
+        user=None, depth=3, fanout=4, records=1000, variations=2, start=date(2019, 1, 1),
+        days=365, seed=0):
+    """Create a ledger of the given shape, see the module's docstring."""
+    if variations < 2:
+        raise ValueError('Records need at least two variations to be balanced')
+    if user is None:
+        user, _ = User.objects.get_or_create(username='benchmark')
+    rng = random.Random(seed)
+    ledger = Ledger.objects.create(
+        user=user, name='Benchmark {}x{}, {} records'.format(depth, fanout, records))
+    leaves = generate_accounts(ledger, depth, fanout)
+    generate_records(ledger, leaves, records, variations, start, days, rng)
+    return ledger
+
+
+class Case:
+    """A hot path: ``setup(ledger)`` returns what ``run`` takes, ``run`` is what's timed."""
+
+    def __init__(self, name, setup, run):
+        self.name, self.setup, self.run = name, setup, run
+
+
+def _largest_root(ledger):
+    return (
+        Account.objects.filter(ledger=ledger, parent=None)
+        .order_by('-balance__total', 'pk').first()
+    )
+
+
+def _get(client_and_url):
+    client, url = client_and_url
+    response = client.get(url)
+    assert response.status_code == 200, response.status_code
+
+
+def _page(url_name, account=False):
+    def setup(ledger):
+        args = [ledger.pk] + ([_largest_root(ledger).pk] if account else [])
+        return Client(), reverse(url_name, args=args)
+    return Case(url_name, setup, _get)
+
+
+def _update_states(ledger, n_records):
+    """``(record_pk, [state with the amounts doubled, state])`` of the latest ``n_records``."""
+    records = Record.objects.with_variations(
+        Record.objects.filter(ledger=ledger).order_by('-date', '-pk')[:n_records], ledger.pk)
+    states = []
+    for record in records:
+        original = record.as_dict()
+        doubled = json.loads(json.dumps(original))
+        for variations in doubled['variations'].values():
+            for variation in variations:
+                variation['amount'] *= 2
+        states.append((record.pk, [doubled, original]))
+    return states
+
+
+def _update_context(ledger):
+    [(record_pk, states)] = _update_states(ledger, 1)
+    url = reverse('record_update_json', args=[ledger.pk, record_pk])
+    return Client(), url, states
+
+
+def _update_record(context):
+    client, url, states = context
+    # Alternate between the record and the record with its amounts doubled
+    states.reverse()
+    response = client.post(url, json.dumps(states[0]), content_type='application/json')
+    assert response.status_code == 200, response.status_code
+
+
+def _filter_context(ledger):
+    url = reverse('variation_filter_json', args=[ledger.pk])
+    return Client(), '{}?account={}&min_amount=50'.format(url, _largest_root(ledger).pk)
+
+
+CASES = [
+    _page('record_list'),
+    _page('account_list'),
+    _page('account_list_json'),
+    _page('account_detail', account=True),
+    Case('record_update_json', _update_context, _update_record),
+    Case('variation_filter_json', _filter_context, _get),
+    Case(
+        'account_total',
+        lambda ledger: _largest_root(ledger).pk,
+        lambda account_pk: Account.objects.select_related('balance').get(pk=account_pk).total,
+    ),
+]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            check=True, universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ledger_shape(ledger):
+    return OrderedDict([
+        ('accounts', Account.objects.filter(ledger=ledger).count()),
+        ('records', Record.objects.filter(ledger=ledger).count()),
+        ('variations', Variation.objects.filter(ledger=ledger).count()),
+    ])
+
+
+def run_case(case, ledger, repeat):
+    """Run ``case`` ``repeat`` times, after a warm-up run, and return its timings."""
+    context = case.setup(ledger)
+    case.run(context)
+    timings, queries = [], 0
+    for _ in range(repeat):
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            case.run(context)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+    return OrderedDict([
+        ('queries', queries),
+        ('min_ms', round(min(timings), 3)),
+        ('median_ms', round(statistics.median(timings), 3)),
+        ('max_ms', round(max(timings), 3)),
+    ])
+
+
+def run(ledger, repeat=10, cases=None, shape=None):
+    """Run ``cases`` (all of ``CASES`` by default) against ``ledger``."""
+    cases = CASES if cases is None else [case for case in CASES if case.name in cases]
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        results = OrderedDict((case.name, run_case(case, ledger, repeat)) for case in cases)
+    return OrderedDict([
+        ('commit', _git_commit()),
+        ('created', timezone.now().isoformat()),
+        ('python', platform.python_version()),
+        ('database', connection.vendor),
+        ('repeat', repeat),
+        ('shape', shape or {}),
+        ('ledger', ledger_shape(ledger)),
+        ('results', results),
+    ])
+
+
+def _percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def _summary(timings, errors, elapsed):
+    return OrderedDict([
+        ('done', len(timings)),
+        ('errors', len(errors)),
+        ('per_second', round(len(timings) / elapsed, 1)),
+        ('median_ms', round(statistics.median(timings), 3) if timings else None),
+        ('p95_ms', round(_percentile(timings, 0.95), 3) if timings else None),
+        ('max_ms', round(max(timings), 3) if timings else None),
+        ('error_messages', sorted(set(errors))),
+    ])
+
+
+def _write(ledger, record_pk, states):
+    # Alternate between the record and the record with its amounts doubled
+    states.reverse()
+    Record.objects.get(pk=record_pk).update_from_dict(states[0])
+
+
+def _read(ledger, *args):
+    records = Record.objects.filter(ledger=ledger)
+    Record.objects.with_variations(records_page(records).records, ledger.pk)
+
+
+def _worker(ledger, operation, args, requests, barrier, results):
+    timings, errors = [], []
+    try:
+        barrier.wait()
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                operation(ledger, *args)
+            except DatabaseError as error:
+                errors.append(str(error))
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        # Every thread has its own connection
+        connection.close()
+        results.append((operation.__name__, timings, errors))
+
+
+def run_concurrent(ledger, writers=4, readers=4, requests=50):
+    """
+    Run ``writers`` threads updating records (each one its own record, like ``record_update_json``)
+    and ``readers`` threads reading pages of records (like ``record_list_json``) at once, each
+    ``requests`` times, with a connection each, and return the throughput, latencies and errors
+    (like "database is locked") of each kind. Needs a database file, not an in-memory one.
+    """
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        raise ValueError('Concurrent benchmarks need a database file')
+    states = _update_states(ledger, writers)
+    if len(states) < writers:
+        raise ValueError('The ledger has fewer records than writers')
+    threads, results = [], []
+    barrier = threading.Barrier(writers + readers + 1)
+    for record_pk, record_states in states:
+        threads.append((_write, (record_pk, record_states)))
+    threads += [(_read, ())] * readers
+    threads = [
+        threading.Thread(
+            target=_worker, args=(ledger, operation, args, requests, barrier, results))
+        for operation, args in threads
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = OrderedDict()
+    for name, kind in (('_write', 'writes'), ('_read', 'reads')):
+        timings = [time for operation, times, _ in results if operation == name for time in times]
+        errors = [error for operation, _, errs in results if operation == name for error in errs]
+        summary[kind] = _summary(timings, errors, elapsed)
+    return OrderedDict([
+        ('commit', _git_commit()),
+        ('created', timezone.now().isoformat()),
+        ('database', connection.vendor),
+        ('pragmas', getattr(settings, 'LEDGER_SQLITE_PRAGMAS', {})),
+        ('writers', writers),
+        ('readers', readers),
+        ('requests', requests),
+        ('elapsed_s', round(elapsed, 3)),
+        ('ledger', ledger_shape(ledger)),
+        ('results', summary),
+    ])
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _serve(threaded):
+    """Serve the WSGI application on a free local port, from a thread."""
+    server = (ThreadedWSGIServer if threaded else WSGIServer)(('127.0.0.1', 0), _QuietHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _http(url, body=None):
+    # Any token will do as long as the cookie and the header match
+    token = 'benchmark' * 3 + 'token'
+    request = urllib.request.Request(url, data=body, headers={
+        'Content-Type': 'application/json',
+        'Cookie': 'csrftoken={}'.format(token),
+        'X-CSRFToken': token,
+    })
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def _edit(base_url, ledger, record_pk, states, requests, barrier, results):
+    """What ``Record.js`` does: load a record and the accounts, then save the record."""
+    urls = [
+        reverse('record_detail_json', args=[ledger.pk, record_pk]),
+        reverse('account_list_json', args=[ledger.pk]),
+    ]
+    update_url = reverse('record_update_json', args=[ledger.pk, record_pk])
+    timings, errors = [], []
+    barrier.wait()
+    for _ in range(requests):
+        states.reverse()
+        for url, body in [(url, None) for url in urls] + [(update_url, json.dumps(states[0]))]:
+            started = time.perf_counter()
+            try:
+                _http(base_url + url, body.encode() if body is not None else None)
+            except OSError as error:
+                errors.append(str(error))
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+    results.append((timings, errors))
+
+
+def _export(base_url, ledger, done, barrier, results):
+    url = base_url + reverse('ledger_export', args=[ledger.pk])
+    timings, errors = [], []
+    barrier.wait()
+    while not done.is_set():
+        started = time.perf_counter()
+        try:
+            _http(url)
+        except OSError as error:
+            errors.append(str(error))
+        else:
+            timings.append((time.perf_counter() - started) * 1000)
+    results.append((timings, errors))
+
+
+def _load(ledger, threaded, states, exporters, requests):
+    server = _serve(threaded)
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    barrier = threading.Barrier(len(states) + exporters + 1)
+    done, edits, exports = threading.Event(), [], []
+    editors = [
+        threading.Thread(
+            target=_edit, args=(base_url, ledger, record_pk, list(record_states), requests,
+                                barrier, edits))
+        for record_pk, record_states in states
+    ]
+    slow = [
+        threading.Thread(target=_export, args=(base_url, ledger, done, barrier, exports))
+        for _ in range(exporters)
+    ]
+    for thread in editors + slow:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in editors:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in slow:
+        thread.join()
+    server.shutdown()
+    server.server_close()
+
+    return OrderedDict([
+        ('editor', _summary(
+            [timing for timings, _ in edits for timing in timings],
+            [error for _, errors in edits for error in errors], elapsed)),
+        ('export', _summary(
+            [timing for timings, _ in exports for timing in timings],
+            [error for _, errors in exports for error in errors], elapsed)),
+    ])
+
+
+def run_load(ledger, editors=4, exporters=2, requests=20):
+    """
+    Serve the WSGI application over HTTP, first from a single thread and then from a thread per
+    request, and run a mixed workload against each: ``editors`` clients doing what the record
+    editor does (``requests`` times: a record, the accounts and an update of the record) while
+    ``exporters`` clients export the ledger over and over. Returns the latencies and throughput
+    of both kinds of requests with both servers. Needs a database file, not an in-memory one.
+    """
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        raise ValueError('Load benchmarks need a database file')
+    states = _update_states(ledger, editors)
+    if len(states) < editors:
+        raise ValueError('The ledger has fewer records than editors')
+    with override_settings(ALLOWED_HOSTS=['127.0.0.1']):
+        results = OrderedDict(
+            (name, _load(ledger, threaded, states, exporters, requests))
+            for name, threaded in (('single_thread', False), ('threaded', True))
+        )
+    return OrderedDict([
+        ('commit', _git_commit()),
+        ('created', timezone.now().isoformat()),
+        ('database', connection.vendor),
+        ('pragmas', getattr(settings, 'LEDGER_SQLITE_PRAGMAS', {})),
+        ('editors', editors),
+        ('exporters', exporters),
+        ('requests', requests),
+        ('ledger', ledger_shape(ledger)),
+        ('results', results),
+    ])
+
+
+def compare(previous, current):
+    """
+    Yield ``(case, field, previous, current, ratio)`` for the timings and query counts of the
+    cases in both results.
+    """
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        for field in ('queries', 'median_ms'):
+            ratio = result[field] / before[field] if before[field] else None
+            yield name, field, before[field], result[field], ratio
@@ -0,0 +1,86 @@
+"""
+Per-ledger read cache on Django's cache framework (``settings.LEDGER_CACHE``), keyed by the
+versions of ledgers, their accounts and records, with hit and miss counts in ``stats``.
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Account, Record
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+_MISSING = object()
+
+
+def _cache():
+    return caches[getattr(settings, 'LEDGER_CACHE', 'default')]
+
+
+def _count(kind, hits, misses):
+    with _stats_lock:
+        stats[kind, 'hit'] += hits
+        stats[kind, 'miss'] += misses
+
+
+def _key(kind, *parts):
+    return 'ledger:{}:{}'.format(kind, ':'.join(str(part) for part in parts))
+
+
+def get_or_set(kind, parts, compute):
+    cache = _cache()
+    key = _key(kind, *parts)
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count(kind, 1, 0)
+        return value
+    _count(kind, 0, 1)
+    value = compute()
+    cache.set(key, value)
+    return value
+
+
+def clear():
+    _cache().clear()
+    with _stats_lock:
+        stats.clear()
+
+
+def account_tree(ledger_pk, version):
+    """``Account.objects.tree``, with the account totals."""
+    return get_or_set('tree', (ledger_pk, version), lambda: Account.objects.tree(ledger_pk))
+
+
+def accounts_dicts(ledger_pk, accounts_version):
+    """``Account.objects.all_as_dict``."""
+    return get_or_set(
+        'accounts', (ledger_pk, accounts_version),
+        lambda: Account.objects.all_as_dict(ledger_pk))
+
+
+def record_dicts(records, ledger_pk, accounts_version):
+    """
+    ``as_dict`` of ``records``, which must have their ``version`` loaded. Only the variations of
+    the records that aren't cached are fetched, in one query.
+    """
+    cache = _cache()
+    records = list(records)
+    keys = {
+        record.pk: _key('record', record.pk, record.version, accounts_version)
+        for record in records
+    }
+    cached = cache.get_many(keys.values())
+    missing = [record for record in records if keys[record.pk] not in cached]
+    _count('record', len(records) - len(missing), len(missing))
+
+    if missing:
+        computed = {
+            keys[record.pk]: record.as_dict()
+            for record in Record.objects.with_variations(missing, ledger_pk)
+        }
+        cache.set_many(computed)
+        cached.update(computed)
+    return [cached[keys[record.pk]] for record in records]
@@ -1,8 +1,37 @@
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
 DEBIT = 'debit'
 CREDIT = 'credit'
 
 
-def record_is_balanced(record):
+def to_cents(amount):
+    """
+    ``amount`` (a ``Decimal``, a number or its string, as forms and JSON send them) in integer
+    cents, rounded half to even. Raises ``InvalidOperation`` if it isn't a finite number.
+    """
+    amount = Decimal(str(amount))
+    if not amount.is_finite():
+        raise InvalidOperation('Not a finite amount: {!r}'.format(amount))
+    return int(amount.scaleb(2).quantize(Decimal(1)))
+
+
+def from_cents(cents):
+    """Integer ``cents`` as an exact ``Decimal`` amount with two decimal places."""
+    return Decimal(cents).scaleb(-2)
+
+
+def json_amount(cents):
+    """
+    Integer ``cents`` as a number for JSON. The division is correctly rounded and floats are
+    written with the shortest repr that reads back the same, which is the exact amount for
+    amounts below 10 ** 13.
+    """
+    return cents / 100
+
+
+def record_imbalance(record):
+    """Debit minus credit of the record's variations, in cents, zero when it's balanced."""
     debit_sum, credit_sum = 0, 0
     for variation in record.variations.all():
         amount = abs(variation.amount)
@@ -10,4 +39,133 @@ def record_is_balanced(record):
             debit_sum += amount
         else:
             credit_sum += amount
-    return debit_sum == credit_sum
+    return debit_sum - credit_sum
+
+
+def record_is_balanced(record):
+    return record_imbalance(record) == 0
+
+
+def rollup_totals(own_totals, parents):
+    """
+    Add up ``own_totals`` (``{account_pk: amount}``) along the account hierarchy described by
+    ``parents`` (``{account_pk: parent_pk}``, ``None`` for root accounts). Returns the total of the
+    whole subtree of every account in ``parents``.
+    """
+    totals = {pk: 0 for pk in parents}
+    for pk, amount in own_totals.items():
+        while pk in totals:
+            totals[pk] += amount
+            pk = parents[pk]
+    return totals
+
+
+def account_paths(parents):
+    """
+    Materialized paths of the accounts in ``parents`` (``{account_pk: parent_pk}``): the primary
+    keys of its ancestors from the root, each followed by a slash (``"1/5/"``), or ``""`` for
+    root accounts.
+    """
+    paths = {}
+
+    def path(pk):
+        if pk not in paths:
+            parent_pk = parents[pk]
+            paths[pk] = '' if parent_pk is None else '{}{}/'.format(path(parent_pk), parent_pk)
+        return paths[pk]
+
+    for pk in parents:
+        path(pk)
+    return paths
+
+
+def path_pks(path):
+    """Primary keys of the ancestors in a materialized ``path``, from the root."""
+    return [int(pk) for pk in path.split('/') if pk]
+
+
+def path_range(path):
+    """
+    Lookups for the paths that start with ``path`` as a range, which unlike ``startswith`` (a
+    ``LIKE``) can use an index on every database: ``/`` sorts right before ``0``.
+    """
+    return {'path__gte': path, 'path__lt': path[:-1] + '0'}
+
+
+def month_end(date):
+    """Last day of the month of ``date``."""
+    next_month = date.replace(day=28) + timedelta(days=4)
+    return next_month - timedelta(days=next_month.day)
+
+
+def month_ends(first, last):
+    """Last day of every month from the month of ``first`` to the one of ``last``."""
+    date = month_end(first)
+    while date <= last:
+        yield date
+        date = month_end(date + timedelta(days=1))
+
+
+def record_state_errors(state, accounts):
+    """
+    Validate the ``state`` of a record as sent by the front-end (what ``Record.update_from_dict``
+    takes) against the ledger's ``accounts`` (``{account_pk: account}``). Returns the errors.
+    """
+    if not isinstance(state, dict):
+        return ['Invalid record']
+
+    errors = []
+    try:
+        datetime.strptime(str(state.get('date')), '%Y-%m-%d')
+    except ValueError:
+        errors.append('Invalid date: {!r}'.format(state.get('date')))
+    if not isinstance(state.get('description'), str):
+        errors.append('Invalid description: {!r}'.format(state.get('description')))
+
+    variations = state.get('variations')
+    if not isinstance(variations, dict):
+        return errors + ['Invalid variations']
+    for type_, variation_dicts in variations.items():
+        if type_ not in (DEBIT, CREDIT) or not isinstance(variation_dicts, list):
+            errors.append('Invalid variation type: {!r}'.format(type_))
+            continue
+        for variation_dict in variation_dicts:
+            valid = isinstance(variation_dict, dict) and isinstance(variation_dict.get('id'), int)
+            if not valid:
+                errors.append('Invalid variation: {!r}'.format(variation_dict))
+                continue
+            account_id = variation_dict.get('account_id')
+            if not isinstance(account_id, int) or account_id not in accounts:
+                errors.append('Unknown account: {!r}'.format(account_id))
+            try:
+                amount = to_cents(variation_dict.get('amount'))
+            except InvalidOperation:
+                amount = None
+            if amount is None or amount < 0:
+                errors.append('Invalid amount: {!r}'.format(variation_dict.get('amount')))
+    return errors
+
+
+def diff_variations(existing, state):
+    """
+    Match the variations of a record's new ``state`` (``{type: [variation_dict]}``) with the
+    ``existing`` ones (``{type: [variation]}``) by type and id, in one pass. Ids are only unique
+    within a type: the front-end generates new ones by adding one to the max id of the type.
+
+    Returns ``(to_create, to_update, to_delete)``: ``(type, variation_dict)`` pairs for the new
+    variations, ``(variation, type, variation_dict)`` for the existing ones that are still in the
+    state, and the existing variations that aren't.
+    """
+    existing_by_key = {
+        (type_, variation.pk): variation
+        for type_, variations in existing.items() for variation in variations
+    }
+    to_create, to_update = [], []
+    for type_, variation_dicts in state.items():
+        for variation_dict in variation_dicts:
+            variation = existing_by_key.pop((type_, variation_dict["id"]), None)
+            if variation is None:
+                to_create.append((type_, variation_dict))
+            else:
+                to_update.append((variation, type_, variation_dict))
+    return to_create, to_update, list(existing_by_key.values())
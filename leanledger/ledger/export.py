@@ -0,0 +1,79 @@
+"""
+Streaming export of a ledger's records, as CSV or JSON Lines.
+
+Records are read in keyset-paginated chunks (see ``pagination.py``) with their variations
+batch-loaded, so memory use doesn't grow with the size of the ledger.
+"""
+import csv
+import json
+
+from .core import CREDIT, DEBIT
+from .models import Account, Record
+from .pagination import records_page
+
+CHUNK_SIZE = 500
+
+CSV_COLUMNS = [
+    'id', 'date', 'description', 'is_balanced',
+    'type', 'variation_id', 'account_id', 'account_name', 'account_url', 'amount',
+]
+
+
+def iter_records(ledger_pk, chunk_size=CHUNK_SIZE):
+    accounts = Account.objects.tree(ledger_pk)
+    records = Record.objects.filter(ledger=ledger_pk)
+    cursor = None
+    while True:
+        page = records_page(records, cursor, chunk_size)
+        yield from Record.objects.with_variations(page.records, ledger_pk, accounts)
+        if page.next_cursor is None:
+            return
+        cursor = page.next_cursor
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record.as_dict()) + '\n'
+
+
+class _Echo:
+    """File-like object that just returns what ``csv.writer`` writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    """One row per variation, repeating the record columns. Records without variations get one
+    row with empty variation columns."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        record_dict = record.as_dict()
+        record_columns = [
+            record_dict['id'], record_dict['date'], record_dict['description'],
+            record_dict['is_balanced'],
+        ]
+        variations = [
+            (type_, variation)
+            for type_ in (DEBIT, CREDIT)
+            for variation in record_dict['variations'][type_]
+        ]
+        if not variations:
+            yield writer.writerow(record_columns + [''] * 6)
+        for type_, variation in variations:
+            yield writer.writerow(record_columns + [
+                type_, variation['id'], variation['account_id'], variation['account_name'],
+                variation['account_url'], variation['amount'],
+            ])
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def export_lines(ledger_pk, format_):
+    lines, _ = FORMATS[format_]
+    return lines(iter_records(ledger_pk))
@@ -1,6 +1,9 @@
+from django import forms
 from django.forms import ModelForm
 
+from .core import from_cents, to_cents
 from .models import Account, Ledger, Record, Variation
+from .reports import GRANULARITIES
 
 
 def set_inputs_css_class(form):
@@ -8,6 +11,23 @@ def set_inputs_css_class(form):
         field.field.widget.attrs['class'] = 'form-control'
 
 
+class AmountField(forms.DecimalField):
+    """An amount entered with decimals, cleaned to integer cents like amounts are stored."""
+
+    def __init__(self, **kwargs):
+        super().__init__(max_digits=16, decimal_places=2, **kwargs)
+
+    def prepare_value(self, value):
+        return from_cents(value) if isinstance(value, int) else value
+
+    def has_changed(self, initial, data):
+        return super().has_changed(self.prepare_value(initial), data)
+
+    def clean(self, value):
+        value = super().clean(value)
+        return to_cents(value) if value is not None else None
+
+
 class AccountForm(ModelForm):
     class Meta:
         model = Account
@@ -35,6 +55,8 @@ class RecordForm(ModelForm):
 
 
 class VariationForm(ModelForm):
+    amount = AmountField()
+
     class Meta:
         model = Variation
         fields = ['amount', 'account']
@@ -42,3 +64,96 @@ class VariationForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         set_inputs_css_class(self)
+
+
+class ReportForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    granularity = forms.ChoiceField(
+        choices=[('', 'Whole range')] + [(name, name.title()) for name in GRANULARITIES],
+        required=False,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        set_inputs_css_class(self)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start is not None and end is not None and start > end:
+            raise forms.ValidationError('The start date must not be after the end date')
+        cleaned_data['granularity'] = cleaned_data.get('granularity') or None
+        return cleaned_data
+
+
+class RecordBatchForm(forms.Form):
+    """Records by primary key (``ids``, comma separated) or by date range."""
+
+    MAX_IDS = 500
+
+    ids = forms.CharField(required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    after = forms.CharField(required=False)
+
+    def clean_ids(self):
+        ids = self.cleaned_data['ids']
+        if not ids:
+            return None
+        try:
+            ids = [int(pk) for pk in ids.split(',')]
+        except ValueError:
+            raise forms.ValidationError('Record ids must be integers separated by commas')
+        if len(ids) > self.MAX_IDS:
+            raise forms.ValidationError('At most {} records at once'.format(self.MAX_IDS))
+        return ids
+
+    def clean(self):
+        cleaned_data = super().clean()
+        ids = cleaned_data.get('ids')
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if ids is not None and (start is not None or end is not None):
+            raise forms.ValidationError('Ask for record ids or for a date range, not both')
+        if ids is None and start is None and end is None and not self.errors:
+            raise forms.ValidationError('Ask for record ids or for a date range')
+        if start is not None and end is not None and start > end:
+            raise forms.ValidationError('The start date must not be after the end date')
+        return cleaned_data
+
+
+class RecordSearchForm(forms.Form):
+    q = forms.CharField(max_length=200)
+    page = forms.IntegerField(min_value=1, required=False)
+
+    def clean_page(self):
+        return self.cleaned_data['page'] or 1
+
+
+class VariationFilterForm(forms.Form):
+    """
+    Variations on an account and its subaccounts (all the ledger's if ``account`` is empty),
+    by record date, amount (in absolute value) and type.
+    """
+
+    account = forms.IntegerField(required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    min_amount = AmountField(min_value=0, required=False)
+    max_amount = AmountField(min_value=0, required=False)
+    direction = forms.ChoiceField(
+        choices=[('', 'Any'), (Variation.DEBIT, 'Debit'), (Variation.CREDIT, 'Credit')],
+        required=False,
+    )
+    after = forms.CharField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start is not None and end is not None and start > end:
+            raise forms.ValidationError('The start date must not be after the end date')
+        min_amount, max_amount = cleaned_data.get('min_amount'), cleaned_data.get('max_amount')
+        if min_amount is not None and max_amount is not None and min_amount > max_amount:
+            raise forms.ValidationError('The minimum amount must not be over the maximum')
+        cleaned_data['direction'] = cleaned_data.get('direction') or None
+        return cleaned_data
@@ -0,0 +1,179 @@
+"""
+Columnar NumPy snapshot of a ledger's variations (NumPy is optional, only this module needs it),
+for totals by account and period without model instances.
+"""
+from datetime import date as Date
+
+import numpy as np
+
+from .core import CREDIT, DEBIT, from_cents
+from .models import Account, Variation
+
+EPOCH = Date(1970, 1, 1).toordinal()
+
+# Units of ``numpy.datetime64`` periods start at
+GRANULARITIES = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+DIRECTIONS = {DEBIT: 1, CREDIT: -1}
+
+_VARIATION_DTYPE = np.dtype([
+    ('record', np.int64),
+    ('date', np.int32),
+    ('account', np.int64),
+    ('amount', np.int64),
+])
+
+
+def _day(date):
+    return date.toordinal() - EPOCH
+
+
+class LedgerFrame:
+    """
+    Variations of a ledger as parallel arrays, sorted by date:
+
+    * ``record``: primary key of the record.
+    * ``date``: date of the record, in days since 1970-01-01.
+    * ``account``: index of the account in ``account_pks``.
+    * ``amount``: amount in cents, positive if it increases the account.
+    * ``direction``: ``1`` for debits, ``-1`` for credits.
+
+    and the ledger's accounts, sorted by primary key:
+
+    * ``account_pks``: primary keys.
+    * ``parent``: index of the parent in ``account_pks``, ``-1`` for root accounts.
+    * ``depth``: ``0`` for root accounts, ``1`` for their children...
+    """
+
+    def __init__(self, record, date, account, amount, account_pks, parent, account_types):
+        order = np.argsort(date, kind='stable')
+        self.record = record[order]
+        self.date = date[order]
+        self.account = account[order]
+        self.amount = amount[order]
+        self.account_pks = account_pks
+        self.parent = parent
+        self.depth = self._depths(parent)
+
+        # Positive amounts are debits to destination accounts and credits to origin accounts
+        signs = np.where(account_types == Account.DESTINATION, 1, -1).astype(np.int8)
+        self.direction = (np.sign(self.amount) * signs[self.account]).astype(np.int8)
+
+    @classmethod
+    def load(cls, ledger_pk):
+        """Load the accounts and the variations of the ledger, in two queries."""
+        accounts = list(
+            Account.objects.filter(ledger=ledger_pk).order_by('pk').values_list(
+                'pk', 'parent_id', 'type'))
+        account_pks = np.array([pk for pk, _, _ in accounts], dtype=np.int64)
+        parent_pks = np.array(
+            [parent_pk if parent_pk is not None else -1 for _, parent_pk, _ in accounts],
+            dtype=np.int64)
+        parent = np.where(
+            parent_pks == -1, -1, np.searchsorted(account_pks, parent_pks)).astype(np.int32)
+        account_types = np.array([type_ for _, _, type_ in accounts])
+
+        rows = (
+            Variation.objects.filter(ledger=ledger_pk).order_by()
+            .values_list('record_id', 'date', 'account_id', 'amount')
+        )
+        variations = np.fromiter(
+            (
+                (record_pk, _day(date), account_pk, amount)
+                for record_pk, date, account_pk, amount in rows.iterator()
+            ),
+            dtype=_VARIATION_DTYPE,
+        )
+        return cls(
+            variations['record'],
+            variations['date'],
+            np.searchsorted(account_pks, variations['account']).astype(np.int32),
+            variations['amount'],
+            account_pks,
+            parent,
+            account_types,
+        )
+
+    def __len__(self):
+        return len(self.amount)
+
+    @staticmethod
+    def _depths(parent):
+        depth = np.zeros(len(parent), dtype=np.int32)
+        ancestor = parent.copy()
+        while (ancestor != -1).any():
+            has_ancestor = ancestor != -1
+            depth[has_ancestor] += 1
+            ancestor[has_ancestor] = parent[ancestor[has_ancestor]]
+        return depth
+
+    def dates(self):
+        """``date`` as ``numpy.datetime64`` days."""
+        return self.date.astype('datetime64[D]')
+
+    def _select(self, start, end, direction):
+        """Indexer of the variations from ``start`` to ``end`` (a slice, dates are sorted)."""
+        first = 0 if start is None else np.searchsorted(self.date, _day(start), side='left')
+        last = len(self) if end is None else np.searchsorted(self.date, _day(end), side='right')
+        selection = slice(first, last)
+        if direction is not None:
+            selection = first + np.flatnonzero(
+                self.direction[selection] == DIRECTIONS[direction])
+        return selection
+
+    def own_totals(self, start=None, end=None, granularity=None, direction=None):
+        """
+        Return ``(periods, totals)``, with the variations of each account in records from
+        ``start`` to ``end`` (both included), optionally only the debits or the credits
+        (``direction``).
+
+        ``totals`` is an array of cents with one row per period and one column per account (in
+        the order of ``account_pks``). If ``granularity`` is ``'day'``, ``'month'`` or
+        ``'year'``, ``periods`` is the ``numpy.datetime64`` start of every period with
+        variations, in order; otherwise it's ``[None]`` and there's a single row.
+        """
+        selection = self._select(start, end, direction)
+        account, amount = self.account[selection], self.amount[selection]
+        n_accounts = len(self.account_pks)
+
+        if granularity is None:
+            periods, key = np.array([None]), account
+        else:
+            # Dates are sorted: each distinct day is a run of variations, and only the days (not
+            # every variation) are converted to the start of their period
+            date = self.date[selection]
+            day_starts = np.flatnonzero(date[1:] != date[:-1]) + 1
+            days = date[np.concatenate(([0], day_starts))] if len(date) else date
+            day_periods = days.astype('datetime64[D]').astype(
+                'datetime64[{}]'.format(GRANULARITIES[granularity]))
+            periods, day_period = np.unique(day_periods, return_inverse=True)
+            periods = periods.astype('datetime64[D]')
+            day = np.zeros(len(date), dtype=np.int64)
+            day[day_starts] = 1
+            key = day_period.ravel()[np.cumsum(day, out=day)] * n_accounts + account
+
+        # In integers, like ``AccountBalance`` (``bincount`` would add up in floating point)
+        totals = np.zeros(len(periods) * n_accounts, dtype=np.int64)
+        np.add.at(totals, key, amount)
+        return periods, totals.reshape(len(periods), n_accounts)
+
+    def rollup(self, totals):
+        """Add ``totals`` (as returned by ``own_totals``) of every account to its ancestors."""
+        totals = totals.copy()
+        # Deepest accounts first, so that each level adds everything under it to its parents
+        for depth in range(int(self.depth.max(initial=0)), 0, -1):
+            children = np.flatnonzero(self.depth == depth)
+            np.add.at(totals, (slice(None), self.parent[children]), totals[:, children])
+        return totals
+
+    def totals(self, start=None, end=None, granularity=None, direction=None):
+        """``own_totals``, rolled up along the account hierarchy."""
+        periods, totals = self.own_totals(start, end, granularity, direction)
+        return periods, self.rollup(totals)
+
+    def as_decimals(self, row):
+        """``{account_pk: amount}`` of one row of totals, with ``Decimal`` amounts."""
+        return {
+            int(pk): from_cents(int(cents))
+            for pk, cents in zip(self.account_pks, row)
+        }
@@ -0,0 +1,182 @@
+"""
+Bulk import of records in the formats of ``export.py``, validated before anything is written and
+written in batches; invalid records are reported to ``on_error`` and skipped.
+"""
+import csv
+import json
+from collections import Counter, namedtuple
+from datetime import datetime
+from decimal import InvalidOperation
+from itertools import groupby
+
+from .balances import deferred_balance_updates, touch_record
+from .core import CREDIT, DEBIT, from_cents, to_cents
+from .models import Account, Record, Variation, bulk_create_with_pks
+
+BATCH_SIZE = 1000
+
+RowError = namedtuple('RowError', ['line', 'errors', 'record'])
+
+
+def jsonl_records(lines):
+    """Yield ``(line_number, record_dict)`` from JSON Lines, skipping blank lines."""
+    for line_number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+
+def csv_records(lines):
+    """
+    Yield ``(line_number, record_dict)`` from CSV rows as written by ``export.csv_lines``.
+    Consecutive rows with the same record ``id`` are one record.
+    """
+    rows = enumerate(csv.DictReader(lines), 2)
+    for _, record_rows in groupby(rows, lambda row: row[1].get('id') or row[0]):
+        record_rows = list(record_rows)
+        line_number, first_row = record_rows[0]
+        variations = {DEBIT: [], CREDIT: []}
+        for _, row in record_rows:
+            if row.get('type'):
+                variations.setdefault(row['type'], []).append({
+                    'account_id': row.get('account_id'),
+                    'account_name': row.get('account_name'),
+                    'amount': row.get('amount'),
+                })
+        yield line_number, {
+            'date': first_row.get('date'),
+            'description': first_row.get('description') or '',
+            'variations': variations,
+        }
+
+
+FORMATS = {
+    'csv': csv_records,
+    'jsonl': jsonl_records,
+}
+
+
+class AccountResolver:
+    def __init__(self, ledger_pk):
+        self.by_pk = Account.objects.tree(ledger_pk)
+        n_names = Counter(account.name for account in self.by_pk.values())
+        self.by_name = {
+            account.name: account
+            for account in self.by_pk.values() if n_names[account.name] == 1
+        }
+        self.by_name.update((account.full_name, account) for account in self.by_pk.values())
+
+    def resolve(self, variation_dict):
+        account_id = variation_dict.get('account_id')
+        if account_id not in (None, ''):
+            try:
+                return self.by_pk.get(int(account_id))
+            except (TypeError, ValueError):
+                return None
+        account_name = variation_dict.get('account_name')
+        return self.by_name.get(account_name) if isinstance(account_name, str) else None
+
+
+def prepare_record(record_dict, resolver):
+    """
+    Validate ``record_dict``. Returns ``(record, variations, errors)``, where ``variations`` are
+    ``(account, signed_amount)`` pairs, with amounts in cents.
+    """
+    if not isinstance(record_dict, dict):
+        return None, [], ['Invalid record']
+
+    errors = []
+    try:
+        date = datetime.strptime(str(record_dict.get('date')), '%Y-%m-%d').date()
+    except ValueError:
+        errors.append('Invalid date: {!r}'.format(record_dict.get('date')))
+        date = None
+    description = record_dict.get('description') or ''
+    if not isinstance(description, str):
+        errors.append('Invalid description: {!r}'.format(description))
+    record = Record(date=date, description=description)
+
+    variations, totals = [], {DEBIT: 0, CREDIT: 0}
+    variations_by_type = record_dict.get('variations') or {}
+    if not isinstance(variations_by_type, dict):
+        return record, [], errors + ['Invalid variations']
+    for type_, variation_dicts in variations_by_type.items():
+        if type_ not in totals or not isinstance(variation_dicts, list):
+            errors.append('Invalid variation type: {!r}'.format(type_))
+    for type_ in totals:
+        variation_dicts = variations_by_type.get(type_, [])
+        if not isinstance(variation_dicts, list):
+            continue
+        for variation_dict in variation_dicts:
+            if not isinstance(variation_dict, dict):
+                errors.append('Invalid variation: {!r}'.format(variation_dict))
+                continue
+            account = resolver.resolve(variation_dict)
+            if account is None:
+                errors.append('Unknown account: {!r}'.format(
+                    variation_dict.get('account_id') or variation_dict.get('account_name')))
+                continue
+            try:
+                amount = to_cents(variation_dict.get('amount'))
+            except InvalidOperation:
+                amount = None
+            if amount is None or amount <= 0:
+                errors.append('Invalid amount: {!r}'.format(variation_dict.get('amount')))
+                continue
+            totals[type_] += amount
+            is_increase = Variation.is_increase(account, type_)
+            variations.append((account, amount if is_increase else -amount))
+
+    if not errors and not (totals[DEBIT] and totals[CREDIT]):
+        errors.append('Record needs debit and credit variations')
+    elif not errors and totals[DEBIT] != totals[CREDIT]:
+        errors.append('Record is not balanced: debit {}, credit {}'.format(
+            from_cents(totals[DEBIT]), from_cents(totals[CREDIT])))
+    return record, variations, errors
+
+
+def write_batch(ledger_pk, batch):
+    """Write ``batch``, a list of ``(record, variations)``, in one transaction."""
+    with deferred_balance_updates():
+        records = [record for record, _ in batch]
+        for record in records:
+            record.ledger_id = ledger_pk
+        bulk_create_with_pks(Record.objects, records)
+        for record in records:
+            touch_record(record.pk)
+        Variation.objects.bulk_create([
+            Variation(record=record, account=account, amount=amount)
+            for record, variations in batch
+            for account, amount in variations
+        ])
+
+
+def import_records(ledger_pk, records, on_error, on_progress=None, batch_size=BATCH_SIZE):
+    """
+    Import ``records``, an iterable of ``(line_number, record_dict)``. ``on_error`` is called
+    with a ``RowError`` for every invalid record and ``on_progress`` with the number of records
+    imported so far after every batch. Returns the number of records imported.
+    """
+    resolver = AccountResolver(ledger_pk)
+    n_imported, batch = 0, []
+    for line_number, record_dict in records:
+        record, variations, errors = prepare_record(record_dict, resolver)
+        if errors:
+            on_error(RowError(line_number, errors, record_dict))
+            continue
+
+        batch.append((record, variations))
+        if len(batch) >= batch_size:
+            write_batch(ledger_pk, batch)
+            n_imported, batch = n_imported + len(batch), []
+            if on_progress is not None:
+                on_progress(n_imported)
+
+    if batch:
+        write_batch(ledger_pk, batch)
+        n_imported += len(batch)
+        if on_progress is not None:
+            on_progress(n_imported)
+    return n_imported
@@ -0,0 +1,104 @@
+import json
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmark
+from ...models import Ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot paths and count their queries against a synthetic ledger, generated with "
+        "the given shape (or an existing one, --ledger), and write the results as JSON to "
+        "compare them across commits (--compare)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', type=int, help="Benchmark this ledger, don't generate one")
+        parser.add_argument('--depth', type=int, default=3, help="Levels of the account trees")
+        parser.add_argument('--fanout', type=int, default=4, help="Children per account")
+        parser.add_argument('--records', type=int, default=1000)
+        parser.add_argument('--variations', type=int, default=2, help="Variations per record")
+        parser.add_argument('--days', type=int, default=365, help="Days the records span")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument(
+            '--case', action='append', dest='cases',
+            choices=[case.name for case in benchmark.CASES], help="Only these cases")
+        parser.add_argument(
+            '--concurrent', action='store_true',
+            help="Run writers and readers at once instead of the cases, see --writers")
+        parser.add_argument('--writers', type=int, default=4, help="Threads updating records")
+        parser.add_argument('--readers', type=int, default=4, help="Threads reading records")
+        parser.add_argument(
+            '--load', action='store_true',
+            help="Compare a single-threaded and a threaded WSGI server over HTTP, see --editors")
+        parser.add_argument('--editors', type=int, default=4, help="Clients editing records")
+        parser.add_argument('--exporters', type=int, default=2, help="Clients exporting")
+        parser.add_argument('--requests', type=int, default=50, help="Requests of every thread")
+        parser.add_argument('--output', help="File to write the results to")
+        parser.add_argument('--compare', help="Results of an earlier run to compare with")
+
+    def handle(self, *args, ledger=None, repeat, cases=None, output=None, compare=None,
+               concurrent=False, writers, readers, load=False, editors, exporters, requests,
+               **options):
+        shape = OrderedDict(
+            (name, options[name])
+            for name in ('depth', 'fanout', 'records', 'variations', 'days', 'seed')
+        )
+        if ledger is not None:
+            try:
+                ledger = Ledger.objects.get(pk=ledger)
+            except Ledger.DoesNotExist:
+                raise CommandError('Ledger {} does not exist'.format(ledger))
+            shape = None
+        else:
+            ledger = benchmark.generate_ledger(**shape)
+            self.stdout.write('Generated ledger {}, use --ledger {} to run again on it'.format(
+                ledger.name, ledger.pk))
+
+        if concurrent or load:
+            try:
+                if concurrent:
+                    results = benchmark.run_concurrent(ledger, writers, readers, requests)
+                    self.write_summaries(results['results'])
+                else:
+                    results = benchmark.run_load(ledger, editors, exporters, requests)
+                    for server, summaries in results['results'].items():
+                        self.stdout.write('{}:'.format(server))
+                        self.write_summaries(summaries)
+            except ValueError as error:
+                raise CommandError(error)
+            if output:
+                with open(output, 'w') as output_file:
+                    json.dump(results, output_file, indent=2)
+            return
+
+        results = benchmark.run(ledger, repeat, cases, shape)
+        for name, result in results['results'].items():
+            self.stdout.write('{:<24} {:>4} queries {:>10.2f} ms (min {:.2f}, max {:.2f})'.format(
+                name, result['queries'], result['median_ms'], result['min_ms'],
+                result['max_ms']))
+
+        if compare:
+            with open(compare) as previous_file:
+                previous = json.load(previous_file)
+            self.stdout.write('Compared with {}:'.format(previous.get('commit') or compare))
+            for name, field, before, after, ratio in benchmark.compare(previous, results):
+                self.stdout.write('{:<24} {:<10} {:>10} -> {:<10} {}'.format(
+                    name, field, before, after,
+                    'x{:.2f}'.format(ratio) if ratio is not None else ''))
+
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+
+    def write_summaries(self, summaries):
+        for kind, result in summaries.items():
+            self.stdout.write(
+                '{:<8} {:>6} done {:>4} errors {:>8.1f}/s median {} ms, p95 {} ms'.format(
+                    kind, result['done'], result['errors'], result['per_second'],
+                    result['median_ms'], result['p95_ms']))
+            for message in result['error_messages']:
+                self.stdout.write('    {}'.format(message))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Account, BalanceCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the balance checkpoints of the months that ended since they were last built. "
+        "Run it periodically (e.g. daily), so that balances as of a date only add up the "
+        "variations of the last month."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', type=int, help="Only this ledger's accounts")
+
+    def handle(self, *args, ledger=None, **options):
+        accounts = Account.objects.all() if ledger is None else Account.objects.filter(
+            ledger=ledger)
+        n_checkpoints = BalanceCheckpoint.objects.build(accounts)
+        self.stdout.write('Built {} checkpoints'.format(n_checkpoints))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import FORMATS, export_lines
+from ...models import Ledger
+
+
+class Command(BaseCommand):
+    help = "Export every record of a ledger, with its variations, as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ledger', type=int)
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to (default: stdout)")
+
+    def handle(self, *args, ledger, format, output=None, **options):
+        if not Ledger.objects.filter(pk=ledger).exists():
+            raise CommandError('Ledger {} does not exist'.format(ledger))
+
+        if output is None:
+            self._write(self.stdout, ledger, format)
+        else:
+            with open(output, 'w', newline='') as output_file:
+                self._write(output_file, ledger, format)
+
+    def _write(self, output_file, ledger, format_):
+        for line in export_lines(ledger, format_):
+            output_file.write(line)
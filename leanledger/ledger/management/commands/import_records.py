@@ -0,0 +1,50 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importer import BATCH_SIZE, FORMATS, import_records
+from ...models import Ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Import records into a ledger from a CSV or JSON Lines file in the export format. "
+        "Invalid records are skipped and reported, one JSON object per line, to --errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ledger', type=int)
+        parser.add_argument('file')
+        parser.add_argument(
+            '--format', choices=sorted(FORMATS), help="Default: from the file extension")
+        parser.add_argument('--errors', help="File to write the invalid records to")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, ledger, file, format=None, errors=None, batch_size, **options):
+        if not Ledger.objects.filter(pk=ledger).exists():
+            raise CommandError('Ledger {} does not exist'.format(ledger))
+        format_ = format or os.path.splitext(file)[1].lstrip('.')
+        if format_ not in FORMATS:
+            raise CommandError('Unknown format, use --format')
+
+        n_errors = 0
+        errors_file = open(errors, 'w') if errors else None
+
+        def on_error(row_error):
+            nonlocal n_errors
+            n_errors += 1
+            if errors_file is not None:
+                errors_file.write(json.dumps(row_error._asdict()) + '\n')
+
+        def on_progress(n_imported):
+            self.stdout.write('Imported {} records ({} errors)'.format(n_imported, n_errors))
+
+        try:
+            with open(file, newline='') as records_file:
+                n_imported = import_records(
+                    ledger, FORMATS[format_](records_file), on_error, on_progress, batch_size)
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+        self.stdout.write('Done: {} records imported, {} errors'.format(n_imported, n_errors))
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import search
+from ...models import Account, AccountBalance, BalanceCheckpoint, Ledger, Record, Variation
+from ...sqlite import write_transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored account paths, the ledger, date and type of variations, account "
+        "balances and their monthly checkpoints, record imbalances and the search index of "
+        "records (e.g. after loading fixtures), or just check them with --verify."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', type=int, help="Only this ledger's accounts and records")
+        parser.add_argument(
+            '--verify', action='store_true', help="Report mismatches instead of rebuilding")
+
+    def handle(self, *args, ledger=None, verify=False, **options):
+        if not verify:
+            if ledger is None:
+                ledgers = list(Ledger.objects.values_list('pk', flat=True))
+            else:
+                ledgers = [ledger]
+            with write_transaction():
+                Account.objects.rebuild_paths(ledger)
+                # Balances are added up by ledger and date of variations
+                Variation.objects.rebuild_denormalized(ledger)
+                n_accounts = AccountBalance.objects.rebuild(ledger)
+                # Also the version of records, like any write to them
+                n_records = Record.objects.rebuild_imbalances(ledger)
+                n_checkpoints = BalanceCheckpoint.objects.rebuild(ledger)
+                search.rebuild(ledger)
+                # Cache entries and ETags computed before are stale
+                Ledger.objects.bump_versions(ledgers, accounts=True)
+            self.stdout.write(
+                'Rebuilt the balances of {} accounts and {} records, and {} checkpoints'.format(
+                    n_accounts, n_records, n_checkpoints))
+            return
+
+        path_mismatches = Account.objects.verify_paths(ledger)
+        for account_pk, expected, stored in path_mismatches:
+            self.stdout.write('Account {}: expected path {!r}, stored {!r}'.format(
+                account_pk, expected, stored))
+        variation_mismatches = Variation.objects.verify_denormalized(ledger)
+        for variation_pk, expected, stored in variation_mismatches:
+            self.stdout.write(
+                'Variation {}: expected (ledger, date, type) {}, stored {}'.format(
+                    variation_pk, expected, stored))
+        account_mismatches = AccountBalance.objects.verify(ledger)
+        for account_pk, expected, stored in account_mismatches:
+            self.stdout.write('Account {}: expected (own, total) {}, stored {}'.format(
+                account_pk, expected, stored))
+        record_mismatches = Record.objects.verify_imbalances(ledger)
+        for record_pk, expected, stored in record_mismatches:
+            self.stdout.write('Record {}: expected imbalance {}, stored {}'.format(
+                record_pk, expected, stored))
+        checkpoint_mismatches = BalanceCheckpoint.objects.verify(ledger)
+        for account_pk, date, expected, stored in checkpoint_mismatches:
+            self.stdout.write('Account {} on {}: expected checkpoint {}, stored {}'.format(
+                account_pk, date, expected, stored))
+        if path_mismatches:
+            # Balances are rolled up along the paths
+            raise CommandError('{} accounts have a wrong path'.format(len(path_mismatches)))
+        if variation_mismatches:
+            raise CommandError('{} variations have a wrong ledger, date or type'.format(
+                len(variation_mismatches)))
+        if account_mismatches or record_mismatches or checkpoint_mismatches:
+            raise CommandError(
+                '{} accounts, {} records and {} checkpoints have a wrong balance'.format(
+                    len(account_mismatches), len(record_mismatches), len(checkpoint_mismatches)))
+        self.stdout.write('All balances are correct')
@@ -0,0 +1,144 @@
+"""
+Per-request SQL instrumentation: query counts and timings in ``Server-Timing``, in
+``request.query_stats`` and in a JSON log line, checked against the ``query_budget`` of views.
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('leanledger.sql')
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries):
+    """Declare that a view runs at most ``queries`` queries."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def fingerprint(sql):
+    """Short hash of ``sql`` (with placeholders), the same for ``IN`` lists of any length."""
+    return hashlib.sha1(_IN_LIST.sub('(%s)', sql).encode()).hexdigest()[:10]
+
+
+class QueryStats:
+    def __init__(self):
+        self.queries = []  # (duration in seconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for duration, _ in self.queries)
+
+    def slowest(self, n):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:n]
+
+    def duplicates(self):
+        """``(fingerprint, count, sql)`` of the queries run more than once, most first."""
+        counts = Counter(fingerprint(sql) for _, sql in self.queries)
+        examples = {fingerprint(sql): sql for _, sql in self.queries}
+        return [
+            (print_, count, examples[print_])
+            for print_, count in counts.most_common() if count > 1
+        ]
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _sampled(self):
+        if getattr(settings, 'LEDGER_SQL_BUDGET_STRICT', False):
+            return True
+        return random.random() < getattr(settings, 'LEDGER_SQL_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        if not self._sampled():
+            return self.get_response(request)
+
+        request.query_stats = stats = QueryStats()
+        started = time.perf_counter()
+        with self._instrument(stats):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self._stream(
+                request, response, response.streaming_content, stats, started)
+            return response
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = 'db;dur={:.1f};desc="{} queries", total;dur={:.1f}'.format(
+            stats.duration * 1000, stats.count, total * 1000)
+        self._log(request, response, stats, total)
+        return response
+
+    @staticmethod
+    def _instrument(stats):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        return stack
+
+    def _stream(self, request, response, content, stats, started):
+        # Instrumented one chunk at a time, the server runs other code in between
+        content = iter(content)
+        while True:
+            with self._instrument(stats):
+                chunk = next(content, None)
+            if chunk is None:
+                break
+            yield chunk
+        self._log(request, response, stats, time.perf_counter() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
+
+    def _log(self, request, response, stats, total):
+        budget = getattr(request, 'query_budget', None)
+        over_budget = budget is not None and stats.count > budget
+        slowest = getattr(settings, 'LEDGER_SQL_SLOWEST', 3)
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+            'budget': budget,
+            'slowest': [
+                {'ms': round(duration * 1000, 3), 'sql': sql}
+                for duration, sql in stats.slowest(slowest)
+            ],
+            'duplicates': [
+                {'fingerprint': print_, 'count': count, 'sql': sql}
+                for print_, count, sql in stats.duplicates()
+            ],
+        }
+        logger.log(logging.WARNING if over_budget else logging.INFO, json.dumps(line))
+        if over_budget and getattr(settings, 'LEDGER_SQL_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded('{} {} ran {} queries, its budget is {}'.format(
+                request.method, request.path, stats.count, budget))
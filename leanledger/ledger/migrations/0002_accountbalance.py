@@ -0,0 +1,49 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:30
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rollup_totals(own_totals, parents):
+    """Frozen copy of ``core.rollup_totals`` as of this migration."""
+    totals = {pk: Decimal('0') for pk in parents}
+    for pk, amount in own_totals.items():
+        while pk in totals:
+            totals[pk] += amount
+            pk = parents[pk]
+    return totals
+
+
+def populate_balances(apps, schema_editor):
+    Account = apps.get_model('ledger', 'Account')
+    AccountBalance = apps.get_model('ledger', 'AccountBalance')
+    Variation = apps.get_model('ledger', 'Variation')
+
+    parents = dict(Account.objects.values_list('pk', 'parent_id'))
+    own_totals = dict(Variation.objects.values_list('account').annotate(models.Sum('amount')))
+    totals = rollup_totals(own_totals, parents)
+    AccountBalance.objects.bulk_create(
+        AccountBalance(account_id=pk, own_total=own_totals.get(pk, Decimal('0')), total=total)
+        for pk, total in totals.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='ledger.Account')),
+                ('own_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0002_accountbalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['ledger', 'date', 'id'], name='record_ledger_date_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:38
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+def populate_imbalances(apps, schema_editor):
+    Record = apps.get_model('ledger', 'Record')
+    Variation = apps.get_model('ledger', 'Variation')
+
+    amount = models.DecimalField(max_digits=16, decimal_places=2)
+    debit_minus_credit = Case(
+        When(account__type='D', then=F('amount')), default=F('amount') * -1, output_field=amount)
+    imbalances = (
+        Variation.objects
+        .filter(record=OuterRef('pk'))
+        .order_by()
+        .values('record')
+        .annotate(imbalance=models.Sum(debit_minus_credit))
+        .values('imbalance')
+    )
+    Record.objects.update(
+        imbalance=Coalesce(Subquery(imbalances), Value(0), output_field=amount))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0003_record_ledger_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='imbalance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=16),
+        ),
+        migrations.RunPython(populate_imbalances, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(_negated=True, imbalance=0), fields=['ledger', 'date', 'id'], name='record_unbalanced_idx'),
+        ),
+    ]
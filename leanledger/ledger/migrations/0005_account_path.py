@@ -0,0 +1,46 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+def account_paths(parents):
+    """Frozen copy of ``core.account_paths`` as of this migration."""
+    paths = {}
+
+    def path(pk):
+        if pk not in paths:
+            parent_pk = parents[pk]
+            paths[pk] = '' if parent_pk is None else '{}{}/'.format(path(parent_pk), parent_pk)
+        return paths[pk]
+
+    for pk in parents:
+        path(pk)
+    return paths
+
+
+def populate_paths(apps, schema_editor):
+    Account = apps.get_model('ledger', 'Account')
+
+    paths = account_paths(dict(Account.objects.values_list('pk', 'parent_id')))
+    Account.objects.bulk_update(
+        [Account(pk=pk, path=path) for pk, path in paths.items()], ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0004_record_imbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['path'], name='account_path_idx'),
+        ),
+    ]
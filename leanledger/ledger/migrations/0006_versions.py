@@ -0,0 +1,34 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0005_account_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledger',
+            name='accounts_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ledger',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ledger',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
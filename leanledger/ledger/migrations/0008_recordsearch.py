@@ -0,0 +1,55 @@
+import sqlite3
+
+from django.db import migrations
+
+# Frozen copies of the table and documents of ``search.py`` as of this migration
+CREATE = (
+    "CREATE VIRTUAL TABLE ledger_recordsearch USING fts5(description, accounts, "
+    "ledger_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+INDEX = """
+    INSERT INTO ledger_recordsearch (rowid, description, accounts, ledger_id)
+    WITH RECURSIVE lineage(record_id, account_id) AS (
+        SELECT record_id, account_id FROM ledger_variation
+        UNION
+        SELECT lineage.record_id, account.parent_id
+        FROM lineage INNER JOIN ledger_account account ON account.id = lineage.account_id
+        WHERE account.parent_id IS NOT NULL
+    )
+    SELECT record.id, record.description, group_concat(DISTINCT account.name), record.ledger_id
+    FROM ledger_record record
+    LEFT JOIN lineage ON lineage.record_id = record.id
+    LEFT JOIN ledger_account account ON account.id = lineage.account_id
+    GROUP BY record.id
+"""
+
+
+def enabled(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    options = sqlite3.connect(':memory:').execute('PRAGMA compile_options').fetchall()
+    return ('ENABLE_FTS5',) in options
+
+
+def create_index(apps, schema_editor):
+    if enabled(schema_editor):
+        schema_editor.execute(CREATE)
+        schema_editor.execute(INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if enabled(schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS ledger_recordsearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0007_balancecheckpoint'),
+    ]
+
+    operations = [
+        # An FTS5 table on SQLite, nothing elsewhere, see leanledger/ledger/search.py
+        migrations.RunPython(create_index, drop_index),
+    ]
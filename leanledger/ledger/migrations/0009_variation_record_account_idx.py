@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0008_recordsearch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='variation',
+            name='record',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='variations', to='ledger.Record'),
+        ),
+        migrations.AddIndex(
+            model_name='variation',
+            index=models.Index(fields=['record', 'account'], name='variation_record_account_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The ledger and date of the record and the type (from the type of the account and the sign of
+# the amount) of every variation, see ``VariationManager.rebuild_denormalized``
+DENORMALIZE = """
+    UPDATE ledger_variation SET
+        ledger_id = (SELECT ledger_id FROM ledger_record WHERE id = ledger_variation.record_id),
+        date = (SELECT date FROM ledger_record WHERE id = ledger_variation.record_id),
+        direction = CASE
+            WHEN (ledger_variation.amount > 0) = ((
+                SELECT type FROM ledger_account WHERE id = ledger_variation.account_id
+            ) = 'D') THEN 'debit'
+            ELSE 'credit'
+        END
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0009_variation_record_account_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variation',
+            name='ledger',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ledger.Ledger'),
+        ),
+        migrations.AddField(
+            model_name='variation',
+            name='date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='variation',
+            name='direction',
+            field=models.CharField(choices=[('debit', 'Debit'), ('credit', 'Credit')], default='debit', editable=False, max_length=6),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(DENORMALIZE, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='variation',
+            name='ledger',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ledger.Ledger'),
+        ),
+        migrations.AlterField(
+            model_name='variation',
+            name='date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='variation',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='variations', to='ledger.Account'),
+        ),
+        migrations.AddIndex(
+            model_name='variation',
+            index=models.Index(fields=['account', 'date', 'id', 'amount'], name='variation_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variation',
+            index=models.Index(fields=['ledger', 'date', 'account', 'direction', 'amount'], name='variation_ledger_date_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+# Every stored amount, converted to integer cents before the columns become integers
+AMOUNTS = [
+    ('ledger_variation', 'amount'),
+    ('ledger_accountbalance', 'own_total'),
+    ('ledger_accountbalance', 'total'),
+    ('ledger_balancecheckpoint', 'own_total'),
+    ('ledger_record', 'imbalance'),
+]
+
+
+def to_cents(table, column):
+    return migrations.RunSQL(
+        'UPDATE {table} SET {column} = ROUND({column} * 100)'.format(table=table, column=column),
+        'UPDATE {table} SET {column} = {column} / 100.0'.format(table=table, column=column),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0010_variation_denormalized'),
+    ]
+
+    operations = [to_cents(table, column) for table, column in AMOUNTS] + [
+        migrations.AlterField(
+            model_name='variation',
+            name='amount',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='accountbalance',
+            name='own_total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='accountbalance',
+            name='total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='balancecheckpoint',
+            name='own_total',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='imbalance',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,17 +1,121 @@
-from decimal import Decimal
+from collections import Counter, defaultdict, namedtuple
+from datetime import timedelta
 from itertools import groupby
 
-from django.db import models
-from django.db.models.functions import Abs
+from django.db import connection, models, transaction
+from django.db.models import (
+    Case, F, OuterRef, Subquery, Value, When, prefetch_related_objects,
+)
+from django.db.models.functions import Abs, Coalesce, Concat, Substr
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 
-from .core import DEBIT, CREDIT, record_is_balanced
+from .balances import add_delta, deferred_balance_updates, move_record, touch_record
+from .core import (
+    DEBIT, CREDIT, account_paths, diff_variations, from_cents, json_amount, month_end, month_ends,
+    path_pks, path_range, record_imbalance, record_state_errors, rollup_totals, to_cents,
+)
+from .sqlite import write_transaction
+
+# What writing a record's new state changes, see ``Record.diff_state``
+StateDiff = namedtuple(
+    'StateDiff', ['update_fields', 'created', 'updated', 'deleted', 'variations'])
+
+
+def _last_pk(manager):
+    """
+    The greatest primary key ever allocated in the table of ``manager``. On SQLite it's read from
+    ``sqlite_sequence`` (Django's tables are ``AUTOINCREMENT``), so the keys of deleted rows are
+    never used again.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name = %s', [manager.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else 0
+    return manager.aggregate(models.Max('pk'))['pk__max'] or 0
+
+
+def bulk_create_with_pks(manager, objs):
+    """
+    ``bulk_create`` that sets the primary keys of ``objs`` also on databases that don't return
+    them (SQLite) by allocating them after the last one, so it must run in a transaction.
+    """
+    objs = list(objs)
+    if objs and not connection.features.can_return_ids_from_bulk_insert:
+        first_pk = _last_pk(manager) + 1
+        for pk, obj in enumerate(objs, first_pk):
+            obj.pk = pk
+    return manager.bulk_create(objs)
+
+
+def update_fields_except(instance, names):
+    """The fields an update of ``instance`` writes, except ``names``."""
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in names
+    ]
+
+
+def _range(field, low, high):
+    """Lookups of the values of ``field`` from ``low`` to ``high``, each only if not ``None``."""
+    lookups = {}
+    if low is not None:
+        lookups[field + '__gte'] = low
+    if high is not None:
+        lookups[field + '__lte'] = high
+    return lookups
+
+
+def _negate(amount):
+    return -amount if amount is not None else None
+
+
+class LedgerManager(models.Manager):
+    def bump_versions(self, ledger_pks=(), record_pks=(), accounts=False):
+        """
+        Increment the version of ``ledger_pks`` and of the ledgers of ``record_pks``, and also
+        their accounts version if ``accounts``, in one query.
+        """
+        if not ledger_pks and not record_pks:
+            return
+        condition = models.Q(pk__in=ledger_pks)
+        if record_pks:
+            condition |= models.Q(pk__in=Record.objects.filter(pk__in=record_pks).values('ledger'))
+        versions = {'version': F('version') + 1, 'modified': timezone.now()}
+        if accounts:
+            versions['accounts_version'] = F('accounts_version') + 1
+        self.filter(condition).update(**versions)
 
 
 class Ledger(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=64)
+    # ``version`` is incremented by every write to the ledger and its accounts, records and
+    # variations (see ``balances.py``), ``accounts_version`` by every write to its accounts. They
+    # are only ever incremented in the database, with ``bump_versions``.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    accounts_version = models.PositiveIntegerField(default=1, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+
+    VERSION_FIELDS = ('version', 'accounts_version', 'modified')
+
+    objects = LedgerManager()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        kwargs.setdefault('update_fields', update_fields_except(self, self.VERSION_FIELDS))
+        with write_transaction():
+            super().save(*args, **kwargs)
+            Ledger.objects.bump_versions([self.pk])
+
+    def delete(self, *args, **kwargs):
+        # The cascade to accounts, records and variations reads before it writes
+        with write_transaction():
+            return super().delete(*args, **kwargs)
 
 
 class AccountManager(models.Manager):
@@ -22,7 +126,71 @@ class AccountManager(models.Manager):
         return self.filter(parent=None, type=Account.ORIGIN, ledger=ledger_pk)
 
     def all_as_dict(self, ledger_pk):
-        return [account.as_dict() for account in self.filter(ledger=ledger_pk)]
+        return [account.as_dict() for account in self.tree(ledger_pk).values()]
+
+    def tree(self, ledger_pk):
+        """
+        Load all the accounts of a ledger with their balances in one query and link them in
+        memory: ``parent`` is set and ``subaccounts`` lists the children, so walking the tree
+        doesn't hit the database again. Returns ``{account_pk: account}``.
+        """
+        accounts = {
+            account.pk: account
+            for account in self.filter(ledger=ledger_pk).select_related('balance').order_by('pk')
+        }
+        for account in accounts.values():
+            account.subaccounts = []
+        for account in accounts.values():
+            if account.parent_id is not None:
+                account.parent = accounts[account.parent_id]
+                account.parent.subaccounts.append(account)
+        return accounts
+
+    def ancestry(self, account_pks):
+        """
+        Return ``{account_pk: parent_pk}`` for ``account_pks`` and all their ancestors, read from
+        their paths in one query.
+        """
+        parents = {}
+        for pk, path in self.filter(pk__in=account_pks).values_list('pk', 'path'):
+            lineage = path_pks(path) + [pk]
+            parents.update(zip(lineage, [None] + lineage[:-1]))
+        return parents
+
+    def descendants(self, account):
+        """All the accounts under ``account``, as a range on the ``path`` index."""
+        return self.filter(**path_range(account.children_path))
+
+    def children_path(self, account_pk):
+        """The path of the children of ``account_pk`` (of root accounts if ``None``)."""
+        if account_pk is None:
+            return ''
+        path = self.filter(pk=account_pk).values_list('path', flat=True).get()
+        return '{}{}/'.format(path, account_pk)
+
+    def move_descendants(self, old_path, new_path):
+        """Replace the start of the paths that start with ``old_path`` with ``new_path``."""
+        self.filter(**path_range(old_path)).update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1)))
+
+    def rebuild_paths(self, ledger_pk=None):
+        accounts = self.all() if ledger_pk is None else self.filter(ledger=ledger_pk)
+        parents = dict(accounts.values_list('pk', 'parent_id'))
+        self.bulk_update(
+            [Account(pk=pk, path=path) for pk, path in account_paths(parents).items()],
+            ['path'],
+            batch_size=500,
+        )
+        return len(parents)
+
+    def verify_paths(self, ledger_pk=None):
+        """Return ``(account_pk, expected, stored)`` for every account with a wrong path."""
+        accounts = self.all() if ledger_pk is None else self.filter(ledger=ledger_pk)
+        stored = dict(accounts.values_list('pk', 'path'))
+        expected = account_paths(dict(accounts.values_list('pk', 'parent_id')))
+        return [
+            (pk, path, stored[pk]) for pk, path in sorted(expected.items()) if stored[pk] != path
+        ]
 
 
 class Account(models.Model):
@@ -37,30 +205,93 @@ class Account(models.Model):
     ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='accounts')
     parent = models.ForeignKey(
         'self', null=True, on_delete=models.CASCADE, related_name='children')
+    # Primary keys of the ancestors from the root, see ``core.account_paths``. Set by ``save``
+    # and moved along with the account by the ``post_save`` signal.
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     objects = AccountManager()
 
+    class Meta:
+        indexes = [
+            # Descendants, see ``AccountManager.descendants``
+            models.Index(fields=['path'], name='account_path_idx'),
+        ]
+
     # TODO enforce uniqueness of: name + parent
     # TODO enforce: children must be the same type as parent
     # TODO enforce: accounts with children don't have own variations
     #      - When adding children, move existing variations to a default "other" child account
 
+    # ``parent_id``, ``path``, ``name`` and ``type`` as last written to the database
+    _stored_parent_id = None
+    _stored_path = ''
+    _stored_name = None
+    _stored_type = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        account = super().from_db(db, field_names, values)
+        account._stored_parent_id = account.parent_id
+        account._stored_path = account.path
+        account._stored_name = account.name
+        account._stored_type = account.type
+        return account
+
+    def save(self, *args, **kwargs):
+        # The path is read from the parent on every save, an ancestor may have moved since this
+        # instance was loaded. Descendants are moved from ``post_save``, in the same transaction.
+        with write_transaction():
+            self.path = Account.objects.children_path(self.parent_id)
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Balances and versions are updated from ``post_delete``, in the same transaction
+        with write_transaction():
+            return super().delete(*args, **kwargs)
+
+    @property
+    def children_path(self):
+        return '{}{}/'.format(self.path, self.pk)
+
+    def subtree(self):
+        """The account and its descendants, from an account loaded by ``AccountManager.tree``."""
+        yield self
+        for subaccount in self.subaccounts:
+            yield from subaccount.subtree()
+
     @property
     def total(self):
-        if self.children.exists():
-            return sum(child.total for child in self.children.all())
-        else:
-            return self.variations.total if self.variations.total is not None else Decimal('0')
+        try:
+            return self.balance.total
+        except AccountBalance.DoesNotExist:
+            return 0
+
+    @property
+    def own_total(self):
+        """Total of the account's own variations, without its subaccounts'."""
+        try:
+            return self.balance.own_total
+        except AccountBalance.DoesNotExist:
+            return 0
+
+    def balance_as_of(self, date):
+        """Total of the account and its subaccounts at the end of ``date``."""
+        return BalanceCheckpoint.objects.balance_as_of(self, date)
 
     def get_breadcrumbs(self):
-        return self.parent.get_breadcrumbs() + (self,) if self.parent else (self,)
+        if self.parent_id is None:
+            return (self,)
+        if Account.parent.is_cached(self):
+            return self.parent.get_breadcrumbs() + (self,)
+        ancestors = Account.objects.in_bulk(path_pks(self.path))
+        return tuple(ancestors[pk] for pk in path_pks(self.path)) + (self,)
 
     @property
     def full_name(self):
         return ' / '.join(account.name for account in self.get_breadcrumbs())
 
     def get_absolute_url(self):
-        return reverse("account_detail", args=[self.ledger.pk, self.pk])
+        return reverse("account_detail", args=[self.ledger_id, self.pk])
 
     def as_dict(self):
         return {
@@ -72,25 +303,453 @@ class Account(models.Model):
         }
 
     def __str__(self):
-        return '{}: {} ({})'.format(self.type, self.name, self.total)
+        return '{}: {} ({})'.format(self.type, self.name, from_cents(self.total))
+
+
+class AccountBalanceManager(models.Manager):
+    def apply_deltas(self, deltas):
+        """
+        Add ``deltas`` (``{account_pk: amount}``) to the own balance of each account and to the
+        subtree balance of each account and all its ancestors.
+        """
+        deltas = {pk: amount for pk, amount in deltas.items() if amount}
+        if not deltas:
+            return
+        self._increment('own_total', deltas)
+        self._increment('total', rollup_totals(deltas, Account.objects.ancestry(deltas)))
+
+    def move_subtree(self, account, old_parent_pk):
+        """Move the balance of ``account`` from its old ancestors to its current ones."""
+        total = self.filter(account=account).values_list('total', flat=True).first()
+        if not total:
+            return
+        deltas = {old_parent_pk: -total, account.parent_id: total}
+        deltas.pop(None, None)
+        self._increment('total', rollup_totals(deltas, Account.objects.ancestry(deltas)))
+
+    def _increment(self, field, deltas):
+        deltas = {pk: amount for pk, amount in deltas.items() if amount}
+        if not deltas:
+            return
+        increment = Case(
+            *[When(account=pk, then=Value(amount)) for pk, amount in deltas.items()],
+            output_field=self.model._meta.get_field(field),
+        )
+        self.filter(account__in=deltas).update(**{field: F(field) + increment})
+
+    def expected(self, ledger_pk=None):
+        """
+        Compute ``{account_pk: (own_total, total)}`` from the variations, with one aggregate query.
+        """
+        accounts = Account.objects.all()
+        variations = Variation.objects.all()
+        if ledger_pk is not None:
+            accounts = accounts.filter(ledger=ledger_pk)
+            variations = variations.filter(ledger=ledger_pk)
+        parents = dict(accounts.values_list('pk', 'parent_id'))
+        own_totals = dict(variations.values_list('account').annotate(models.Sum('amount')))
+        totals = rollup_totals(own_totals, parents)
+        return {pk: (own_totals.get(pk, 0), totals[pk]) for pk in parents}
+
+    def rebuild(self, ledger_pk=None):
+        expected = self.expected(ledger_pk)
+        balances = self.all() if ledger_pk is None else self.filter(account__ledger=ledger_pk)
+        with transaction.atomic():
+            balances.delete()
+            self.bulk_create(
+                AccountBalance(account_id=pk, own_total=own_total, total=total)
+                for pk, (own_total, total) in expected.items()
+            )
+        return len(expected)
+
+    def verify(self, ledger_pk=None):
+        """
+        Return ``(account_pk, expected, stored)`` for every account whose stored balance doesn't
+        match its variations. ``stored`` is ``None`` if the account has no balance row.
+        """
+        balances = self.all() if ledger_pk is None else self.filter(account__ledger=ledger_pk)
+        stored = {
+            pk: (own_total, total)
+            for pk, own_total, total in balances.values_list('account', 'own_total', 'total')
+        }
+        return [
+            (pk, values, stored.get(pk))
+            for pk, values in sorted(self.expected(ledger_pk).items())
+            if stored.get(pk) != values
+        ]
+
+
+class AccountBalance(models.Model):
+    """
+    Stored balance of an account, kept up to date by every variation write path:
+    ``own_total`` is the sum of the account's own variations and ``total`` also includes all its
+    descendants, in cents like the amounts.
+    """
+    account = models.OneToOneField(
+        Account, primary_key=True, on_delete=models.CASCADE, related_name='balance')
+    own_total = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+
+    objects = AccountBalanceManager()
+
+
+class BalanceCheckpointManager(models.Manager):
+    def latest(self, accounts, date):
+        """
+        Return ``{account_pk: (date, own_total)}`` with the latest checkpoint of each of
+        ``accounts`` (a queryset) on or before ``date``, ``(None, 0)`` if there's none, in one
+        query.
+        """
+        checkpoints = self.filter(account=OuterRef('pk'), date__lte=date).order_by('-date')
+        rows = accounts.order_by().annotate(
+            checkpoint_date=Subquery(checkpoints.values('date')[:1]),
+            checkpoint_total=Subquery(checkpoints.values('own_total')[:1]),
+        ).values_list('pk', 'checkpoint_date', 'checkpoint_total')
+        return {pk: (date, total if total is not None else 0) for pk, date, total in rows}
+
+    def _closing_balances(self, accounts, latest, last):
+        """
+        Checkpoints of ``accounts`` for the end of every month after the ones in ``latest`` (as
+        returned by ``latest``), or from the first variation of accounts without one, until
+        ``last``.
+        """
+        if not latest:
+            return []
+        conditions = models.Q()
+        without = [pk for pk, (date, _) in latest.items() if date is None]
+        if without:
+            conditions |= models.Q(account__in=without)
+        after = {date for date, _ in latest.values() if date is not None}
+        if after:
+            conditions |= models.Q(
+                account__in=[pk for pk, (date, _) in latest.items() if date is not None],
+                date__gt=min(after),
+            )
+        # Ranges of the variations' account and date index, which has the amounts
+        rows = (
+            Variation.objects.filter(conditions, date__lte=last)
+            .order_by()
+            .values_list('account', 'date').annotate(models.Sum('amount'))
+        )
+
+        monthly = defaultdict(lambda: defaultdict(int))
+        for account_pk, date, amount in rows:
+            if latest[account_pk][0] is None or date > latest[account_pk][0]:
+                monthly[account_pk][month_end(date)] += amount
+
+        checkpoints = []
+        for account_pk, (date, own_total) in latest.items():
+            amounts = monthly.get(account_pk, {})
+            if date is None and not amounts:
+                continue
+            first = date + timedelta(days=1) if date is not None else min(amounts)
+            for month in month_ends(first, last):
+                own_total += amounts.get(month, 0)
+                checkpoints.append(
+                    BalanceCheckpoint(account_id=account_pk, date=month, own_total=own_total))
+        return checkpoints
+
+    def build(self, accounts, until=None):
+        """
+        Create the missing checkpoints of ``accounts`` (a queryset), after their latest one, for
+        every month that ended before ``until`` (today by default). Returns how many.
+        """
+        until = until or timezone.localdate()
+        last = until.replace(day=1) - timedelta(days=1)
+        checkpoints = self._closing_balances(accounts, self.latest(accounts, last), last)
+        self.bulk_create(checkpoints, batch_size=500)
+        return len(checkpoints)
+
+    def invalidate(self, changes, moved):
+        """
+        Delete the checkpoints made stale by a write and build them again. ``changes``
+        (``{(account_pk, record_pk)}``) are the accounts of the variations written and their
+        records, ``moved`` (``{record_pk: date}``) the earlier dates of records that changed date
+        or are deleted. Checkpoints are stale from the earliest date of those records on.
+        """
+        if not changes and not moved:
+            return
+        record_pks = {record_pk for _, record_pk in changes} | set(moved)
+        first_date = Record.objects.filter(pk__in=record_pks).order_by('date').values('date')[:1]
+        since = models.Q(date__gte=Subquery(first_date))
+        accounts = models.Q(pk__in={account_pk for account_pk, _ in changes})
+        if moved:
+            since |= models.Q(date__gte=min(moved.values()))
+            accounts |= models.Q(
+                pk__in=Variation.objects.filter(record__in=moved).values('account'))
+        stale = Account.objects.filter(accounts)
+        if self.filter(since, account__in=stale).delete()[0]:
+            self.build(stale)
+
+    def balance_as_of(self, account, date):
+        """
+        Total of ``account`` and its descendants at the end of ``date``: the latest checkpoint
+        of each one plus the variations after it, with one query per distinct checkpoint date
+        (just one when the checkpoints are up to date).
+        """
+        accounts = Account.objects.filter(
+            models.Q(pk=account.pk) | models.Q(**path_range(account.children_path)))
+        latest = self.latest(accounts, date)
+        total = sum(own_total for _, own_total in latest.values())
+
+        by_date = defaultdict(list)
+        for pk, (checkpoint_date, _) in latest.items():
+            by_date[checkpoint_date].append(pk)
+        for checkpoint_date, account_pks in by_date.items():
+            variations = Variation.objects.filter(account__in=account_pks, date__lte=date)
+            if checkpoint_date is not None:
+                # Ranges of the variations' account and date index, only after the checkpoint
+                variations = variations.filter(date__gt=checkpoint_date)
+            amount = variations.aggregate(models.Sum('amount'))['amount__sum']
+            if amount is not None:
+                total += amount
+        return total
+
+    def rebuild(self, ledger_pk=None, until=None):
+        accounts = Account.objects.all() if ledger_pk is None else Account.objects.filter(
+            ledger=ledger_pk)
+        with transaction.atomic():
+            self.filter(account__in=accounts).delete()
+            return self.build(accounts, until)
+
+    def verify(self, ledger_pk=None, until=None):
+        """
+        Return ``(account_pk, date, expected, stored)`` for every stored checkpoint that doesn't
+        match the variations before it (``expected`` is ``None`` if it shouldn't exist).
+        """
+        accounts = Account.objects.all() if ledger_pk is None else Account.objects.filter(
+            ledger=ledger_pk)
+        checkpoints = self.filter(account__in=accounts)
+        last = checkpoints.aggregate(models.Max('date'))['date__max']
+        if last is None:
+            return []
+        from_scratch = {pk: (None, 0) for pk in accounts.values_list('pk', flat=True)}
+        expected = {
+            (checkpoint.account_id, checkpoint.date): checkpoint.own_total
+            for checkpoint in self._closing_balances(accounts, from_scratch, last)
+        }
+        return [
+            (account_pk, date, expected.get((account_pk, date)), own_total)
+            for account_pk, date, own_total in checkpoints.order_by('account', 'date')
+            .values_list('account', 'date', 'own_total')
+            if expected.get((account_pk, date)) != own_total
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Own total of an account at the end of a month (``date`` is its last day). Every account
+    has one for every month from its first variation until the last month checkpoints were
+    built for (see ``BalanceCheckpointManager.build``): stale ones are deleted and built again
+    by the variation and record write paths, missing ones only make ``balance_as_of`` slower.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='checkpoints')
+    date = models.DateField()
+    own_total = models.BigIntegerField()
+
+    objects = BalanceCheckpointManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='checkpoint_account_date'),
+        ]
+
+
+def debit_minus_credit():
+    """Expression of the amount of a variation, positive if it's a debit."""
+    return Case(
+        When(direction=DEBIT, then=Abs('amount')),
+        default=Abs('amount') * -1,
+        output_field=models.BigIntegerField(),
+    )
 
 
 class RecordManager(models.Manager):
     def variations_by_type(self):
         return [record.variations_by_type() for record in self.all()]
 
+    def unbalanced(self, ledger_pk):
+        return self.filter(ledger=ledger_pk).exclude(imbalance=0)
+
+    def _expected_imbalance(self):
+        imbalances = (
+            Variation.objects
+            .filter(record=OuterRef('pk'))
+            .order_by()
+            .values('record')
+            .annotate(imbalance=models.Sum(debit_minus_credit()))
+            .values('imbalance')
+        )
+        return Coalesce(
+            Subquery(imbalances), Value(0), output_field=self.model._meta.get_field('imbalance'))
+
+    def refresh(self, record_pks):
+        """
+        Recompute the stored imbalance of ``record_pks`` and set their version to the one their
+        ledger gets from this write (its version is incremented in the same write, see
+        ``balances._write``). Versions only grow within a ledger, so a record never gets a
+        version a deleted record with the same primary key had.
+        """
+        if record_pks:
+            self.refresh_records(self.filter(pk__in=record_pks))
+
+    def refresh_records(self, records):
+        """``refresh`` the records of the queryset ``records``, in one query."""
+        ledger_versions = Ledger.objects.filter(pk=OuterRef('ledger')).values('version')
+        return records.update(
+            imbalance=self._expected_imbalance(), version=Subquery(ledger_versions) + 1)
+
+    def rebuild_imbalances(self, ledger_pk=None):
+        """``refresh`` all the records (of the ledger)."""
+        records = self.all() if ledger_pk is None else self.filter(ledger=ledger_pk)
+        return self.refresh_records(records)
+
+    def verify_imbalances(self, ledger_pk=None):
+        """Return ``(record_pk, expected, stored)`` for every record with a wrong imbalance."""
+        records = self.all() if ledger_pk is None else self.filter(ledger=ledger_pk)
+        return list(
+            records.annotate(expected=self._expected_imbalance())
+            .exclude(imbalance=F('expected'))
+            .order_by('pk')
+            .values_list('pk', 'expected', 'imbalance')
+        )
+
+    def with_variations(self, records, ledger_pk, accounts=None):
+        """
+        Fetch the variations of ``records`` in one query and link them to the ledger's accounts
+        (``accounts``, or loaded with ``Account.objects.tree``), so that ``variations_by_type``,
+        ``is_balanced`` and ``as_dict`` don't hit the database. Returns ``records`` as a list.
+        """
+        records = list(records)
+        prefetch_related_objects(records, 'variations')
+        if accounts is None:
+            accounts = Account.objects.tree(ledger_pk)
+        for record in records:
+            for variation in record.variations.all():
+                variation.account = accounts[variation.account_id]
+        return records
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """``bulk_update`` that reports the written records, like ``save`` does."""
+        objs = list(objs)
+        if not objs:
+            return
+        with deferred_balance_updates():
+            super().bulk_update(objs, fields, *args, **kwargs)
+            if 'date' in fields:
+                Variation.objects.redate(
+                    [record.pk for record in objs if record._stored_date != record.date])
+            for record in objs:
+                if 'date' in fields and record._stored_date not in (None, record.date):
+                    move_record(record.pk, record._stored_date)
+                touch_record(record.pk)
+                record._stored_date = record.date
+
+    def update_from_dicts(self, ledger_pk, states):
+        """
+        Apply ``states``, a list of what ``Record.update_from_dict`` takes (with the record's
+        ``id``), to records of the ledger, all of them or none: every state is validated before
+        anything is written, and then records and variations are written in one transaction, with
+        the same queries however many records there are.
+
+        Returns ``(records, errors)``: the updated records, in the order of ``states``, with their
+        variations cached, and ``{index: [error]}`` for the invalid states, in which case nothing
+        was written.
+        """
+        accounts = Account.objects.tree(ledger_pk)
+        ids = [state.get('id') if isinstance(state, dict) else None for state in states]
+        n_ids = Counter(pk for pk in ids if isinstance(pk, int))
+        # What the states are applied to is read in the transaction that writes them
+        with deferred_balance_updates():
+            records = self.filter(ledger=ledger_pk).in_bulk(list(n_ids))
+            errors = {}
+            for index, (pk, state) in enumerate(zip(ids, states)):
+                state_errors = record_state_errors(state, accounts)
+                if not isinstance(pk, int) or pk not in records:
+                    state_errors.insert(0, 'Unknown record: {!r}'.format(pk))
+                elif n_ids[pk] > 1:
+                    state_errors.insert(0, 'Record {} is in more than one state'.format(pk))
+                if state_errors:
+                    errors[index] = state_errors
+            if errors:
+                return [], errors
+
+            records = self.with_variations([records[pk] for pk in ids], ledger_pk, accounts)
+            changed, created, updated, deleted, variations = [], [], [], [], []
+            for record, state in zip(records, states):
+                diff = record.diff_state(state, accounts)
+                if diff.update_fields:
+                    changed.append(record)
+                created += diff.created
+                updated += diff.updated
+                deleted += diff.deleted
+                variations.append(diff.variations)
+
+            self.bulk_update(changed, ['date', 'description'])
+            bulk_create_with_pks(Variation.objects, created)
+            Variation.objects.bulk_update(updated, ['account', 'amount'])
+            if deleted:
+                Variation.objects.filter(pk__in=[v.pk for v in deleted]).delete()
+
+        for record, record_variations in zip(records, variations):
+            record.set_variations(record_variations)
+            record.imbalance = record_imbalance(record)
+        return records, {}
+
 
 class Record(models.Model):
     ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='records')
     date = models.DateField()
     description = models.CharField(max_length=128, blank=True)
+    # Debit minus credit (in cents), and the version of the ledger after the last write to the
+    # record and its variations. Both are kept up to date by the write paths, see ``balances.py``.
+    imbalance = models.BigIntegerField(default=0)
+    version = models.PositiveIntegerField(default=1, editable=False)
     # TODO on_delete=CASCASDE when Accounts are deleted
 
+    STORED_FIELDS = ('imbalance', 'version')
+
     objects = RecordManager()
 
+    # ``date`` as last written to the database
+    _stored_date = None
+
+    class Meta:
+        indexes = [
+            # Keyset pagination, see ``pagination.py``
+            models.Index(fields=['ledger', 'date', 'id'], name='record_ledger_date_idx'),
+            models.Index(
+                fields=['ledger', 'date', 'id'],
+                name='record_unbalanced_idx',
+                condition=~models.Q(imbalance=0),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        record = super().from_db(db, field_names, values)
+        record._stored_date = record.__dict__.get('date')
+        return record
+
+    def save(self, *args, **kwargs):
+        # The stored fields are only written by ``RecordManager.refresh``
+        if not self._state.adding:
+            kwargs.setdefault('update_fields', update_fields_except(self, self.STORED_FIELDS))
+        if kwargs.get('update_fields') == []:
+            return  # Nothing to write, like ``Model.save``
+        # The date is copied to the variations from ``post_save``, in the same transaction
+        with write_transaction():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Balances and versions are updated from ``post_delete``, in the same transaction
+        with write_transaction():
+            return super().delete(*args, **kwargs)
+
     def variations_by_type(self):
         get_type = lambda variation: variation.type
-        variations = list(self.variations.all().order_by(Abs("amount").desc(), "pk"))
+        # Sorted in Python so prefetched variations are used
+        variations = sorted(self.variations.all(), key=lambda v: (-abs(v.amount), v.pk))
         variations.sort(key=get_type)
         grouped = groupby(variations, get_type)
         return {type_: list(variations) for type_, variations in grouped}
@@ -103,16 +762,29 @@ class Record(models.Model):
             "date": self.date.strftime("%Y-%m-%d"),
             "description": self.description,
             "variations": {
-                "debit": [variation.as_dict() for variation in variations[Variation.DEBIT]],
-                "credit": [variation.as_dict() for variation in variations[Variation.CREDIT]],
+                "debit": [v.as_dict() for v in variations.get(Variation.DEBIT, [])],
+                "credit": [v.as_dict() for v in variations.get(Variation.CREDIT, [])],
             },
         }
 
-    def update_from_dict(self, new_record_state):
-        # TODO move to serializer
+    def set_variations(self, variations):
+        """Cache ``variations`` as ``self.variations.all()``, like ``prefetch_related`` does."""
+        prefetched = self.__dict__.setdefault('_prefetched_objects_cache', {})
+        prefetched.pop('variations', None)
+        queryset = self.variations.get_queryset()
+        queryset._result_cache, queryset._prefetch_done = list(variations), True
+        for variation in queryset._result_cache:
+            variation.record = self
+        prefetched['variations'] = queryset
 
-        # Update record
-        new_date, new_description = new_record_state["date"], new_record_state["description"]
+    def diff_state(self, new_record_state, accounts):
+        """
+        Set the date and description of a record's new state on it and match the state's
+        variations with its variations, which should be cached (``set_variations``). Nothing is
+        written: returns a ``StateDiff`` of what has to be.
+        """
+        new_date = self._meta.get_field("date").to_python(new_record_state["date"])
+        new_description = new_record_state["description"]
         update_fields = []
         if new_date != self.date:
             self.date = new_date
@@ -122,93 +794,313 @@ class Record(models.Model):
             self.description = new_description
             update_fields.append("description")
 
-        self.save(update_fields=update_fields)
-        self.refresh_from_db()
+        to_create, to_update, to_delete = diff_variations(
+            self.variations_by_type(), new_record_state["variations"])
+        created = [
+            Variation.from_dict(variation_dict, type_, self, accounts)
+            for type_, variation_dict in to_create
+        ]
+        updated = [
+            variation for variation, type_, variation_dict in to_update
+            if variation.update_from_dict(variation_dict, type_, accounts, commit=False)
+        ]
+        kept = [variation for variation, _, _ in to_update]
+        return StateDiff(update_fields, created, updated, to_delete, kept + created)
 
-        variations_from_state = new_record_state["variations"]
-        existing_variations = self.variations_by_type()
+    def update_from_dict(self, new_record_state):
+        """
+        Apply the state of a record, as sent by the front-end, in one transaction: all the
+        referenced accounts are fetched at once and variations are created, updated and deleted
+        with one query each. The new variations are cached, so ``as_dict`` doesn't query them.
+        """
+        # TODO move to serializer
+        variations_state = new_record_state["variations"]
+        account_pks = {
+            variation["account_id"]
+            for variations in variations_state.values() for variation in variations
+        }
+        accounts = Account.objects.filter(ledger=self.ledger_id).in_bulk(account_pks)
+        if len(accounts) != len(account_pks):
+            raise Account.DoesNotExist(
+                'Unknown accounts: {}'.format(sorted(account_pks - set(accounts))))
 
-        Variation.objects.create_variations_from_dict(
-            self, existing_variations, variations_from_state
-        )
-        Variation.objects.update_variations_from_dict(existing_variations, variations_from_state)
-        Variation.objects.delete_variations_from_dict(existing_variations, variations_from_state)
+        with deferred_balance_updates():
+            self.set_variations(self.variations.select_related("account"))
+            diff = self.diff_state(new_record_state, accounts)
+            self.save(update_fields=diff.update_fields)
+            bulk_create_with_pks(Variation.objects, diff.created)
+            Variation.objects.bulk_update(diff.updated, ["account", "amount"])
+            if diff.deleted:
+                Variation.objects.filter(pk__in=[v.pk for v in diff.deleted]).delete()
 
+        self.set_variations(diff.variations)
+        self.imbalance = record_imbalance(self)
         return self
 
-    is_balanced = record_is_balanced
+    def is_balanced(self):
+        return self.imbalance == 0
 
 
 class VariationManager(models.Manager):
     @property
     def total(self):
-        amount_sum = self.all().aggregate(models.Sum('amount'))['amount__sum']
-        return amount_sum.quantize(Decimal('0.01')) if amount_sum is not None else None
-
-    def create_variations_from_dict(self, record, existing_variations, variations_state):
-        """
-        ids in ``variations_state` are generated in the front-end by increasing in one the max
-        existing id within a variation type in a record. So there is no risk of generating an
-        existing id.
-        """
-        to_create = []
-        for variation_type, variations in variations_state.items():
-            existing_variations_pks = [v.pk for v in existing_variations[variation_type]]
-            to_create += [
-                Variation.from_dict(variation, variation_type, record)
-                for variation in variations if variation["id"] not in existing_variations_pks
-            ]
-
-        Variation.objects.bulk_create(to_create)
-
-    def update_variations_from_dict(self, existing_variations, variations_state):
-        for variation_type, variations in existing_variations.items():
-            for variation in variations:
-                variation_state = [
-                    v for v in variations_state[variation_type] if v["id"] == variation.pk
-                ]
-                if variation_state:
-                    variation.update_from_dict(variation_state[0], variation_type)
-
-    def delete_variations_from_dict(self, existing_variations, variations_state):
-        to_delete = []
-        for variation_type, variations in existing_variations.items():
-            pks_from_state = [v["id"] for v in variations_state[variation_type]]
-            for variation in [v for v in variations if v.pk not in pks_from_state]:
-                variation.delete()
+        return self.all().aggregate(models.Sum('amount'))['amount__sum']
+
+    def matching(self, ledger_pk, accounts=None, start=None, end=None, min_amount=None,
+                 max_amount=None, direction=None):
+        """
+        Variations of the ledger on ``accounts`` (e.g. a subtree from the tree loaded by
+        ``Account.objects.tree``, all the ledger's if ``None``), dated from ``start`` to
+        ``end``, whose amount is from ``min_amount`` to ``max_amount`` (in cents) and whose type
+        is ``direction`` (``DEBIT`` or ``CREDIT``), each only if given. Amounts are compared in
+        absolute value, like records show them.
+
+        Every condition is on a column of the ledger and date index of variations, which is
+        read newest first: a page is read from the index without sorting the matches and
+        without reading records.
+        """
+        variations = self.filter(ledger=ledger_pk, **_range('date', start, end))
+        if accounts is not None:
+            account_pks = [account.pk for account in accounts]
+            if not account_pks:
+                return self.none()
+            variations = variations.filter(account__in=account_pks)
+        if direction is not None:
+            variations = variations.filter(direction=direction)
+        if min_amount is not None or max_amount is not None:
+            variations = variations.filter(
+                models.Q(amount__gt=0, **_range('amount', min_amount, max_amount))
+                | models.Q(
+                    amount__lt=0, **_range('amount', _negate(max_amount), _negate(min_amount))))
+        return variations
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if not objs:
+            return objs
+        for variation in objs:
+            variation.denormalize()
+        with deferred_balance_updates():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            for variation in objs:
+                variation.report_balance_change()
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if not objs:
+            return
+        for variation in objs:
+            denormalized = variation.denormalize(fields)
+        with deferred_balance_updates():
+            super().bulk_update(objs, list(fields) + denormalized, *args, **kwargs)
+            for variation in objs:
+                variation.report_balance_change(fields)
+
+    def redate(self, record_pks):
+        """Copy the date of ``record_pks`` to their variations, in one query."""
+        if record_pks:
+            dates = Record.objects.filter(pk=OuterRef('record')).values('date')
+            self.filter(record__in=record_pks).update(date=Subquery(dates))
+
+    def redirect(self, account):
+        """
+        Set the direction of the variations of ``account`` again after its type changed, and the
+        imbalance and version of their records (the version of the ledger must be incremented in
+        the same write).
+        """
+        self.filter(account=account).update(direction=Case(
+            When(amount__gt=0, then=Value(self.model.direction_of(account.type, 1))),
+            default=Value(self.model.direction_of(account.type, 0)),
+        ))
+        Record.objects.refresh_records(Record.objects.filter(variations__account=account))
+
+    def rebuild_denormalized(self, ledger_pk=None):
+        """Set the denormalized fields of all the variations (of the ledger) again."""
+        variations = self.all() if ledger_pk is None else self.filter(record__ledger=ledger_pk)
+        records = Record.objects.filter(pk=OuterRef('record'))
+        destinations = Account.objects.filter(type=Account.DESTINATION).values('pk')
+        origins = Account.objects.filter(type=Account.ORIGIN).values('pk')
+        return variations.update(
+            ledger=Subquery(records.values('ledger')),
+            date=Subquery(records.values('date')),
+            direction=Case(
+                When(amount__gt=0, account__in=destinations, then=Value(DEBIT)),
+                When(amount__lte=0, account__in=origins, then=Value(DEBIT)),
+                default=Value(CREDIT),
+            ),
+        )
+
+    def verify_denormalized(self, ledger_pk=None):
+        """
+        Return ``(variation_pk, expected, stored)`` for every variation with a wrong ledger, date
+        or direction, as tuples of the three.
+        """
+        variations = self.all() if ledger_pk is None else self.filter(record__ledger=ledger_pk)
+        increase = models.Q(amount__gt=0)
+        rows = (
+            variations.annotate(
+                expected_ledger=F('record__ledger'),
+                expected_date=F('record__date'),
+                expected_direction=Case(
+                    When(increase & models.Q(account__type=Account.DESTINATION), then=Value(DEBIT)),
+                    When(~increase & models.Q(account__type=Account.ORIGIN), then=Value(DEBIT)),
+                    default=Value(CREDIT),
+                    output_field=self.model._meta.get_field('direction'),
+                ),
+            )
+            .exclude(
+                ledger=F('expected_ledger'), date=F('expected_date'),
+                direction=F('expected_direction'))
+            .order_by('pk')
+            .values_list(
+                'pk', 'expected_ledger', 'expected_date', 'expected_direction', 'ledger', 'date',
+                'direction')
+        )
+        return [(row[0], row[1:4], row[4:]) for row in rows]
 
 
 class Variation(models.Model):
-    record = models.ForeignKey(Record, on_delete=models.CASCADE, related_name='variations')
-    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='variations')
-    amount = models.DecimalField(max_digits=16, decimal_places=2)  # TODO cannot be 0
+    # Indexed along with the account, see ``Meta.indexes``
+    record = models.ForeignKey(
+        Record, on_delete=models.CASCADE, related_name='variations', db_index=False)
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name='variations', db_index=False)
+    # In cents, like every stored amount: they are added up as integers, and only converted to
+    # decimals (``core.from_cents``) to be shown
+    amount = models.BigIntegerField()  # TODO cannot be 0
+    # The ledger and date of the record, and the type of the variation (from the type of the
+    # account and the sign of the amount), so that aggregates by ledger, date and type read this
+    # table only, from its covering indexes. Set by ``denormalize``, which the write paths call,
+    # and copied again by ``VariationManager.redate`` when records change date.
+    ledger = models.ForeignKey(
+        Ledger, on_delete=models.CASCADE, related_name='+', db_index=False, editable=False)
+    date = models.DateField(editable=False)
+    direction = models.CharField(
+        max_length=6, choices=((DEBIT, 'Debit'), (CREDIT, 'Credit')), editable=False)
 
     DEBIT = DEBIT
     CREDIT = CREDIT
 
     objects = VariationManager()
 
+    class Meta:
+        indexes = [
+            # The variations of a record, and those on given accounts without reading the
+            # others
+            models.Index(fields=['record', 'account'], name='variation_record_account_idx'),
+            # Statements (keyset pagination on the date and primary key) and balances of
+            # accounts, see ``pagination.statement_page`` and ``BalanceCheckpointManager``
+            models.Index(
+                fields=['account', 'date', 'id', 'amount'], name='variation_account_date_idx'),
+            # Reports and filters of a ledger by date, see ``reports.own_totals`` and
+            # ``VariationManager.matching``
+            models.Index(
+                fields=['ledger', 'date', 'account', 'direction', 'amount'],
+                name='variation_ledger_date_idx',
+            ),
+        ]
+
+    # ``(account_id, amount)`` as last written to the database
+    _stored = None
+
     @classmethod
-    def from_dict(cls, variation_dict, variation_type, record):
-        account = Account.objects.get(pk=variation_dict["account_id"])
+    def from_db(cls, db, field_names, values):
+        variation = super().from_db(db, field_names, values)
+        variation._stored = (variation.account_id, variation.amount)
+        return variation
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        denormalized = self.denormalize(update_fields)
+        if update_fields is not None:
+            kwargs['update_fields'] = list(update_fields) + denormalized
+        # Stored balances are updated from ``post_save``, in the same transaction
+        with write_transaction():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Stored balances are updated from ``post_delete``, in the same transaction
+        with write_transaction():
+            return super().delete(*args, **kwargs)
+
+    def denormalize(self, fields=None):
+        """
+        Set the denormalized fields that depend on ``fields`` (all of them if ``None``): the
+        ledger and date of the record and the direction. Returns their names.
+        """
+        fields = None if fields is None else set(fields)
+        denormalized = []
+        if fields is None or fields & {'record', 'record_id'}:
+            self.ledger_id, self.date = self.record.ledger_id, self.record.date
+            denormalized += ['ledger', 'date']
+        if fields is None or fields & {'account', 'account_id', 'amount'}:
+            self.direction = self.direction_of(self.account.type, self.amount)
+            denormalized.append('direction')
+        return denormalized
+
+    @property
+    def stored_amount(self):
+        """``amount`` as it's written to the database (it may have been set to a string)."""
+        return self._meta.get_field('amount').to_python(self.amount)
+
+    def report_balance_change(self, update_fields=None):
+        """
+        Report to the stored balances how this variation moved since it was last written, given
+        the fields that were written (all of them if ``None``), and that its record changed.
+        """
+        stored = self._stored
+        account_pk, amount = self.account_id, self.stored_amount
+        if stored is not None and update_fields is not None:
+            if not set(update_fields) & {'account', 'account_id'}:
+                account_pk = stored[0]
+            if 'amount' not in update_fields:
+                amount = stored[1]
+
+        with deferred_balance_updates():
+            if stored is not None:
+                add_delta(stored[0], -stored[1], self.record_id)
+            add_delta(account_pk, amount, self.record_id)
+            touch_record(self.record_id)
+        self._stored = (account_pk, amount)
+
+    @staticmethod
+    def amount_from_dict(variation_dict):
+        # Amounts come as floats from JSON, in cents through their shortest repr
+        return to_cents(variation_dict["amount"])
+
+    @classmethod
+    def from_dict(cls, variation_dict, variation_type, record, accounts=None):
+        """``accounts`` maps primary keys to accounts, otherwise the account is fetched."""
+        account_id = variation_dict["account_id"]
+        account = (
+            accounts[account_id] if accounts is not None else Account.objects.get(pk=account_id))
         is_increase = cls.is_increase(account, variation_type)
-        amount = (1 if is_increase else -1) * variation_dict["amount"]
-        return Variation(amount=amount, account=account, record=record)
+        amount = (1 if is_increase else -1) * cls.amount_from_dict(variation_dict)
+        variation = Variation(amount=amount, account=account, record=record)
+        variation.denormalize()
+        return variation
 
     @classmethod
     def is_increase(cls, account, type_):
-        if account.type == Account.ORIGIN:
+        return cls.increases(account.type, type_)
+
+    @classmethod
+    def increases(cls, account_type, type_):
+        """Whether variations of ``type_`` on accounts of ``account_type`` are positive."""
+        if account_type == Account.ORIGIN:
             return type_ == cls.CREDIT
         else:
             return type_ == cls.DEBIT
 
+    @classmethod
+    def direction_of(cls, account_type, amount):
+        """The type of a variation of ``amount`` on an account of ``account_type``."""
+        return cls.DEBIT if (amount > 0) == cls.increases(account_type, cls.DEBIT) else cls.CREDIT
+
     @property
     def type(self):
-        is_increase = self.amount > 0
-        if self.account.type == Account.ORIGIN:
-            return self.CREDIT if is_increase else self.DEBIT
-        else:
-            return self.DEBIT if is_increase else self.CREDIT
+        return self.direction
 
     def as_dict(self):
         return {
@@ -216,25 +1108,37 @@ class Variation(models.Model):
             "account_id": self.account.pk,
             "account_name": self.account.name,
             "account_url": self.account.get_absolute_url(),
-            "amount": abs(float(self.amount)),
+            "amount": json_amount(abs(self.amount)),
         }
 
-    def update_from_dict(self, variation_dict, type_):
+    def update_from_dict(self, variation_dict, type_, accounts=None, commit=True):
+        """
+        ``accounts`` maps primary keys to accounts, otherwise the account is fetched if it
+        changed. Returns the updated fields, which are only saved if ``commit``.
+        """
         update_fields = []
 
         account_id = variation_dict["account_id"]
         if account_id != self.account.pk:
-            self.account = Account.objects.get(pk=account_id)
+            self.account = (
+                accounts[account_id] if accounts is not None
+                else Account.objects.get(pk=account_id)
+            )
             update_fields.append("account")
 
         # Note that account could have already changed and change `is_increase` output
-        amount = variation_dict["amount"] * (1 if self.is_increase(self.account, type_) else -1)
+        amount = self.amount_from_dict(variation_dict) * (
+            1 if self.is_increase(self.account, type_) else -1)
         if amount != self.amount:
             self.amount = amount
             update_fields.append("amount")
+        # Saving sets it too, but the type may be read before
+        self.denormalize(update_fields)
 
-        self.save(update_fields=update_fields)
+        if commit:
+            self.save(update_fields=update_fields)
+        return update_fields
 
     def __str__(self):
         return 'Variation({}, {}, {})'.format(
-            self.account.name, abs(self.amount), self.type)
+            self.account.name, from_cents(abs(self.amount)), self.type)
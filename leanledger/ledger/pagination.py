@@ -0,0 +1,81 @@
+"""
+Keyset pagination of records and of variations (the statement of an account, or any filtered
+ones) on ``(date, pk)``, newest first: variations have the date of their record.
+
+The cursor of a page is the position of its last row, and the next page is fetched by filtering
+on it instead of using an OFFSET, so it costs the same however deep it is.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import Q, Sum
+
+PAGE_SIZE = 50
+# Records of a page of ``record_batch_json``
+BATCH_PAGE_SIZE = 500
+
+Page = namedtuple('Page', ['records', 'next_cursor'])
+VariationPage = namedtuple('VariationPage', ['variations', 'next_cursor'])
+StatementPage = namedtuple('StatementPage', ['lines', 'next_cursor'])
+StatementLine = namedtuple('StatementLine', ['variation', 'balance'])
+
+
+def encode_cursor(row):
+    """Cursor of a record or a variation."""
+    return '{}.{}'.format(row.date.strftime('%Y-%m-%d'), row.pk)
+
+
+def decode_cursor(cursor):
+    """Raise ``ValueError`` if ``cursor`` wasn't generated by ``encode_cursor``."""
+    date, pk = cursor.split('.')
+    return datetime.strptime(date, '%Y-%m-%d').date(), int(pk)
+
+
+def records_page(records, cursor=None, size=None):
+    size = size or PAGE_SIZE
+    records = records.order_by('-date', '-pk')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        records = records.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+
+    # One extra record tells whether there is a next page
+    records = list(records[:size + 1])
+    next_cursor = encode_cursor(records[size - 1]) if len(records) > size else None
+    return Page(records[:size], next_cursor)
+
+
+def variations_page(variations, cursor=None, size=None):
+    """Page of ``variations`` with their records, like ``records_page``."""
+    size = size or PAGE_SIZE
+    variations = variations.select_related('record').order_by('-date', '-pk')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        variations = variations.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+
+    variations = list(variations[:size + 1])
+    next_cursor = encode_cursor(variations[size - 1]) if len(variations) > size else None
+    return VariationPage(variations[:size], next_cursor)
+
+
+def statement_page(account, cursor=None, size=None):
+    """
+    Page of the account's own variations, newest first, each with the balance of the account
+    right after it (in cents): its stored balance minus the variations after the page, added up
+    in SQL on the ``(account, date, id, amount)`` index.
+    """
+    size = size or PAGE_SIZE
+    variations = account.variations.select_related('record').order_by('-date', '-pk')
+    balance = account.own_total
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        variations = variations.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+        later = account.variations.filter(Q(date__gt=date) | Q(date=date, pk__gte=pk))
+        balance -= later.aggregate(total=Sum('amount'))['total'] or 0
+
+    variations = list(variations[:size + 1])
+    lines = []
+    for variation in variations[:size]:
+        lines.append(StatementLine(variation, balance))
+        balance -= variation.amount
+    next_cursor = encode_cursor(variations[size - 1]) if len(variations) > size else None
+    return StatementPage(lines, next_cursor)
@@ -0,0 +1,169 @@
+"""
+Period reports: debit, credit and net totals (in cents) of every account over a date range,
+optionally by day, month or year, from one grouped aggregate.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import models
+from django.db.models import Case, F, Sum, Value, When
+
+from .core import json_amount, rollup_totals
+from .models import Account, Variation
+
+GRANULARITIES = {
+    'day': lambda date: date,
+    'month': lambda date: date.replace(day=1),
+    'year': lambda date: date.replace(month=1, day=1),
+}
+
+
+class AccountTotals(namedtuple('AccountTotals', ['account', 'depth', 'debit', 'credit'])):
+    @property
+    def net(self):
+        """How much the total of the account changed."""
+        if self.account.type == Account.ORIGIN:
+            return self.credit - self.debit
+        return self.debit - self.credit
+
+
+class Period(namedtuple('Period', ['start', 'accounts'])):
+    """
+    Totals of one period (``start`` is ``None`` if the report isn't split in periods).
+    ``accounts`` lists the ``AccountTotals`` of the accounts with variations in the period, in
+    tree order.
+    """
+
+    def _roots(self, type_=None):
+        return [
+            totals for totals in self.accounts
+            if totals.depth == 0 and type_ in (None, totals.account.type)
+        ]
+
+    @property
+    def debit(self):
+        return sum(totals.debit for totals in self._roots())
+
+    @property
+    def credit(self):
+        return sum(totals.credit for totals in self._roots())
+
+    @property
+    def destination(self):
+        return [totals for totals in self.accounts if totals.account.type == Account.DESTINATION]
+
+    @property
+    def origin(self):
+        return [totals for totals in self.accounts if totals.account.type == Account.ORIGIN]
+
+    @property
+    def destination_net(self):
+        return sum(totals.net for totals in self._roots(Account.DESTINATION))
+
+    @property
+    def origin_net(self):
+        return sum(totals.net for totals in self._roots(Account.ORIGIN))
+
+    def as_dict(self):
+        return {
+            'start': self.start.isoformat() if self.start is not None else None,
+            'accounts': [
+                {
+                    'id': totals.account.pk,
+                    'full_name': totals.account.full_name,
+                    'type': totals.account.type,
+                    'debit': json_amount(totals.debit),
+                    'credit': json_amount(totals.credit),
+                    'net': json_amount(totals.net),
+                }
+                for totals in self.accounts
+            ],
+            'debit': json_amount(self.debit),
+            'credit': json_amount(self.credit),
+            'destination_net': json_amount(self.destination_net),
+            'origin_net': json_amount(self.origin_net),
+        }
+
+
+def _signed_sum(condition, sign):
+    return Sum(
+        Case(
+            When(condition, then=F('amount') * sign),
+            default=Value(0),
+            output_field=models.BigIntegerField(),
+        ),
+    )
+
+
+def own_totals(ledger_pk, start=None, end=None, granularity=None):
+    """
+    Return ``{period_start: {account_pk: (increase, decrease)}}`` with the variations of each
+    account in records from ``start`` to ``end`` (both included), in one query.
+    """
+    # A range of the variations' ledger and date index, which has the accounts and amounts
+    variations = Variation.objects.filter(ledger=ledger_pk)
+    if start is not None:
+        variations = variations.filter(date__gte=start)
+    if end is not None:
+        variations = variations.filter(date__lte=end)
+
+    # Grouped by date rather than by period: truncating dates in the database is a function call
+    # per variation (a Python one on SQLite), adding up the days of a period here is cheap
+    fields = ['account'] if granularity is None else ['account', 'date']
+    rows = variations.order_by().values(*fields).annotate(
+        increase=_signed_sum(models.Q(amount__gt=0), 1),
+        decrease=_signed_sum(models.Q(amount__lt=0), -1),
+    )
+
+    totals = defaultdict(lambda: defaultdict(lambda: (0, 0)))
+    for row in rows:
+        period = None if granularity is None else GRANULARITIES[granularity](row['date'])
+        increase, decrease = totals[period][row['account']]
+        totals[period][row['account']] = (
+            increase + row['increase'], decrease + row['decrease'])
+    return totals
+
+
+def _tree_order(accounts):
+    """``(account, depth)`` for ``accounts`` (as loaded by ``Account.objects.tree``), depth
+    first, destination accounts first and siblings by name."""
+    def walk(siblings, depth):
+        for account in sorted(siblings, key=lambda account: account.name):
+            yield account, depth
+            yield from walk(account.subaccounts, depth + 1)
+
+    roots = [account for account in accounts.values() if account.parent_id is None]
+    for type_ in (Account.DESTINATION, Account.ORIGIN):
+        yield from walk([account for account in roots if account.type == type_], 0)
+
+
+def period_report(ledger_pk, start=None, end=None, granularity=None):
+    """
+    Return the ``Period`` totals of the ledger's accounts from ``start`` to ``end``, one for
+    every day, month or year (``granularity``) with variations, or just one if ``granularity`` is
+    ``None``.
+    """
+    accounts = Account.objects.tree(ledger_pk)
+    parents = {pk: account.parent_id for pk, account in accounts.items()}
+    ordered = list(_tree_order(accounts))
+
+    periods = []
+    totals_by_period = own_totals(ledger_pk, start, end, granularity)
+    for period_start in sorted(totals_by_period):
+        totals = totals_by_period[period_start]
+        increases = rollup_totals({pk: amounts[0] for pk, amounts in totals.items()}, parents)
+        decreases = rollup_totals({pk: amounts[1] for pk, amounts in totals.items()}, parents)
+        period_accounts = []
+        for account, depth in ordered:
+            increase, decrease = increases[account.pk], decreases[account.pk]
+            if not increase and not decrease:
+                continue
+            if account.type == Account.DESTINATION:
+                debit, credit = increase, decrease
+            else:
+                debit, credit = decrease, increase
+            period_accounts.append(AccountTotals(account, depth, debit, credit))
+        periods.append(Period(period_start, period_accounts))
+
+    if not periods and granularity is None:
+        periods.append(Period(None, []))
+    return periods
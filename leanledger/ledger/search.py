@@ -0,0 +1,143 @@
+"""
+Full-text search of records by their description and the full names of their accounts: an FTS5
+index on SQLite (``ledger_recordsearch``, kept up to date by ``balances.py``), ``icontains``
+lookups elsewhere.
+"""
+import functools
+import re
+import sqlite3
+
+from django.db import connection as default_connection
+from django.db.models import Q
+
+from .core import path_range
+
+TABLE = 'ledger_recordsearch'
+
+_CREATE = (
+    "CREATE VIRTUAL TABLE {} USING fts5(description, accounts, ledger_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+).format(TABLE)
+
+# The names of the accounts of every variation of the record and of their ancestors, walking up
+# the ``parent`` links by primary key (matching ancestors on the paths would scan every account)
+_DOCUMENTS = """
+    WITH RECURSIVE lineage(record_id, account_id) AS (
+        SELECT record_id, account_id FROM ledger_variation WHERE record_id IN ({records})
+        UNION
+        SELECT lineage.record_id, account.parent_id
+        FROM lineage INNER JOIN ledger_account account ON account.id = lineage.account_id
+        WHERE account.parent_id IS NOT NULL
+    )
+    SELECT record.id, record.description, group_concat(DISTINCT account.name), record.ledger_id
+    FROM ledger_record record
+    LEFT JOIN lineage ON lineage.record_id = record.id
+    LEFT JOIN ledger_account account ON account.id = lineage.account_id
+    WHERE record.id IN ({records})
+    GROUP BY record.id
+"""
+
+_WORD = re.compile(r'\w+')
+# Words of a query that are searched, the rest are ignored
+MAX_WORDS = 10
+
+
+@functools.lru_cache()
+def fts5_available():
+    """Whether the SQLite library has FTS5 (all connections share it)."""
+    options = sqlite3.connect(':memory:').execute('PRAGMA compile_options').fetchall()
+    return ('ENABLE_FTS5',) in options
+
+
+def enabled(connection=None):
+    connection = connection or default_connection
+    return connection.vendor == 'sqlite' and fts5_available()
+
+
+def create_table(schema_editor):
+    """Create the index and index all the records, if the database supports it."""
+    if enabled(schema_editor.connection):
+        schema_editor.execute(_CREATE)
+        rebuild(connection=schema_editor.connection)
+
+
+def drop_table(schema_editor):
+    if enabled(schema_editor.connection):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(TABLE))
+
+
+def _index(records, params, connection):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(TABLE, records), params)
+        cursor.execute(
+            'INSERT INTO {} (rowid, description, accounts, ledger_id) {}'.format(
+                TABLE, _DOCUMENTS.format(records=records)),
+            params * 2)
+
+
+def index(record_pks, connection=None):
+    """
+    Index ``record_pks`` again, in two queries. Records that don't exist anymore are removed
+    from the index.
+    """
+    connection = connection or default_connection
+    record_pks = list(record_pks)
+    if record_pks and enabled(connection):
+        _index(', '.join(['%s'] * len(record_pks)), record_pks, connection)
+
+
+def index_accounts(account, connection=None):
+    """Index again the records with variations on ``account`` or its descendants."""
+    connection = connection or default_connection
+    if not enabled(connection):
+        return
+    subtree = path_range(account.children_path)
+    records = (
+        'SELECT variation.record_id FROM ledger_variation variation '
+        'INNER JOIN ledger_account account ON account.id = variation.account_id '
+        'WHERE account.id = %s OR (account.path >= %s AND account.path < %s)'
+    )
+    params = [account.pk, subtree['path__gte'], subtree['path__lt']]
+    _index(records, params, connection)
+
+
+def rebuild(ledger_pk=None, connection=None):
+    """Index again all the records (of the ledger)."""
+    connection = connection or default_connection
+    if not enabled(connection):
+        return
+    if ledger_pk is None:
+        _index('SELECT id FROM ledger_record', [], connection)
+    else:
+        _index('SELECT id FROM ledger_record WHERE ledger_id = %s', [ledger_pk], connection)
+
+
+def search(ledger_pk, query, page=1, size=50, connection=None):
+    """
+    Primary keys of the records of the ledger that match every word of ``query``, on page
+    ``page`` (from 1) of ``size``, best matches first, and whether there is a next page.
+    """
+    from .models import Record
+
+    connection = connection or default_connection
+    words = _WORD.findall(query)[:MAX_WORDS]
+    if not words:
+        return [], False
+    offset = (page - 1) * size
+    if enabled(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s AND ledger_id = %s '
+                'ORDER BY bm25({table}, 2.0, 1.0, 0.0), rowid DESC LIMIT %s OFFSET %s'.format(
+                    table=TABLE),
+                [' '.join('"{}"*'.format(word) for word in words), ledger_pk, size + 1, offset])
+            pks = [pk for pk, in cursor.fetchall()]
+    else:
+        records = Record.objects.filter(ledger=ledger_pk)
+        for word in words:
+            records = records.filter(
+                Q(description__icontains=word) | Q(variations__account__name__icontains=word))
+        pks = list(
+            records.order_by('-date', '-pk').values_list('pk', flat=True)
+            .distinct()[offset:offset + size + 1])
+    return pks[:size], len(pks) > size
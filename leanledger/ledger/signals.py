@@ -0,0 +1,76 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .balances import (
+    add_delta, deferred_balance_updates, move_record, touch_ledger, touch_record,
+)
+from .models import Account, AccountBalance, Ledger, Record, Variation
+
+
+@receiver(post_save, sender=Account)
+def account_saved(sender, instance, created, raw, **kwargs):
+    if raw:  # Loading fixtures: run ``rebuild_balances`` afterwards
+        return
+    if created:
+        AccountBalance.objects.create(account=instance)
+    else:
+        moved = instance.parent_id != instance._stored_parent_id
+        if moved:
+            Account.objects.move_descendants(
+                '{}{}/'.format(instance._stored_path, instance.pk), instance.children_path)
+            AccountBalance.objects.move_subtree(instance, instance._stored_parent_id)
+        if moved or instance.name != instance._stored_name:
+            # The full names of the subtree changed
+            search.index_accounts(instance)
+        if instance.type != instance._stored_type:
+            Variation.objects.redirect(instance)
+    instance._stored_parent_id = instance.parent_id
+    instance._stored_path = instance.path
+    instance._stored_name = instance.name
+    instance._stored_type = instance.type
+    Ledger.objects.bump_versions([instance.ledger_id], accounts=True)
+
+
+@receiver(post_delete, sender=Account)
+def account_deleted(sender, instance, **kwargs):
+    Ledger.objects.bump_versions([instance.ledger_id], accounts=True)
+
+
+@receiver(post_save, sender=Record)
+def record_saved(sender, instance, created, raw, update_fields, **kwargs):
+    if raw:
+        return
+    moved = not created and (update_fields is None or 'date' in update_fields)
+    with deferred_balance_updates():
+        if moved and instance._stored_date != instance.date:
+            Variation.objects.redate([instance.pk])
+        if moved and instance._stored_date not in (None, instance.date):
+            move_record(instance.pk, instance._stored_date)
+        touch_record(instance.pk)
+    instance._stored_date = instance.date
+
+
+@receiver(post_delete, sender=Record)
+def record_deleted(sender, instance, **kwargs):
+    with deferred_balance_updates():
+        move_record(instance.pk, instance.date)
+        touch_ledger(instance.ledger_id)
+
+
+@receiver(post_save, sender=Variation)
+def variation_saved(sender, instance, created, raw, update_fields, **kwargs):
+    if raw:
+        return
+    if created:
+        instance._stored = None
+    instance.report_balance_change(update_fields)
+
+
+@receiver(post_delete, sender=Variation)
+def variation_deleted(sender, instance, **kwargs):
+    account_pk, amount = instance._stored or (instance.account_id, instance.stored_amount)
+    with deferred_balance_updates():
+        add_delta(account_pk, -amount, instance.record_id)
+        touch_record(instance.record_id)
+    instance._stored = None
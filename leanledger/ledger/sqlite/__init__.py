@@ -0,0 +1,43 @@
+"""
+SQLite tuning for concurrent users: the PRAGMAs of ``settings.LEDGER_SQLITE_PRAGMAS`` on every
+connection, and ``write_transaction``, which every write path (saves, deletes and the bulk
+operations) goes through so that writers take the write lock before they read.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+# Writers of a process queue on it, rather than polling the lock of the database
+_writers = threading.Lock()
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # On the DB-API connection, so the PRAGMAs aren't counted as queries of the request
+    for name, value in getattr(settings, 'LEDGER_SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    ``transaction.atomic`` that, on SQLite (with this package as the database ``ENGINE``), takes
+    the write lock as soon as the outermost block begins. Nested blocks are savepoints, as usual.
+    """
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block or not hasattr(connection, 'begin'):
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    with _writers:
+        connection.begin = 'BEGIN IMMEDIATE'
+        try:
+            with transaction.atomic(using=using):
+                connection.begin = 'BEGIN'
+                yield
+        finally:
+            connection.begin = 'BEGIN'
@@ -0,0 +1,12 @@
+"""
+Django's SQLite backend, where ``write_transaction`` can choose how transactions begin.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Statement that begins the next transaction (``atomic`` begins them explicitly on SQLite)
+    begin = 'BEGIN'
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(self.begin)
@@ -1,5 +1,7 @@
 from django import template
 
+from ..core import from_cents
+
 
 register = template.Library()
 
@@ -9,3 +11,5 @@ def absolute(value):
 
 
 register.filter('absolute', absolute)
+# Amounts are stored in cents
+register.filter('from_cents', from_cents)
@@ -0,0 +1,37 @@
+import json
+
+from django.test import TestCase
+
+from .. import benchmark
+from ..models import Account, AccountBalance, Record
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self.ledger = benchmark.generate_ledger(depth=2, fanout=2, records=20, variations=3)
+
+    def test_generate_ledger(self):
+        self.assertEqual(benchmark.ledger_shape(self.ledger), {
+            'accounts': 2 * (2 + 2 * 2),
+            'records': 20,
+            'variations': 20 * 3,
+        })
+        self.assertFalse(Record.objects.unbalanced(self.ledger.pk).exists())
+        self.assertEqual(AccountBalance.objects.verify(self.ledger.pk), [])
+        self.assertEqual(Account.objects.verify_paths(self.ledger.pk), [])
+
+    def test_run(self):
+        results = benchmark.run(self.ledger, repeat=2)
+
+        self.assertEqual(list(results['results']), [case.name for case in benchmark.CASES])
+        self.assertEqual(results['results']['account_list_json']['queries'], 2)
+        # Results can be written and compared
+        previous = json.loads(json.dumps(results))
+        comparison = list(benchmark.compare(previous, results))
+        self.assertIn(('account_list_json', 'queries', 2, 2, 1), comparison)
+
+    def test_concurrent_need_a_database_file(self):
+        with self.assertRaises(ValueError):
+            benchmark.run_concurrent(self.ledger)
+        with self.assertRaises(ValueError):
+            benchmark.run_load(self.ledger)
@@ -0,0 +1,147 @@
+import os
+import tempfile
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .. import cache
+from ..importer import import_records
+from ..models import Account, Ledger, Record, Variation
+
+
+class TestCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.wealth = Account.objects.create(
+            name='wealth', type=Account.ORIGIN, ledger=self.ledger)
+        self.records = []
+        for day in (1, 2):
+            record = Record.objects.create(date=date(2019, 10, day), ledger=self.ledger)
+            Variation.objects.create(amount=10, record=record, account=self.cash)
+            Variation.objects.create(amount=10, record=record, account=self.wealth)
+            self.records.append(record)
+
+    def ledger_versions(self):
+        ledger = Ledger.objects.get(pk=self.ledger.pk)
+        return ledger.version, ledger.accounts_version
+
+    def record_dicts(self):
+        records = Record.objects.filter(ledger=self.ledger).order_by('pk')
+        return cache.record_dicts(records, self.ledger.pk, self.ledger_versions()[1])
+
+    def test_record_dicts(self):
+        expected = [
+            record.as_dict()
+            for record in Record.objects.with_variations(self.records, self.ledger.pk)
+        ]
+
+        self.assertEqual(self.record_dicts(), expected)
+        # Versions and records, but neither variations nor accounts
+        with self.assertNumQueries(2):
+            self.assertEqual(self.record_dicts(), expected)
+        self.assertEqual((cache.stats['record', 'hit'], cache.stats['record', 'miss']), (2, 2))
+
+    def test_variation_write(self):
+        self.record_dicts()
+        cache.accounts_dicts(self.ledger.pk, self.ledger_versions()[1])
+
+        variation = self.records[0].variations.get(account=self.cash)
+        variation.amount = 20
+        variation.save()
+
+        record_dicts = self.record_dicts()
+        self.assertEqual(record_dicts[0]['variations']['debit'][0]['amount'], 0.2)
+        self.assertFalse(record_dicts[0]['is_balanced'])
+        # Only the record that changed is computed again
+        self.assertEqual(cache.stats['record', 'miss'], 3)
+        cache.accounts_dicts(self.ledger.pk, self.ledger_versions()[1])
+        self.assertEqual(cache.stats['accounts', 'hit'], 1)
+
+    def test_account_write(self):
+        self.record_dicts()
+        cache.accounts_dicts(self.ledger.pk, self.ledger_versions()[1])
+
+        self.cash.name = 'wallet'
+        self.cash.save()
+
+        accounts = cache.accounts_dicts(self.ledger.pk, self.ledger_versions()[1])
+        self.assertEqual(accounts[0]['name'], 'wallet')
+        self.assertEqual(self.record_dicts()[0]['variations']['debit'][0]['account_name'], 'wallet')
+        self.assertEqual(cache.stats['record', 'miss'], 4)
+
+    def test_deleted_record(self):
+        self.record_dicts()
+        deleted_pk = self.records[1].pk
+        self.records[1].delete()
+
+        record = {
+            'date': '2019-10-03', 'description': 'Groceries',
+            'variations': {
+                'debit': [{'account_id': self.cash.pk, 'amount': 0.2}],
+                'credit': [{'account_id': self.wealth.pk, 'amount': 0.2}],
+            },
+        }
+        import_records(self.ledger.pk, [(1, record)], on_error=self.fail)
+
+        # The imported record doesn't reuse the primary key (and cache entries) of the deleted one
+        record_dicts = self.record_dicts()
+        self.assertNotEqual(record_dicts[1]['id'], deleted_pk)
+        self.assertEqual(record_dicts[1]['description'], 'Groceries')
+
+    def test_account_tree_totals(self):
+        tree = cache.account_tree(self.ledger.pk, self.ledger_versions()[0])
+        self.assertEqual(tree[self.cash.pk].total, 20)
+
+        Variation.objects.bulk_create(
+            [Variation(amount=5, record=self.records[0], account=self.cash)])
+
+        tree = cache.account_tree(self.ledger.pk, self.ledger_versions()[0])
+        self.assertEqual(tree[self.cash.pk].total, 25)
+        self.assertEqual((cache.stats['tree', 'hit'], cache.stats['tree', 'miss']), (0, 2))
+
+    def test_account_list_json(self):
+        url = reverse('account_list_json', args=[self.ledger.pk])
+        self.client.get(url)
+
+        # Just the versions
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.stats['accounts', 'hit'], 1)
+
+    def test_account_list(self):
+        url = reverse('account_list', args=[self.ledger.pk])
+        self.client.get(url)
+
+        # Versions and ledger
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        self.assertContains(response, 'wealth')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            caches = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'ledger': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': cache_dir,
+                },
+            }
+            with override_settings(CACHES=caches, LEDGER_CACHE='ledger'):
+                self.record_dicts()
+                tree = cache.account_tree(self.ledger.pk, self.ledger_versions()[0])
+
+                with self.assertNumQueries(2):
+                    self.record_dicts()
+                self.assertEqual(
+                    cache.account_tree(self.ledger.pk, self.ledger_versions()[0]), tree)
+                self.assertEqual(cache.stats['record', 'hit'], 2)
+                self.assertTrue(os.listdir(cache_dir))
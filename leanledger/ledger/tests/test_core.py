@@ -1,8 +1,13 @@
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
 from unittest import TestCase
 from unittest.mock import Mock
 
-
-from ..core import record_is_balanced
+from ..core import (
+    account_paths, diff_variations, from_cents, json_amount, month_end, month_ends, path_pks,
+    path_range, record_is_balanced, rollup_totals, to_cents,
+)
 
 
 class TestRecordIsBalanced(TestCase):
@@ -65,3 +70,96 @@ class TestRecordIsBalanced(TestCase):
         ]
 
         self.assertFalse(record_is_balanced(record))
+
+
+class TestCents(TestCase):
+    def test_to_cents(self):
+        self.assertEqual(to_cents(Decimal('12.34')), 1234)
+        self.assertEqual(to_cents('-0.5'), -50)
+        self.assertEqual(to_cents(7), 700)
+        # Floats from JSON, by their shortest repr
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertEqual(to_cents(1.005), 100)
+        self.assertEqual(to_cents('0.125'), 12)
+
+    def test_to_cents_invalid(self):
+        for amount in ('nope', 'NaN', 'Infinity', None):
+            with self.subTest(amount=amount), self.assertRaises(InvalidOperation):
+                to_cents(amount)
+
+    def test_from_cents(self):
+        self.assertEqual(str(from_cents(1234)), '12.34')
+        self.assertEqual(str(from_cents(-5)), '-0.05')
+        self.assertEqual(str(from_cents(0)), '0.00')
+
+    def test_json_amount(self):
+        # The JSON is the exact amount
+        for cents in (1, 10, 1234, -5, 99999999999999):
+            with self.subTest(cents=cents):
+                self.assertEqual(Decimal(json.dumps(json_amount(cents))), from_cents(cents))
+
+
+class TestRollupTotals(TestCase):
+    def test_rollup(self):
+        parents = {1: None, 2: 1, 3: 2, 4: 1, 5: None}
+        own_totals = {3: 10, 4: 5, 5: 7}
+
+        self.assertEqual(rollup_totals(own_totals, parents), {1: 15, 2: 10, 3: 10, 4: 5, 5: 7})
+
+    def test_unknown_accounts_are_ignored(self):
+        self.assertEqual(rollup_totals({3: 10}, {1: None}), {1: 0})
+
+
+class TestAccountPaths(TestCase):
+    def test_paths(self):
+        parents = {1: None, 2: 1, 3: 2, 4: 1, 5: None}
+
+        self.assertEqual(account_paths(parents), {1: '', 2: '1/', 3: '1/2/', 4: '1/', 5: ''})
+
+    def test_path_pks(self):
+        self.assertEqual(path_pks('1/12/'), [1, 12])
+        self.assertEqual(path_pks(''), [])
+
+    def test_path_range(self):
+        lookups = path_range('1/2/')
+        in_range = [
+            path for path in ['1/', '1/2/', '1/2/3/', '1/20/', '1/2/30/', '1/3/']
+            if lookups['path__gte'] <= path < lookups['path__lt']
+        ]
+
+        self.assertEqual(in_range, ['1/2/', '1/2/3/', '1/2/30/'])
+
+
+class TestMonthEnds(TestCase):
+    def test_month_end(self):
+        self.assertEqual(month_end(date(2020, 2, 10)), date(2020, 2, 29))
+        self.assertEqual(month_end(date(2019, 12, 31)), date(2019, 12, 31))
+
+    def test_month_ends(self):
+        self.assertEqual(
+            list(month_ends(date(2019, 11, 15), date(2020, 2, 28))),
+            [date(2019, 11, 30), date(2019, 12, 31), date(2020, 1, 31)])
+        self.assertEqual(list(month_ends(date(2019, 11, 15), date(2019, 11, 29))), [])
+
+
+class TestDiffVariations(TestCase):
+    def test_diff(self):
+        debit_one, debit_two, credit_one = Mock(pk=1), Mock(pk=2), Mock(pk=1)
+        existing = {'debit': [debit_one, debit_two], 'credit': [credit_one]}
+        state = {
+            'debit': [{'id': 2, 'amount': 10}, {'id': 3, 'amount': 5}],
+            # Ids are only unique within a type
+            'credit': [{'id': 1, 'amount': 10}, {'id': 2, 'amount': 5}],
+        }
+
+        to_create, to_update, to_delete = diff_variations(existing, state)
+
+        self.assertEqual(to_create, [
+            ('debit', {'id': 3, 'amount': 5}),
+            ('credit', {'id': 2, 'amount': 5}),
+        ])
+        self.assertEqual(to_update, [
+            (debit_two, 'debit', {'id': 2, 'amount': 10}),
+            (credit_one, 'credit', {'id': 1, 'amount': 10}),
+        ])
+        self.assertEqual(to_delete, [debit_one])
@@ -0,0 +1,94 @@
+import csv
+import json
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from ..export import csv_lines, iter_records, jsonl_lines
+from ..models import Account, Ledger, Record, Variation
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.expense = Account.objects.create(
+            name='expense', type=Account.ORIGIN, ledger=self.ledger)
+        for day in range(1, 6):
+            record = Record.objects.create(
+                date=date(2019, 9, day), ledger=self.ledger, description='Record {}'.format(day))
+            Variation.objects.create(amount=-day, record=record, account=self.cash)
+            Variation.objects.create(amount=-day, record=record, account=self.expense)
+        self.empty_record = Record.objects.create(date=date(2019, 8, 1), ledger=self.ledger)
+
+    def expected_dicts(self):
+        return [record.as_dict() for record in Record.objects.order_by('-date', '-pk')]
+
+    def test_iter_records_in_chunks(self):
+        # Accounts once, then records and variations per chunk
+        with self.assertNumQueries(1 + 2 * 3):
+            records = [record.as_dict() for record in iter_records(self.ledger.pk, chunk_size=2)]
+
+        self.assertEqual(records, self.expected_dicts())
+
+    def test_jsonl(self):
+        lines = list(jsonl_lines(iter_records(self.ledger.pk)))
+
+        self.assertEqual([json.loads(line) for line in lines], self.expected_dicts())
+
+    def test_csv(self):
+        rows = list(csv.DictReader(csv_lines(iter_records(self.ledger.pk))))
+
+        self.assertEqual(len(rows), 5 * 2 + 1)
+        self.assertEqual(rows[0], {
+            'id': str(Record.objects.get(date=date(2019, 9, 5)).pk),
+            'date': '2019-09-05',
+            'description': 'Record 5',
+            'is_balanced': 'True',
+            'type': 'debit',
+            'variation_id': str(Variation.objects.get(account=self.expense, amount=-5).pk),
+            'account_id': str(self.expense.pk),
+            'account_name': 'expense',
+            'account_url': self.expense.get_absolute_url(),
+            'amount': '0.05',
+        })
+        self.assertEqual(rows[-1]['id'], str(self.empty_record.pk))
+        self.assertEqual(rows[-1]['variation_id'], '')
+
+    def test_view_streams(self):
+        url = reverse('ledger_export', args=[self.ledger.pk])
+
+        response = self.client.get(url, {'format': 'jsonl'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected_dicts())
+
+    def test_view_unknown_format(self):
+        url = reverse('ledger_export', args=[self.ledger.pk])
+
+        response = self.client.get(url, {'format': 'xls'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_view_unknown_ledger(self):
+        url = reverse('ledger_export', args=[self.ledger.pk + 100])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self):
+        output = StringIO()
+
+        call_command('export_ledger', self.ledger.pk, '--format', 'jsonl', stdout=output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected_dicts())
@@ -1,6 +1,6 @@
 from django.test import TestCase
 
-from ..forms import LedgerForm
+from ..forms import LedgerForm, VariationFilterForm
 
 
 class RecordFormTest(TestCase):
@@ -13,3 +13,17 @@ class RecordFormTest(TestCase):
         form = LedgerForm({'name': ''})
 
         self.assertFalse(form.is_valid())
+
+
+class VariationFilterFormTest(TestCase):
+    def test_amounts_in_cents(self):
+        form = VariationFilterForm({'min_amount': '0.5', 'max_amount': '12.34'})
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['min_amount'], 50)
+        self.assertEqual(form.cleaned_data['max_amount'], 1234)
+
+    def test_invalid_amounts(self):
+        for data in ({'min_amount': '0.001'}, {'min_amount': '-1'}, {'max_amount': 'nope'}):
+            with self.subTest(data=data):
+                self.assertFalse(VariationFilterForm(data).is_valid())
@@ -0,0 +1,114 @@
+from datetime import date
+from unittest import skipIf
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..core import from_cents
+from ..models import Account, AccountBalance, Ledger, Record, Variation
+from ..reports import period_report
+
+try:
+    import numpy
+    from ..frame import LedgerFrame
+except ImportError:
+    numpy = None
+
+
+@skipIf(numpy is None, "NumPy isn't installed")
+class TestLedgerFrame(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.bank = Account.objects.create(
+            name='bank', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        self.savings = Account.objects.create(
+            name='savings', type=Account.DESTINATION, parent=self.bank, ledger=self.ledger)
+        self.salary = Account.objects.create(
+            name='salary', type=Account.ORIGIN, ledger=self.ledger)
+        self.food = Account.objects.create(
+            name='food', type=Account.ORIGIN, ledger=self.ledger)
+        self.create_record(date(2019, 9, 20), [(self.cash, -3025), (self.food, -3025)])
+        self.create_record(date(2019, 9, 1), [(self.bank, 10010), (self.salary, 10010)])
+        self.create_record(date(2019, 10, 5), [(self.savings, 5000), (self.salary, 5000)])
+
+    def create_record(self, date_, variations):
+        record = Record.objects.create(date=date_, ledger=self.ledger)
+        for account, amount in variations:
+            Variation.objects.create(amount=amount, record=record, account=account)
+
+    def column(self, account):
+        return int(numpy.searchsorted(self.frame.account_pks, account.pk))
+
+    def load(self):
+        # Accounts and variations
+        with self.assertNumQueries(2):
+            self.frame = LedgerFrame.load(self.ledger.pk)
+
+    def test_load(self):
+        self.load()
+
+        self.assertEqual(len(self.frame), 6)
+        self.assertEqual(
+            [str(day) for day in self.frame.dates()[::2]],
+            ['2019-09-01', '2019-09-20', '2019-10-05'])
+        self.assertEqual(self.frame.amount.tolist(), [10010, 10010, -3025, -3025, 5000, 5000])
+        self.assertEqual(self.frame.direction.tolist(), [1, -1, -1, 1, 1, -1])
+        self.assertEqual(self.frame.parent[self.column(self.savings)], self.column(self.bank))
+        self.assertEqual(self.frame.parent[self.column(self.cash)], -1)
+        self.assertEqual(self.frame.depth[self.column(self.savings)], 2)
+
+    def test_totals(self):
+        self.load()
+
+        [period], [totals] = self.frame.totals()
+
+        self.assertIsNone(period)
+        balances = AccountBalance.objects.filter(account__ledger=self.ledger)
+        self.assertEqual(
+            self.frame.as_decimals(totals),
+            {balance.account_id: from_cents(balance.total) for balance in balances})
+
+    def test_totals_by_month(self):
+        self.load()
+
+        periods, totals = self.frame.totals(granularity='month')
+        september, october = period_report(self.ledger.pk, granularity='month')
+
+        self.assertEqual([str(period) for period in periods], ['2019-09-01', '2019-10-01'])
+        for row, period in zip(totals, (september, october)):
+            totals = self.frame.as_decimals(row)
+            for account_totals in period.accounts:
+                self.assertEqual(
+                    totals[account_totals.account.pk], from_cents(account_totals.net))
+
+    def test_own_totals_by_direction(self):
+        self.load()
+
+        _, [debits] = self.frame.own_totals(
+            start=date(2019, 9, 2), end=date(2019, 10, 5), direction=Variation.DEBIT)
+
+        self.assertEqual(debits[self.column(self.food)], -3025)
+        self.assertEqual(debits[self.column(self.savings)], 5000)
+        self.assertEqual(debits[self.column(self.bank)], 0)
+
+    def test_exact_totals(self):
+        # Floating point sums would lose the cents next to the large amounts that cancel out
+        self.create_record(
+            date(2019, 10, 6), [(self.food, 2 ** 60), (self.food, 1), (self.food, -2 ** 60)])
+        self.load()
+
+        [_], [totals] = self.frame.own_totals()
+
+        self.assertEqual(
+            int(totals[self.column(self.food)]),
+            AccountBalance.objects.get(account=self.food).own_total)
+
+    def test_empty_ledger(self):
+        self.frame = LedgerFrame.load(Ledger.objects.create(user=self.user, name='Empty').pk)
+
+        periods, totals = self.frame.totals(granularity='day')
+
+        self.assertEqual((len(periods), totals.shape), (0, (0, 0)))
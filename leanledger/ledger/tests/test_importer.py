@@ -0,0 +1,192 @@
+import csv
+import json
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from ..export import CSV_COLUMNS, csv_lines, iter_records, jsonl_lines
+from ..importer import csv_records, import_records, jsonl_records
+from ..models import Account, AccountBalance, Ledger, Record, Variation
+
+
+class TestImport(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.target = Ledger.objects.create(user=self.user, name='Target Ledger')
+        for ledger in (self.ledger, self.target):
+            Account.objects.create(name='cash', type=Account.DESTINATION, ledger=ledger)
+            expenses = Account.objects.create(
+                name='expenses', type=Account.ORIGIN, ledger=ledger)
+            Account.objects.create(
+                name='food', type=Account.ORIGIN, parent=expenses, ledger=ledger)
+        self.cash = Account.objects.get(ledger=self.target, name='cash')
+        self.food = Account.objects.get(ledger=self.target, name='food')
+
+        food = Account.objects.get(ledger=self.ledger, name='food')
+        for day in range(1, 6):
+            record = Record.objects.create(
+                date=date(2019, 9, day), ledger=self.ledger, description='Record {}'.format(day))
+            Variation.objects.create(
+                amount=-day, record=record, account=Account.objects.get(
+                    ledger=self.ledger, name='cash'))
+            Variation.objects.create(amount=-day, record=record, account=food)
+
+    def record_summaries(self, ledger):
+        return [
+            (record.date, record.description, sorted(
+                (variation.account.full_name, variation.amount)
+                for variation in record.variations.all()
+            ))
+            for record in Record.objects.filter(ledger=ledger).order_by('date')
+        ]
+
+    def source_records(self):
+        """Export of the source ledger, without the account ids that are only valid there."""
+        for line in jsonl_lines(iter_records(self.ledger.pk)):
+            record_dict = json.loads(line)
+            for variations in record_dict['variations'].values():
+                for variation in variations:
+                    del variation['account_id']
+            yield json.dumps(record_dict) + '\n'
+
+    def import_(self, records, batch_size=1000):
+        errors, progress = [], []
+        n_imported = import_records(
+            self.target.pk, records, errors.append, progress.append, batch_size)
+        return n_imported, errors, progress
+
+    def test_jsonl_round_trip(self):
+        n_imported, errors, progress = self.import_(
+            jsonl_records(self.source_records()), batch_size=2)
+
+        self.assertEqual((n_imported, errors, progress), (5, [], [2, 4, 5]))
+        self.assertEqual(
+            self.record_summaries(self.target), self.record_summaries(self.ledger))
+        self.assertEqual(self.cash.total, -15)
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_csv_round_trip(self):
+        rows = list(csv.DictReader(csv_lines(iter_records(self.ledger.pk))))
+        for row in rows:
+            row['account_id'] = ''  # The source ledger's: resolve accounts by name instead
+        csv_file = StringIO()
+        writer = csv.DictWriter(csv_file, CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        csv_file.seek(0)
+
+        n_imported, errors, _ = self.import_(csv_records(csv_file))
+
+        self.assertEqual((n_imported, errors), (5, []))
+        self.assertEqual(
+            self.record_summaries(self.target), self.record_summaries(self.ledger))
+
+    def test_batch_queries(self):
+        records = [
+            (line, {
+                'date': '2019-10-01',
+                'description': '',
+                'variations': {
+                    'debit': [{'account_name': 'expenses / food', 'amount': 10}],
+                    'credit': [{'account_id': self.cash.pk, 'amount': 10}],
+                },
+            })
+            for line in range(100)
+        ]
+
+        # Accounts, then one transaction with the primary keys, records, variations (in two
+        # inserts, SQLite takes up to 999 parameters), the balances of the accounts and their
+        # ancestors, the stale balance checkpoints, the records' imbalance and version, their
+        # search index and the ledger's version
+        with self.assertNumQueries(1 + 2 + 4 + 3 + 1 + 1 + 2 + 1):
+            n_imported, errors, _ = self.import_(records)
+
+        self.assertEqual(n_imported, 100)
+        self.assertEqual(self.food.total, -100000)
+
+    def test_errors(self):
+        records = [
+            (1, {'date': '2019-13-01', 'variations': {}}),
+            (2, {'date': '2019-10-01', 'variations': {
+                'debit': [{'account_name': 'food', 'amount': 10}],
+                'credit': [{'account_name': 'cash', 'amount': 9}],
+            }}),
+            (3, {'date': '2019-10-01', 'variations': {
+                'debit': [{'account_name': 'nope', 'amount': 10}],
+                'credit': [{'account_name': 'cash', 'amount': -10}],
+            }}),
+            (4, None),
+            (5, {'date': '2019-10-01', 'variations': {
+                'debit': [{'account_name': 'food', 'amount': '10.50'}],
+                'credit': [{'account_name': 'cash', 'amount': 10.5}],
+            }}),
+            (6, {'date': '2019-10-01', 'variations': [1, 2]}),
+            (7, {'date': '2019-10-01', 'variations': {'debit': [5], 'credit': {'amount': 5}}}),
+            (8, {'date': '2019-10-01', 'description': ['food'], 'variations': {
+                'debit': [{'account_name': ['food'], 'amount': 10}],
+            }}),
+            (9, {'date': '2019-10-01', 'description': 'x', 'variations': {}}),
+        ]
+
+        n_imported, errors, _ = self.import_(records)
+
+        self.assertEqual(n_imported, 1)
+        self.assertEqual([error.line for error in errors], [1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual(errors[1].errors, ['Record is not balanced: debit 10.00, credit 9.00'])
+        self.assertEqual(len(errors[2].errors), 2)
+        self.assertEqual(errors[4].errors, ['Invalid variations'])
+        self.assertEqual(
+            errors[5].errors, ["Invalid variation type: 'credit'", 'Invalid variation: 5'])
+        self.assertEqual(
+            errors[6].errors, ["Invalid description: ['food']", "Unknown account: ['food']"])
+        self.assertEqual(errors[7].errors, ['Record needs debit and credit variations'])
+        self.assertEqual(self.cash.total, -1050)
+
+    def test_command(self):
+        lines = list(self.source_records()) + ['{"date": "nope"}\n']
+        with tempfile.TemporaryDirectory() as directory:
+            records_path = os.path.join(directory, 'records.jsonl')
+            errors_path = os.path.join(directory, 'errors.jsonl')
+            with open(records_path, 'w') as records_file:
+                records_file.writelines(lines)
+            output = StringIO()
+
+            call_command(
+                'import_records', self.target.pk, records_path, '--errors', errors_path,
+                stdout=output)
+
+            with open(errors_path) as errors_file:
+                errors = [json.loads(line) for line in errors_file]
+        self.assertIn('Done: 5 records imported, 1 errors', output.getvalue())
+        self.assertEqual(errors[0]['line'], 6)
+
+    def test_view(self):
+        url = reverse('record_import', args=[self.target.pk])
+        body = json.dumps({'date': '2019-10-01', 'description': 'Lunch', 'variations': {
+            'debit': [{'account_name': 'expenses / food', 'amount': 12}],
+            'credit': [{'account_name': 'cash', 'amount': 12}],
+        }}) + '\n{}\n'
+
+        response = self.client.post(
+            url + '?format=jsonl', body, content_type='application/x-ndjson')
+
+        self.assertEqual(json.loads(response.content), {
+            'imported': 1,
+            'errors': [{'line': 2, 'errors': ['Invalid date: None']}],
+        })
+        self.assertTrue(Record.objects.filter(ledger=self.target, description='Lunch').exists())
+
+    def test_view_unknown_ledger(self):
+        url = reverse('record_import', args=[self.target.pk + 100])
+
+        response = self.client.post(
+            url + '?format=jsonl', '{}\n', content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,97 @@
+import json
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .. import cache, views
+from ..middleware import QueryBudgetExceeded, QueryStats, fingerprint
+from ..models import Account, Ledger
+
+
+class TestQueryInstrumentation(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        Account.objects.create(name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.url = reverse('account_list_json', args=[self.ledger.pk])
+
+    def test_server_timing(self):
+        with self.assertLogs('leanledger.sql', 'INFO') as logs:
+            response = self.client.get(self.url)
+
+        self.assertRegex(
+            response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", total;dur=[\d.]+$')
+        self.assertEqual(response.wsgi_request.query_stats.count, 2)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['path'], line['queries'], line['budget']), (self.url, 2, 2))
+        self.assertEqual(len(line['slowest']), 2)
+
+    @override_settings(LEDGER_SQL_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(self.url)
+
+        self.assertNotIn('Server-Timing', response)
+
+    def test_over_budget(self):
+        with patch.object(views.account_list_json, 'query_budget', 1):
+            with self.assertLogs('leanledger.sql', 'WARNING'):
+                response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(LEDGER_SQL_BUDGET_STRICT=True, LEDGER_SQL_SAMPLE_RATE=0)
+    def test_over_budget_strict(self):
+        with patch.object(views.account_list_json, 'query_budget', 1):
+            with self.assertRaises(QueryBudgetExceeded), self.assertLogs('leanledger.sql'):
+                self.client.get(self.url)
+
+    def test_streaming(self):
+        url = reverse('ledger_export', args=[self.ledger.pk])
+        response = self.client.get(url)
+
+        self.assertNotIn('Server-Timing', response)
+        # The versions by the view, then the accounts and the first page of records as the
+        # content is consumed
+        with self.assertLogs('leanledger.sql', 'INFO') as logs:
+            b''.join(response.streaming_content)
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['path'], line['queries']), (url, 3))
+
+    @override_settings(LEDGER_SQL_BUDGET_STRICT=True)
+    def test_streaming_over_budget_strict(self):
+        with patch.object(views.ledger_export, 'query_budget', 1, create=True):
+            response = self.client.get(reverse('ledger_export', args=[self.ledger.pk]))
+
+        with self.assertRaises(QueryBudgetExceeded), self.assertLogs('leanledger.sql'):
+            b''.join(response.streaming_content)
+
+
+class TestQueryStats(TestCase):
+    def test_duplicates(self):
+        stats = QueryStats()
+        stats.queries = [
+            (0.002, 'SELECT * FROM t WHERE id IN (%s, %s)'),
+            (0.001, 'SELECT * FROM u'),
+            (0.003, 'SELECT * FROM t WHERE id IN (%s)'),
+        ]
+
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.slowest(1), [(0.003, 'SELECT * FROM t WHERE id IN (%s)')])
+        self.assertEqual(stats.duplicates(), [
+            (fingerprint('SELECT * FROM t WHERE id IN (%s)'), 2,
+             'SELECT * FROM t WHERE id IN (%s)'),
+        ])
+
+
+class TestFingerprint(TestCase):
+    def test_in_lists(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'))
+        self.assertNotEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'),
+            fingerprint('SELECT * FROM u WHERE id IN (%s, %s)'))
@@ -1,11 +1,13 @@
 from datetime import date
-from decimal import Decimal
-from unittest.mock import Mock, patch
+from io import StringIO
+from unittest.mock import Mock
 
+from django.core.management import CommandError, call_command
+from django.db.models import Sum
 from django.test import TestCase
 from django.contrib.auth.models import User
 
-from ..models import Account, Ledger, Record, Variation
+from ..models import Account, AccountBalance, BalanceCheckpoint, Ledger, Record, Variation
 
 
 def set_up_class(test_case):
@@ -23,11 +25,11 @@ def set_up_class(test_case):
     test_case.account_expense_three = Account.objects.create(
         name='expense three', type=Account.ORIGIN, ledger=test_case.ledger)
     test_case.variation_cash = Variation.objects.create(
-        amount=-100, record=test_case.record, account=test_case.account_cash)
+        amount=-10000, record=test_case.record, account=test_case.account_cash)
     test_case.variation_expense_one = Variation.objects.create(
-        amount=-40, record=test_case.record, account=test_case.account_expense_one)
+        amount=-4000, record=test_case.record, account=test_case.account_expense_one)
     test_case.variation_expense_two = Variation.objects.create(
-        amount=-60, record=test_case.record, account=test_case.account_expense_two)
+        amount=-6000, record=test_case.record, account=test_case.account_expense_two)
 
 
 def tear_down_class(test_case):
@@ -92,7 +94,18 @@ class TestAccount(TestCase):
     def test_account_total(self):
         cash = Account.objects.get(name='cash')
 
-        self.assertEqual(cash.total, Decimal('160'))
+        self.assertEqual(cash.total, 160)
+
+    def test_tree(self):
+        with self.assertNumQueries(1):
+            accounts = Account.objects.tree(self.ledger.pk)
+            cash = accounts[self.cash.pk]
+            children = {account.name: account.total for account in cash.subaccounts}
+            breadcrumbs = accounts[self.bank_two_sub.pk].get_breadcrumbs()
+
+        self.assertEqual(cash.total, 160)
+        self.assertEqual(children, {'bank one': 80, 'bank two': 80})
+        self.assertEqual(breadcrumbs, (self.cash, self.bank_two, self.bank_two_sub))
 
     def test_breadcrumbs(self):
         breadcrumbs = (self.cash, self.bank_two, self.bank_two_sub)
@@ -101,6 +114,54 @@ class TestAccount(TestCase):
     def test_full_name(self):
         self.assertEqual(self.bank_two_sub.full_name, 'cash / bank two / sub bank two')
 
+    def test_breadcrumbs_queries(self):
+        account = Account.objects.get(pk=self.bank_two_sub.pk)
+
+        # All the ancestors at once, from the path
+        with self.assertNumQueries(1):
+            self.assertEqual(account.full_name, 'cash / bank two / sub bank two')
+
+    def test_descendants(self):
+        descendants = Account.objects.descendants(self.cash)
+
+        self.assertEqual(
+            {account.name for account in descendants}, {'bank one', 'bank two', 'sub bank two'})
+        self.assertEqual(list(Account.objects.descendants(self.bank_two_sub)), [])
+
+    def test_reparent_paths(self):
+        wallet = Account.objects.create(
+            name='wallet', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        bank_two = Account.objects.get(pk=self.bank_two.pk)
+
+        bank_two.parent = wallet
+        bank_two.save()
+
+        sub_bank_two = Account.objects.get(pk=self.bank_two_sub.pk)
+        self.assertEqual(sub_bank_two.full_name, 'cash / wallet / bank two / sub bank two')
+        self.assertEqual(Account.objects.verify_paths(), [])
+
+        bank_two.parent = self.cash
+        bank_two.save()
+        wallet.delete()
+
+        self.assertEqual(Account.objects.verify_paths(), [])
+
+    def test_stale_instance_path(self):
+        a = Account.objects.create(name='a', type=Account.DESTINATION, ledger=self.ledger)
+        b = Account.objects.create(name='b', type=Account.DESTINATION, ledger=self.ledger)
+        c = Account.objects.create(
+            name='c', type=Account.DESTINATION, parent=b, ledger=self.ledger)
+        stale_c = Account.objects.get(pk=c.pk)
+
+        b.parent = a
+        b.save()
+        stale_c.name = 'renamed c'
+        stale_c.save()
+
+        self.assertEqual(Account.objects.verify_paths(), [])
+        self.assertEqual(Account.objects.get(pk=c.pk).get_breadcrumbs(), (a, b, c))
+        a.delete()
+
     def test_as_dict(self):
         account_dict = self.cash.as_dict()
 
@@ -170,6 +231,15 @@ class TestRecord(TestCase):
         }
         self.assertEqual(record_dict, expected)
 
+    def test_with_variations(self):
+        records = Record.objects.filter(pk=self.record.pk)
+
+        with self.assertNumQueries(3):
+            record = Record.objects.with_variations(records, self.ledger.pk)[0]
+            record_dict = record.as_dict()
+
+        self.assertEqual(record_dict, self.record.as_dict())
+
     def test_update_from_dict_record(self):
         new_record_state = {
             "date": "2020-01-01",
@@ -193,14 +263,115 @@ class TestRecord(TestCase):
                                       "id": self.variation_expense_one.pk}]}
         }
 
-        with patch.object(Variation, "objects") as variation_objects:
-            self.record.update_from_dict(new_record_state)
+        variations = self.record.variations_by_type()
+
+        self.record.update_from_dict(new_record_state)
 
-        variation_objects.create_variations_from_dict.assert_called_once()
-        variation_objects.update_variations_from_dict.assert_called_once()
-        variation_objects.delete_variations_from_dict.assert_called_once()
+        self.record.refresh_from_db()
         self.assertEqual(self.record.date, date(2020, 1, 1))
         self.assertEqual(self.record.description, "New description")
+        self.assertEqual(self.record.variations_by_type(), variations)
+
+    def test_update_from_dict_queries(self):
+        new_record_state = self.record.as_dict()
+        new_record_state["variations"]["debit"][0]["amount"] = 50
+        new_record_state["variations"]["debit"].pop()
+        new_record_state["variations"]["debit"].append({
+            "account_id": self.account_bank.pk, "amount": 50, "id": 1000})
+        record = Record.objects.get(pk=self.record.pk)
+
+        # Accounts, transaction, existing variations, new primary keys, create, update,
+        # delete (select and delete), balances (own, ancestors and totals), stale balance
+        # checkpoints, the record's imbalance and version, its search index, the ledger's
+        # version, and no query at all to build the response
+        with self.assertNumQueries(1 + 2 + 1 + 1 + 1 + 1 + 2 + 3 + 1 + 1 + 2 + 1):
+            record.update_from_dict(new_record_state)
+            record_dict = record.as_dict()
+
+        self.assertEqual(record_dict, Record.objects.get(pk=self.record.pk).as_dict())
+        self.assertEqual(
+            [variation["amount"] for variation in record_dict["variations"]["debit"]], [50, 50])
+
+    def test_update_from_dict_unknown_account(self):
+        new_record_state = self.record.as_dict()
+        new_record_state["variations"]["debit"][0]["account_id"] = 0
+
+        with self.assertRaises(Account.DoesNotExist):
+            self.record.update_from_dict(new_record_state)
+
+    def create_records(self, n_records):
+        records = []
+        for day in range(1, n_records + 1):
+            record = Record.objects.create(date=date(2019, 10, day), ledger=self.ledger)
+            Variation.objects.create(
+                amount=-day * 100, record=record, account=self.account_cash)
+            Variation.objects.create(
+                amount=-day * 100, record=record, account=self.account_expense_one)
+            records.append(record)
+        return Record.objects.with_variations(records, self.ledger.pk)
+
+    def recategorized(self, records):
+        """States of ``records`` moved to November, with expense one replaced by expense two."""
+        states = [record.as_dict() for record in records]
+        for state in states:
+            state['date'] = state['date'].replace('-10-', '-11-')
+            state['variations']['debit'][0]['account_id'] = self.account_expense_two.pk
+        return states
+
+    def test_update_from_dicts(self):
+        BalanceCheckpoint.objects.build(Account.objects.filter(ledger=self.ledger))
+        records = self.create_records(3)
+        # The first record gets a second debit and loses it back to the credit
+        states = self.recategorized(records)
+        states[0]['variations']['debit'].append(
+            {'account_id': self.account_expense_three.pk, 'amount': 1, 'id': 1000})
+        states[0]['variations']['credit'][0]['amount'] = 2
+
+        updated, errors = Record.objects.update_from_dicts(self.ledger.pk, states)
+
+        self.assertEqual(errors, {})
+        self.assertEqual(
+            [record.as_dict() for record in updated],
+            [record.as_dict() for record in Record.objects.filter(
+                pk__in=[record.pk for record in records]).order_by('pk')])
+        self.assertEqual(Account.objects.get(pk=self.account_expense_one.pk).total, -4000)
+        self.assertEqual(Account.objects.get(pk=self.account_expense_two.pk).total, -6600)
+        self.assertEqual(Account.objects.get(pk=self.account_expense_three.pk).total, -100)
+        self.assertEqual(AccountBalance.objects.verify(self.ledger.pk), [])
+        self.assertEqual(BalanceCheckpoint.objects.verify(self.ledger.pk), [])
+        self.assertEqual(Record.objects.verify_imbalances(self.ledger.pk), [])
+
+    def test_update_from_dicts_queries(self):
+        for n_records in (2, 20):
+            Record.objects.exclude(pk=self.record.pk).delete()
+            states = self.recategorized(self.create_records(n_records))
+
+            # Accounts, records, variations, transaction, records, the date of their variations,
+            # variations, balances (own, ancestors and totals), stale balance checkpoints, the
+            # records' imbalance and version, their search index and the ledger's version,
+            # however many records there are
+            with self.assertNumQueries(1 + 1 + 1 + 2 + 1 + 1 + 1 + 3 + 1 + 1 + 2 + 1):
+                Record.objects.update_from_dicts(self.ledger.pk, states)
+
+    def test_update_from_dicts_invalid(self):
+        records = self.create_records(2)
+        states = self.recategorized(records) + [{'id': 0}]
+        states[1]['variations']['credit'][0]['amount'] = 'NaN'
+        states[0]['id'] = states[1]['id']
+
+        updated, errors = Record.objects.update_from_dicts(self.ledger.pk, states)
+
+        self.assertEqual(updated, [])
+        self.assertEqual(errors, {
+            0: ['Record {} is in more than one state'.format(records[1].pk)],
+            1: ['Record {} is in more than one state'.format(records[1].pk),
+                "Invalid amount: 'NaN'"],
+            2: ['Unknown record: 0', 'Invalid date: None', 'Invalid description: None',
+                'Invalid variations'],
+        })
+        self.assertEqual(
+            [record.as_dict() for record in Record.objects.filter(pk__in=[r.pk for r in records])],
+            [record.as_dict() for record in records])
 
 
 class TestVariation(TestCase):
@@ -208,15 +379,19 @@ class TestVariation(TestCase):
         set_up_class(self)
         self.record_2 = Record.objects.create(date=date(2019, 10, 14), ledger=self.ledger)
         self.variation_cash_2 = Variation.objects.create(
-            amount=-200, record=self.record_2, account=self.account_cash
+            amount=-20000, record=self.record_2, account=self.account_cash
         )
         self.variation_expense_one_2 = Variation.objects.create(
-            amount=-200, record=self.record_2, account=self.account_expense_one
+            amount=-20000, record=self.record_2, account=self.account_expense_one
         )
 
-    tearDownClass = classmethod(tear_down_class)
+    @classmethod
+    def tearDownClass(cls):
+        tear_down_class(cls)
+        # Leaves the class' transaction, so later test cases don't run inside it
+        super().tearDownClass()
 
-    def test_create_variations_from_dict(self):
+    def test_update_from_dict_create_variations(self):
         variations_state = {"credit": [{"account_name": "cash",
                                        "account_url": self.account_cash.get_absolute_url(),
                                        "account_id": self.account_cash.pk,
@@ -239,20 +414,18 @@ class TestVariation(TestCase):
                                       "account_id": self.account_expense_one.pk,
                                       "amount": 40.0,
                                       "id": self.variation_expense_one.pk}]}
-        existing_variations = self.record.variations_by_type()
         n_variations = self.record.variations.count()
 
-        Variation.objects.create_variations_from_dict(
-            self.record, existing_variations, variations_state
-        )
+        self.record.update_from_dict(
+            {"date": "2019-09-14", "description": "", "variations": variations_state})
 
         # If it doesn't exist, an exception will be raised:
         new_variation = self.record.variations.get(account__name="bank")
         # Amount sign is changed according to account type and variation type (debit/credit)
-        self.assertEqual(new_variation.amount, -50)
+        self.assertEqual(new_variation.amount, -5000)
         self.assertEqual(self.record.variations.count(), n_variations + 1)
 
-    def test_update_variations_from_dict(self):
+    def test_update_from_dict_update_variations(self):
         variations_state = {"credit": [{"account_name": "cash",
                                        "account_url": self.account_cash.get_absolute_url(),
                                        "account_id": self.account_cash.pk,
@@ -269,15 +442,14 @@ class TestVariation(TestCase):
                                       "account_id": self.account_expense_one.pk,
                                       "amount": 30.0,
                                       "id": self.variation_expense_one.pk}]}
-        existing_variations = self.record.variations_by_type()
-
-        Variation.objects.update_variations_from_dict(existing_variations, variations_state)
+        self.record.update_from_dict(
+            {"date": "2019-09-14", "description": "", "variations": variations_state})
 
         self.variation_expense_two.refresh_from_db()
-        self.assertEqual(self.variation_expense_two.amount, -70)
+        self.assertEqual(self.variation_expense_two.amount, -7000)
         self.assertEqual(self.variation_expense_two.account.pk, self.account_expense_three.pk)
 
-    def test_delete_variations_from_dict(self):
+    def test_update_from_dict_delete_variations(self):
         variations_state = {"credit": [{"account_name": "cash",
                                        "account_url": self.account_cash.get_absolute_url(),
                                        "account_id": self.account_cash.pk,
@@ -289,14 +461,13 @@ class TestVariation(TestCase):
                                       "account_id": self.account_expense_two.pk,
                                       "amount": 60,
                                       "id": self.variation_expense_two.pk}]}
-        existing_variations = self.record.variations_by_type()
-
-        Variation.objects.delete_variations_from_dict(existing_variations, variations_state)
+        self.record.update_from_dict(
+            {"date": "2019-09-14", "description": "", "variations": variations_state})
 
         self.assertFalse(Variation.objects.filter(pk=self.variation_expense_one.pk).exists())
 
     def test_total(self):
-        self.assertEqual(self.account_cash.variations.total, Decimal('-300'))
+        self.assertEqual(self.account_cash.variations.total, -30000)
 
     def test_from_dict(self):
         """
@@ -312,7 +483,7 @@ class TestVariation(TestCase):
 
         variation = Variation.from_dict(variation_dict, Variation.CREDIT, self.record)
 
-        self.assertEqual(variation.amount, -70)
+        self.assertEqual(variation.amount, -7000)
 
     def test_type(self):
         # TODO
@@ -341,7 +512,7 @@ class TestVariation(TestCase):
 
         self.variation_cash.update_from_dict(new_variation_state, Variation.CREDIT)
 
-        self.assertEqual(self.variation_cash.amount, -50)
+        self.assertEqual(self.variation_cash.amount, -5000)
         self.assertEqual(self.variation_cash.account.pk, self.account_cash.pk)
 
     def test_update_from_dict_account(self):
@@ -356,4 +527,589 @@ class TestVariation(TestCase):
         self.variation_expense_one.update_from_dict(new_variation_state, Variation.DEBIT)
 
         self.assertEqual(self.variation_expense_one.account.pk, self.account_expense_two.pk)
-        self.assertEqual(self.variation_expense_one.amount, -200)
+        self.assertEqual(self.variation_expense_one.amount, -20000)
+
+
+class TestVariationMatching(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.expenses = Account.objects.create(
+            name='expenses', type=Account.ORIGIN, ledger=self.ledger)
+        self.food = Account.objects.create(
+            name='food', type=Account.ORIGIN, parent=self.expenses, ledger=self.ledger)
+        self.rent = Account.objects.create(
+            name='rent', type=Account.ORIGIN, parent=self.expenses, ledger=self.ledger)
+        # Spending from cash, and a refund of food
+        self.march = self.create_record(date(2019, 3, 10), self.food, 30)
+        self.april = self.create_record(date(2019, 4, 1), self.rent, 500)
+        self.may = self.create_record(date(2019, 5, 20), self.food, 80)
+        self.refund = self.create_record(date(2019, 5, 25), self.food, -60)
+        other_ledger = Ledger.objects.create(user=self.user, name='Other Ledger')
+        Record.objects.create(date=date(2019, 4, 1), ledger=other_ledger)
+
+    def create_record(self, date_, account, amount):
+        record = Record.objects.create(date=date_, ledger=self.ledger)
+        Variation.objects.create(amount=-amount, record=record, account=self.cash)
+        Variation.objects.create(amount=-amount, record=record, account=account)
+        return record
+
+    def matching(self, accounts=None, **kwargs):
+        return Variation.objects.matching(self.ledger.pk, accounts, **kwargs)
+
+    def records(self, variations):
+        return list(
+            variations.order_by('record__date', 'pk').values_list('record__date', 'amount'))
+
+    def test_accounts(self):
+        tree = Account.objects.tree(self.ledger.pk)
+
+        self.assertEqual(self.records(self.matching(tree[self.expenses.pk].subtree())), [
+            (date(2019, 3, 10), -30), (date(2019, 4, 1), -500), (date(2019, 5, 20), -80),
+            (date(2019, 5, 25), 60),
+        ])
+        self.assertEqual(self.records(self.matching([self.rent])), [(date(2019, 4, 1), -500)])
+        self.assertEqual(self.matching().count(), 8)
+        self.assertFalse(self.matching([]).exists())
+
+    def test_dates(self):
+        variations = self.matching([self.food], start=date(2019, 4, 1), end=date(2019, 5, 20))
+
+        self.assertEqual(self.records(variations), [(date(2019, 5, 20), -80)])
+
+    def test_amounts_and_directions(self):
+        # In absolute value, and spending is a debit of food, the refund a credit
+        self.assertEqual(self.records(self.matching([self.food], min_amount=50)), [
+            (date(2019, 5, 20), -80), (date(2019, 5, 25), 60),
+        ])
+        self.assertEqual(
+            self.records(self.matching([self.food], max_amount=60, direction=Variation.DEBIT)),
+            [(date(2019, 3, 10), -30)])
+        self.assertEqual(self.records(self.matching(direction=Variation.DEBIT, max_amount=60)), [
+            (date(2019, 3, 10), -30), (date(2019, 5, 25), 60),
+        ])
+        self.assertEqual(
+            self.records(self.matching([self.cash], direction=Variation.CREDIT, min_amount=40)),
+            [(date(2019, 4, 1), -500), (date(2019, 5, 20), -80)])
+
+    def test_query_plans(self):
+        def plan(*args, **kwargs):
+            variations = self.matching(*args, **kwargs)
+            # As ``variations_page`` reads them
+            return variations.select_related('record').order_by('-date', '-pk')[:51].explain()
+
+        # Newest first from the ledger and date index, which has every filtered column: only
+        # the records of the page are read, and the matches aren't sorted
+        subtree = plan(
+            [self.expenses, self.food, self.rent], start=date(2019, 3, 1), end=date(2019, 5, 31),
+            min_amount=50)
+        self.assertIn('variation_ledger_date_idx (ledger_id=? AND date>? AND date<?)', subtree)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', subtree)
+        self.assertNotIn('SCAN', subtree)
+
+        everything = plan(direction=Variation.CREDIT)
+        self.assertIn('variation_ledger_date_idx (ledger_id=?)', everything)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', everything)
+        self.assertNotIn('SCAN', everything)
+
+    def denormalized(self, record):
+        return sorted(
+            record.variations.values_list('account__name', 'ledger', 'date', 'direction'))
+
+    def test_denormalized(self):
+        self.assertEqual(self.denormalized(self.refund), [
+            ('cash', self.ledger.pk, date(2019, 5, 25), Variation.DEBIT),
+            ('food', self.ledger.pk, date(2019, 5, 25), Variation.CREDIT),
+        ])
+
+        self.refund.date = date(2019, 6, 1)
+        self.refund.save()
+        variation = self.refund.variations.get(account=self.food)
+        variation.amount = -60
+        variation.save()
+
+        self.assertEqual(self.denormalized(self.refund), [
+            ('cash', self.ledger.pk, date(2019, 6, 1), Variation.DEBIT),
+            ('food', self.ledger.pk, date(2019, 6, 1), Variation.DEBIT),
+        ])
+
+    def test_denormalized_bulk_writes(self):
+        state = self.march.as_dict()
+        state['date'] = '2019-03-11'
+        state['variations']['debit'][0]['account_id'] = self.rent.pk
+
+        _, errors = Record.objects.update_from_dicts(self.ledger.pk, [state])
+
+        self.assertEqual(errors, {})
+
+        self.assertEqual(self.denormalized(self.march), [
+            ('cash', self.ledger.pk, date(2019, 3, 11), Variation.CREDIT),
+            ('rent', self.ledger.pk, date(2019, 3, 11), Variation.DEBIT),
+        ])
+
+    def test_account_type(self):
+        self.food.type = Account.DESTINATION
+        self.food.save()
+
+        self.assertEqual(self.denormalized(self.refund), [
+            ('cash', self.ledger.pk, date(2019, 5, 25), Variation.DEBIT),
+            ('food', self.ledger.pk, date(2019, 5, 25), Variation.DEBIT),
+        ])
+        self.assertEqual(
+            self.records(self.matching([self.food], direction=Variation.CREDIT)),
+            [(date(2019, 3, 10), -30), (date(2019, 5, 20), -80)])
+
+    def test_rebuild_denormalized(self):
+        variation = self.april.variations.get(account=self.rent)
+        Variation.objects.filter(pk=variation.pk).update(
+            date=date(2000, 1, 1), direction=Variation.CREDIT)
+
+        self.assertEqual(Variation.objects.verify_denormalized(), [(
+            variation.pk,
+            (self.ledger.pk, date(2019, 4, 1), Variation.DEBIT),
+            (self.ledger.pk, date(2000, 1, 1), Variation.CREDIT),
+        )])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        call_command('rebuild_balances', stdout=StringIO())
+
+        self.assertEqual(Variation.objects.verify_denormalized(), [])
+
+
+class TestAccountBalance(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.bank = Account.objects.create(
+            name='bank', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        self.wallet = Account.objects.create(
+            name='wallet', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        self.wealth = Account.objects.create(
+            name='wealth', type=Account.ORIGIN, ledger=self.ledger)
+        self.record = Record.objects.create(date=date(2019, 9, 14), ledger=self.ledger)
+
+    def assertTotals(self, expected):
+        totals = {
+            account.name: account.total
+            for account in Account.objects.filter(ledger=self.ledger)
+        }
+        self.assertEqual(totals, expected)
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_create(self):
+        Variation.objects.create(amount=3000, record=self.record, account=self.bank)
+        Variation.objects.create(amount=2010, record=self.record, account=self.wallet)
+
+        self.assertTotals({'cash': 5010, 'bank': 3000, 'wallet': 2010, 'wealth': 0})
+
+    def test_update(self):
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.bank)
+
+        variation.account, variation.amount = self.wealth, 10
+        variation.save()
+
+        self.assertTotals({'cash': 0, 'bank': 0, 'wallet': 0, 'wealth': 10})
+
+    def test_update_fields(self):
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.bank)
+
+        variation.account, variation.amount = self.wealth, 10
+        variation.save(update_fields=['amount'])
+
+        self.assertTotals({'cash': 10, 'bank': 10, 'wallet': 0, 'wealth': 0})
+
+    def test_delete(self):
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.bank)
+        Variation.objects.create(amount=5, record=self.record, account=self.wallet)
+
+        variation.delete()
+
+        self.assertTotals({'cash': 5, 'bank': 0, 'wallet': 5, 'wealth': 0})
+
+    def test_delete_record(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.bank)
+
+        self.record.delete()
+
+        self.assertTotals({'cash': 0, 'bank': 0, 'wallet': 0, 'wealth': 0})
+
+    def test_delete_account(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.bank)
+        Variation.objects.create(amount=5, record=self.record, account=self.wallet)
+
+        self.bank.delete()
+
+        self.assertTotals({'cash': 5, 'wallet': 5, 'wealth': 0})
+
+    def test_bulk_create(self):
+        Variation.objects.bulk_create([
+            Variation(amount=30, record=self.record, account=self.bank),
+            Variation(amount=-30, record=self.record, account=self.wealth),
+            Variation(amount=2, record=self.record, account=self.bank),
+        ])
+
+        self.assertTotals({'cash': 32, 'bank': 32, 'wallet': 0, 'wealth': -30})
+
+    def test_reparent(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.bank)
+        account = Account.objects.get(pk=self.bank.pk)
+
+        account.parent = self.wallet
+        account.save()
+
+        self.assertTotals({'cash': 30, 'bank': 30, 'wallet': 30, 'wealth': 0})
+
+    def test_update_from_dict(self):
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.bank)
+        Variation.objects.create(amount=30, record=self.record, account=self.wealth)
+
+        self.record.update_from_dict({
+            "date": self.record.date,
+            "description": "",
+            "variations": {
+                "debit": [{"id": variation.pk, "account_id": self.wallet.pk, "amount": 0.4}],
+                "credit": [{"id": variation.pk + 10, "account_id": self.wealth.pk, "amount": 0.4}],
+            },
+        })
+
+        self.assertTotals({'cash': 40, 'bank': 0, 'wallet': 40, 'wealth': 40})
+
+    def test_rebuild(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.bank)
+        AccountBalance.objects.filter(account=self.bank).update(total=0)
+        AccountBalance.objects.filter(account=self.wealth).delete()
+
+        self.assertEqual(len(AccountBalance.objects.verify()), 2)
+
+        call_command('rebuild_balances', stdout=StringIO())
+
+        self.assertTotals({'cash': 30, 'bank': 30, 'wallet': 0, 'wealth': 0})
+
+    def test_rebuild_paths(self):
+        Account.objects.filter(pk=self.bank.pk).update(path='')
+
+        self.assertEqual(Account.objects.verify_paths(), [(self.bank.pk, self.bank.path, '')])
+
+        call_command('rebuild_balances', stdout=StringIO())
+
+        self.assertEqual(Account.objects.verify_paths(), [])
+
+    def test_verify_command(self):
+        AccountBalance.objects.filter(account=self.bank).update(total=1)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+
+class TestRecordImbalance(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.wealth = Account.objects.create(
+            name='wealth', type=Account.ORIGIN, ledger=self.ledger)
+        self.record = Record.objects.create(date=date(2019, 9, 14), ledger=self.ledger)
+
+    def assertImbalance(self, expected):
+        self.assertEqual(Record.objects.get(pk=self.record.pk).imbalance, expected)
+        self.assertEqual(Record.objects.verify_imbalances(), [])
+
+    def test_create(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+
+        self.assertImbalance(30)
+        self.assertEqual(list(Record.objects.unbalanced(self.ledger.pk)), [self.record])
+
+    def test_balanced(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+        Variation.objects.create(amount=30, record=self.record, account=self.wealth)
+
+        self.assertImbalance(0)
+        self.assertTrue(Record.objects.get(pk=self.record.pk).is_balanced())
+        self.assertEqual(list(Record.objects.unbalanced(self.ledger.pk)), [])
+
+    def test_update(self):
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.cash)
+        Variation.objects.create(amount=30, record=self.record, account=self.wealth)
+
+        variation.amount = 20
+        variation.save()
+
+        self.assertImbalance(-10)
+
+    def test_delete(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+        variation = Variation.objects.create(amount=30, record=self.record, account=self.wealth)
+
+        variation.delete()
+
+        self.assertImbalance(30)
+
+    def test_bulk_create(self):
+        Variation.objects.bulk_create([
+            Variation(amount=30, record=self.record, account=self.cash),
+            Variation(amount=20, record=self.record, account=self.wealth),
+        ])
+
+        self.assertImbalance(10)
+
+    def test_account_type(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+        Variation.objects.create(amount=30, record=self.record, account=self.wealth)
+        version = Record.objects.get(pk=self.record.pk).version
+
+        # Both variations are debits now
+        self.wealth.type = Account.DESTINATION
+        self.wealth.save()
+
+        self.assertImbalance(60)
+        self.assertEqual(list(Record.objects.unbalanced(self.ledger.pk)), [self.record])
+        self.assertGreater(Record.objects.get(pk=self.record.pk).version, version)
+
+    def test_cents(self):
+        # 0.1 + 0.2 isn't 0.3 in floating point, amounts are added up in cents
+        self.record.update_from_dict({
+            "date": self.record.date,
+            "description": "",
+            "variations": {
+                "debit": [{"id": 1000, "account_id": self.cash.pk, "amount": 0.3}],
+                "credit": [
+                    {"id": 1001, "account_id": self.wealth.pk, "amount": 0.1},
+                    {"id": 1002, "account_id": self.wealth.pk, "amount": 0.2},
+                ],
+            },
+        })
+
+        self.assertImbalance(0)
+        self.assertEqual(list(Record.objects.unbalanced(self.ledger.pk)), [])
+
+    def test_update_from_dict(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+
+        self.record.update_from_dict({
+            "date": self.record.date,
+            "description": "",
+            "variations": {
+                "debit": [{"id": 1000, "account_id": self.cash.pk, "amount": 40.0}],
+                "credit": [{"id": 1001, "account_id": self.wealth.pk, "amount": 40.0}],
+            },
+        })
+
+        self.assertImbalance(0)
+        self.assertTrue(self.record.is_balanced())
+
+    def test_rebuild(self):
+        Variation.objects.create(amount=30, record=self.record, account=self.cash)
+        Record.objects.filter(pk=self.record.pk).update(imbalance=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+
+        self.assertImbalance(30)
+
+
+class TestBalanceCheckpoint(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.bank = Account.objects.create(
+            name='bank', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        self.wealth = Account.objects.create(
+            name='wealth', type=Account.ORIGIN, ledger=self.ledger)
+        self.january = self.create_record(date(2019, 1, 15), [(self.cash, 100), (self.wealth, 100)])
+        self.february = self.create_record(date(2019, 2, 10), [(self.bank, 50), (self.wealth, 50)])
+        self.april = self.create_record(date(2019, 4, 30), [(self.cash, -30), (self.wealth, -30)])
+        self.build()
+
+    def create_record(self, date_, variations):
+        record = Record.objects.create(date=date_, ledger=self.ledger)
+        for account, amount in variations:
+            Variation.objects.create(amount=amount, record=record, account=account)
+        return record
+
+    def build(self):
+        return BalanceCheckpoint.objects.build(
+            Account.objects.filter(ledger=self.ledger), until=date(2019, 6, 1))
+
+    def checkpoints(self, account):
+        return list(account.checkpoints.order_by('date').values_list('date', 'own_total'))
+
+    def expected_balance(self, account, date_):
+        accounts = [account] + list(Account.objects.descendants(account))
+        variations = Variation.objects.filter(account__in=accounts, record__date__lte=date_)
+        return variations.aggregate(Sum('amount'))['amount__sum'] or 0
+
+    def assertBalancesAsOf(self, *dates):
+        self.assertEqual(BalanceCheckpoint.objects.verify(self.ledger.pk), [])
+        for account in (self.cash, self.bank, self.wealth):
+            for date_ in dates:
+                self.assertEqual(
+                    account.balance_as_of(date_), self.expected_balance(account, date_))
+
+    def test_build(self):
+        self.assertEqual(self.checkpoints(self.cash), [
+            (date(2019, 1, 31), 100),
+            (date(2019, 2, 28), 100),
+            (date(2019, 3, 31), 100),
+            (date(2019, 4, 30), 70),
+            (date(2019, 5, 31), 70),
+        ])
+        self.assertEqual(self.checkpoints(self.bank)[0], (date(2019, 2, 28), 50))
+        # Already built
+        self.assertEqual(self.build(), 0)
+
+    def test_balance_as_of(self):
+        # Latest checkpoints and the variations after them
+        with self.assertNumQueries(2):
+            self.assertEqual(self.cash.balance_as_of(date(2019, 4, 15)), 150)
+
+        self.assertBalancesAsOf(
+            date(2018, 12, 31), date(2019, 1, 15), date(2019, 2, 28), date(2019, 4, 30),
+            date(2019, 8, 1))
+
+    def test_backdated_update(self):
+        january = list(self.cash.checkpoints.filter(date=date(2019, 1, 31)))
+
+        self.february.update_from_dict({
+            "date": self.february.date,
+            "description": "",
+            "variations": {
+                "debit": [{"id": 1000, "account_id": self.cash.pk, "amount": 0.8}],
+                "credit": [{"id": 1001, "account_id": self.wealth.pk, "amount": 0.8}],
+            },
+        })
+
+        # Only the checkpoints from February were built again
+        self.assertEqual(list(self.cash.checkpoints.filter(date=date(2019, 1, 31))), january)
+        self.assertEqual(self.checkpoints(self.cash)[1], (date(2019, 2, 28), 180))
+        self.assertEqual(self.checkpoints(self.bank), [])
+        self.assertBalancesAsOf(date(2019, 2, 28), date(2019, 5, 31))
+
+    def test_move_record(self):
+        record = Record.objects.get(pk=self.april.pk)
+        record.date = date(2019, 1, 1)
+        record.save()
+
+        self.assertEqual(self.checkpoints(self.cash)[0], (date(2019, 1, 31), 70))
+        self.assertBalancesAsOf(date(2019, 1, 1), date(2019, 3, 31), date(2019, 5, 31))
+
+    def test_delete_record(self):
+        self.january.delete()
+
+        # From the first variation left
+        self.assertEqual(self.checkpoints(self.cash)[0], (date(2019, 4, 30), -30))
+        self.assertBalancesAsOf(date(2019, 3, 31), date(2019, 5, 31))
+
+    def test_missing_checkpoints(self):
+        BalanceCheckpoint.objects.filter(date__gt=date(2019, 2, 28)).delete()
+
+        self.assertBalancesAsOf(date(2019, 4, 30), date(2019, 5, 31))
+
+    def test_verify_command(self):
+        BalanceCheckpoint.objects.filter(account=self.bank).update(own_total=1)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+
+class TestVersions(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.record = Record.objects.create(date=date(2019, 9, 14), ledger=self.ledger)
+
+    def versions(self):
+        ledger = Ledger.objects.get(pk=self.ledger.pk)
+        record_version = Record.objects.filter(pk=self.record.pk).values_list(
+            'version', flat=True).first()
+        return ledger.version, ledger.accounts_version, record_version
+
+    def assertBumped(self, write, ledger=1, accounts=0, record=1):
+        before = self.versions()
+        modified = Ledger.objects.get(pk=self.ledger.pk).modified
+
+        write()
+
+        after = self.versions()
+        bumped = [after[0] - before[0], after[1] - before[1]]
+        if record is not None:
+            bumped.append(after[2] - before[2])
+        self.assertEqual(bumped, [ledger, accounts] + ([record] if record is not None else []))
+        if ledger:
+            self.assertGreater(Ledger.objects.get(pk=self.ledger.pk).modified, modified)
+
+    def test_variation_writes(self):
+        def create():
+            self.variation = Variation.objects.create(
+                amount=10, record=self.record, account=self.cash)
+
+        def update():
+            self.variation.amount = 20
+            self.variation.save()
+
+        self.assertBumped(create)
+        self.assertBumped(update)
+        self.assertBumped(self.variation.delete)
+
+    def test_record_writes(self):
+        def update():
+            self.record.description = 'Groceries'
+            self.record.save()
+
+        self.assertBumped(update)
+        # Gone with its version
+        self.assertBumped(self.record.delete, record=None)
+
+    def test_account_writes(self):
+        def rename():
+            self.cash.name = 'wallet'
+            self.cash.save()
+
+        self.assertBumped(rename, accounts=1, record=0)
+        self.assertBumped(self.cash.delete, accounts=1, record=0)
+
+    def test_ledger_writes(self):
+        def rename():
+            self.ledger.name = 'Our Ledger'
+            self.ledger.save()
+
+        self.assertBumped(rename, record=0)
+
+    def test_rebuild_balances(self):
+        self.assertBumped(
+            lambda: call_command('rebuild_balances', stdout=StringIO()), accounts=1)
+
+    def test_deleted_record_versions(self):
+        Variation.objects.create(amount=10, record=self.record, account=self.cash)
+        deleted_version = self.versions()[2]
+        self.record.delete()
+
+        self.record = Record.objects.create(date=date(2019, 9, 15), ledger=self.ledger)
+
+        # Record versions are ledger versions, so the versions (and ETags) of deleted records
+        # aren't reused, even by a record with the same primary key
+        ledger_version, _, version = self.versions()
+        self.assertEqual(version, ledger_version)
+        self.assertGreater(version, deleted_version)
+
+    def test_stale_saves_keep_versions(self):
+        stale_record, stale_ledger = self.record, self.ledger
+        Variation.objects.create(amount=10, record=self.record, account=self.cash)
+        before = self.versions()
+
+        stale_record.save()
+        stale_ledger.save()
+
+        after = self.versions()
+        self.assertEqual((after[0], after[2]), (before[0] + 2, before[2] + 1))
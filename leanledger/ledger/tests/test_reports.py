@@ -0,0 +1,114 @@
+import json
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Account, Ledger, Record, Variation
+from ..reports import period_report
+
+
+class TestPeriodReport(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.bank = Account.objects.create(
+            name='bank', type=Account.DESTINATION, parent=self.cash, ledger=self.ledger)
+        self.salary = Account.objects.create(
+            name='salary', type=Account.ORIGIN, ledger=self.ledger)
+        self.food = Account.objects.create(
+            name='food', type=Account.ORIGIN, ledger=self.ledger)
+        self.create_record(date(2019, 9, 1), [(self.bank, 100), (self.salary, 100)])
+        self.create_record(date(2019, 9, 20), [(self.cash, -30), (self.food, -30)])
+        self.create_record(date(2019, 10, 5), [(self.bank, 50), (self.salary, 50)])
+
+    def create_record(self, date_, variations):
+        record = Record.objects.create(date=date_, ledger=self.ledger)
+        for account, amount in variations:
+            Variation.objects.create(amount=amount, record=record, account=account)
+
+    def totals(self, period):
+        return [
+            (totals.account.name, totals.depth, totals.debit, totals.credit, totals.net)
+            for totals in period.accounts
+        ]
+
+    def test_whole_range(self):
+        # Accounts and the totals
+        with self.assertNumQueries(2):
+            [period] = period_report(self.ledger.pk)
+
+        self.assertIsNone(period.start)
+        self.assertEqual(self.totals(period), [
+            ('cash', 0, 150, 30, 120),
+            ('bank', 1, 150, 0, 150),
+            ('food', 0, 30, 0, -30),
+            ('salary', 0, 0, 150, 150),
+        ])
+        self.assertEqual((period.debit, period.credit), (180, 180))
+        self.assertEqual((period.destination_net, period.origin_net), (120, 120))
+
+    def test_by_month(self):
+        september, october = period_report(self.ledger.pk, granularity='month')
+
+        self.assertEqual(september.start, date(2019, 9, 1))
+        self.assertEqual(self.totals(september), [
+            ('cash', 0, 100, 30, 70),
+            ('bank', 1, 100, 0, 100),
+            ('food', 0, 30, 0, -30),
+            ('salary', 0, 0, 100, 100),
+        ])
+        self.assertEqual(october.start, date(2019, 10, 1))
+        self.assertEqual(self.totals(october), [
+            ('cash', 0, 50, 0, 50),
+            ('bank', 1, 50, 0, 50),
+            ('salary', 0, 0, 50, 50),
+        ])
+
+    def test_date_range(self):
+        [period] = period_report(self.ledger.pk, start=date(2019, 9, 2), end=date(2019, 10, 4))
+
+        self.assertEqual(self.totals(period), [('cash', 0, 0, 30, -30), ('food', 0, 30, 0, -30)])
+
+    def test_empty_range(self):
+        [period] = period_report(self.ledger.pk, start=date(2020, 1, 1))
+
+        self.assertEqual(period.accounts, [])
+        self.assertEqual(
+            period_report(self.ledger.pk, start=date(2020, 1, 1), granularity='day'), [])
+
+    def test_report_view(self):
+        url = reverse('ledger_report', args=[self.ledger.pk])
+
+        response = self.client.get(url, {'granularity': 'year'})
+
+        self.assertTemplateUsed(response, 'ledger/report.html')
+        self.assertEqual(len(response.context['periods']), 1)
+        self.assertContains(response, 'salary')
+        # Totals are shown with decimals
+        self.assertContains(response, '<td class="text-right">1.50</td>')
+
+    def test_report_json(self):
+        url = reverse('ledger_report_json', args=[self.ledger.pk])
+
+        response = json.loads(self.client.get(url, {'start': '2019-10-01'}).content)
+
+        self.assertEqual(response['periods'][0]['accounts'][1], {
+            'id': self.bank.pk,
+            'full_name': 'cash / bank',
+            'type': Account.DESTINATION,
+            'debit': 0.5,
+            'credit': 0.0,
+            'net': 0.5,
+        })
+        self.assertEqual(response['periods'][0]['debit'], 0.5)
+
+    def test_report_json_invalid(self):
+        url = reverse('ledger_report_json', args=[self.ledger.pk])
+
+        response = self.client.get(url, {'start': '2019-10-01', 'end': '2019-09-01'})
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,100 @@
+from datetime import date
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from .. import search
+from ..models import Account, Ledger, Record, Variation
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+        self.ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        self.cash = Account.objects.create(
+            name='Cash', type=Account.DESTINATION, ledger=self.ledger)
+        self.expenses = Account.objects.create(
+            name='Expenses', type=Account.ORIGIN, ledger=self.ledger)
+        self.groceries = Account.objects.create(
+            name='Groceries', type=Account.ORIGIN, parent=self.expenses, ledger=self.ledger)
+        self.supermarket = self.create_record(date(2019, 10, 1), 'Supermarket', self.groceries)
+        self.bakery = self.create_record(date(2019, 10, 2), 'Bakery', self.groceries)
+        self.rent = self.create_record(date(2019, 10, 3), 'Rent', self.expenses)
+
+    def create_record(self, date_, description, account, ledger=None):
+        record = Record.objects.create(
+            date=date_, description=description, ledger=ledger or self.ledger)
+        Variation.objects.create(amount=-10, record=record, account=self.cash)
+        Variation.objects.create(amount=-10, record=record, account=account)
+        return record
+
+    def search(self, query, **kwargs):
+        return search.search(self.ledger.pk, query, **kwargs)
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('super'), ([self.supermarket.pk], False))
+        # Every word matches, in the description or in the full names of the accounts
+        self.assertEqual(self.search('exp gro bak'), ([self.bakery.pk], False))
+        self.assertEqual(self.search('expenses'), (
+            [self.rent.pk, self.bakery.pk, self.supermarket.pk], False))
+        self.assertEqual(self.search('nothing'), ([], False))
+        self.assertEqual(self.search('" * -'), ([], False))
+
+    def test_ranking(self):
+        groceries = self.create_record(date(2019, 9, 1), 'Groceries', self.cash)
+
+        pks, _ = self.search('groceries')
+
+        # Matches in the description first
+        self.assertEqual(pks, [groceries.pk, self.bakery.pk, self.supermarket.pk])
+
+    def test_pages(self):
+        first = self.search('cash', size=2)
+        second = self.search('cash', page=2, size=2)
+
+        self.assertEqual(first, ([self.rent.pk, self.bakery.pk], True))
+        self.assertEqual(second, ([self.supermarket.pk], False))
+
+    def test_other_ledgers(self):
+        other_ledger = Ledger.objects.create(user=self.user, name='Other Ledger')
+        self.create_record(date(2019, 10, 1), 'Supermarket', self.groceries, other_ledger)
+
+        self.assertEqual(self.search('supermarket'), ([self.supermarket.pk], False))
+
+    def test_record_writes(self):
+        self.supermarket.description = 'Hypermarket'
+        self.supermarket.save()
+        variation = self.bakery.variations.get(account=self.groceries)
+        variation.account = self.expenses
+        variation.save()
+        self.rent.delete()
+
+        self.assertEqual(self.search('hyper'), ([self.supermarket.pk], False))
+        self.assertEqual(self.search('super'), ([], False))
+        self.assertEqual(self.search('groceries'), ([self.supermarket.pk], False))
+        self.assertEqual(self.search('rent'), ([], False))
+
+    def test_account_writes(self):
+        self.expenses.name = 'Spending'
+        self.expenses.save()
+
+        self.assertEqual(self.search('spending groceries'), (
+            [self.bakery.pk, self.supermarket.pk], False))
+        self.assertEqual(self.search('expenses'), ([], False))
+
+        self.groceries.parent = None
+        self.groceries.save()
+
+        self.assertEqual(self.search('spending'), ([self.rent.pk], False))
+
+    def test_rebuild(self):
+        search.rebuild(self.ledger.pk)
+
+        self.assertEqual(self.search('exp gro'), ([self.bakery.pk, self.supermarket.pk], False))
+
+    @patch('leanledger.ledger.search.fts5_available', return_value=False)
+    def test_fallback(self, _):
+        self.assertEqual(self.search('super'), ([self.supermarket.pk], False))
+        self.assertEqual(self.search('groceries bak'), ([self.bakery.pk], False))
+        self.assertEqual(self.search('cash', size=2), ([self.rent.pk, self.bakery.pk], True))
@@ -0,0 +1,66 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Account, Ledger, Record, Variation
+from ..sqlite import configure_connection, write_transaction
+
+
+class TestWriteTransaction(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Test')
+
+    def test_begin_immediate(self):
+        with CaptureQueriesContext(connection) as captured:
+            with write_transaction():
+                with write_transaction():
+                    Ledger.objects.create(user=self.user, name='My Ledger')
+
+        self.assertEqual(captured[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertTrue(Ledger.objects.filter(name='My Ledger').exists())
+
+        # Other transactions begin as usual
+        with CaptureQueriesContext(connection) as captured:
+            with transaction.atomic():
+                Ledger.objects.update(name='Other Ledger')
+
+        self.assertEqual(captured[0]['sql'], 'BEGIN')
+
+    def test_deletes(self):
+        ledger = Ledger.objects.create(user=self.user, name='My Ledger')
+        account = Account.objects.create(name='cash', type=Account.DESTINATION, ledger=ledger)
+        record = Record.objects.create(date=date(2019, 10, 1), ledger=ledger)
+        variation = Variation.objects.create(amount=10, record=record, account=account)
+
+        for instance in (variation, record, account, ledger):
+            with CaptureQueriesContext(connection) as captured:
+                instance.delete()
+
+            self.assertEqual(captured[0]['sql'], 'BEGIN IMMEDIATE', instance)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError), write_transaction():
+            Ledger.objects.create(user=self.user, name='My Ledger')
+            raise ValueError
+
+        self.assertFalse(Ledger.objects.exists())
+        self.assertEqual(connection.begin, 'BEGIN')
+
+
+class TestConfigureConnection(TestCase):
+    def cache_size(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            return cursor.fetchone()[0]
+
+    @override_settings(LEDGER_SQLITE_PRAGMAS={'cache_size': -1234})
+    def test_pragmas(self):
+        self.addCleanup(connection.connection.execute, 'PRAGMA cache_size = {}'.format(
+            self.cache_size()))
+
+        configure_connection(sender=None, connection=connection)
+
+        self.assertEqual(self.cache_size(), -1234)
@@ -1,14 +1,19 @@
 import json
 from collections import namedtuple
 from datetime import date
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.http import http_date
 
+from .. import cache
 from ..models import Account, Ledger, Variation, Record
 
 
+# Views fail when they go over their query budget
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
 class TestLedgerViews(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -76,6 +81,7 @@ class TestLedgerViews(TestCase):
 
 
 def create_test_data(test):
+    cache.clear()
     test.username, test.password = 'joe', 'pass'
     test.user = User.objects.create_user(username=test.username, password=test.password)
     test.ledger = Ledger.objects.create(user=test.user, name='My Ledger')
@@ -89,13 +95,14 @@ def create_test_data(test):
     test.account_expense_two = Account.objects.create(
         name='expense two', type=Account.ORIGIN, ledger=test.ledger)
     test.variation_cash = Variation.objects.create(
-        amount=-100, record=test.record, account=test.account_cash)
+        amount=-10000, record=test.record, account=test.account_cash)
     test.variation_expense_one = Variation.objects.create(
-        amount=-40, record=test.record, account=test.account_expense_one)
+        amount=-4000, record=test.record, account=test.account_expense_one)
     test.variation_expense_two = Variation.objects.create(
-        amount=-60, record=test.record, account=test.account_expense_two)
+        amount=-6000, record=test.record, account=test.account_expense_two)
 
 
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
 class TestRecordViews(TestCase):
     def setUp(self):
         create_test_data(self)
@@ -108,6 +115,162 @@ class TestRecordViews(TestCase):
         self.assertTemplateUsed(response, 'ledger/record_list.html')
         self.assertContains(response, 'expense one')
 
+    def test_records_page_queries(self):
+        food = Account.objects.create(
+            name='food', type=Account.ORIGIN, parent=self.account_expense_one, ledger=self.ledger)
+        for day in range(1, 11):
+            record = Record.objects.create(date=date(2019, 10, day), ledger=self.ledger)
+            Variation.objects.create(amount=-day, record=record, account=self.account_cash)
+            Variation.objects.create(amount=-day, record=record, account=food)
+        url = reverse('record_list', args=[self.ledger.pk])
+
+        # Versions, ledger, records, variations and accounts, however many records there are
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        self.assertContains(response, 'expense one / food')
+        self.assertNotContains(response, 'badge-danger')
+
+    def create_records(self, n_records):
+        for day in range(1, n_records + 1):
+            record = Record.objects.create(date=date(2019, 10, day % 3 + 1), ledger=self.ledger)
+            Variation.objects.create(amount=-day, record=record, account=self.account_cash)
+            Variation.objects.create(amount=-day, record=record, account=self.account_expense_one)
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 4)
+    def test_records_page_pagination(self):
+        self.create_records(6)
+        url = reverse('record_list', args=[self.ledger.pk])
+        expected = list(Record.objects.order_by('-date', '-pk'))
+
+        first_page = self.client.get(url)
+        second_page = self.client.get(url, {'after': first_page.context['next_cursor']})
+
+        self.assertEqual(list(first_page.context['records']), expected[:4])
+        self.assertEqual(list(second_page.context['records']), expected[4:])
+        self.assertIsNone(second_page.context['next_cursor'])
+
+    def test_records_page_invalid_cursor(self):
+        url = reverse('record_list', args=[self.ledger.pk])
+
+        response = self.client.get(url, {'after': 'nope'})
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 2)
+    def test_record_list_json(self):
+        self.create_records(4)
+        url = reverse('record_list_json', args=[self.ledger.pk])
+        expected = [record.as_dict() for record in Record.objects.order_by('-date', '-pk')]
+
+        records, cursor = [], None
+        for n_page in range(3):
+            # Deep pages cost the same as the first one: versions, cursor, variations and
+            # accounts
+            with self.assertNumQueries(4):
+                page = json.loads(self.client.get(url, {'after': cursor or ''}).content)
+            records += page['records']
+            cursor = page['next']
+
+        self.assertIsNone(cursor)
+        self.assertEqual(records, json.loads(json.dumps(expected)))
+
+    def test_record_batch_json_ids(self):
+        self.create_records(6)
+        url = reverse('record_batch_json', args=[self.ledger.pk])
+        other_ledger = Ledger.objects.create(user=self.user, name='Other Ledger')
+        other_record = Record.objects.create(date=date(2019, 10, 1), ledger=other_ledger)
+        records = list(Record.objects.filter(ledger=self.ledger).order_by('-pk'))
+        ids = [record.pk for record in records] + [other_record.pk, 1000]
+
+        # Versions, records, variations and accounts, however many records there are
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'ids': ','.join(map(str, ids))})
+
+        expected = [record.as_dict() for record in records]
+        self.assertEqual(json.loads(response.content), {
+            'records': json.loads(json.dumps(expected)),
+            'missing': [other_record.pk, 1000],
+        })
+
+    @patch('leanledger.ledger.views.BATCH_PAGE_SIZE', 2)
+    def test_record_batch_json_dates(self):
+        self.create_records(6)
+        url = reverse('record_batch_json', args=[self.ledger.pk])
+        expected = [
+            record.as_dict() for record in
+            Record.objects.filter(date__gte=date(2019, 10, 2)).order_by('-date', '-pk')
+        ]
+
+        records, cursor = [], None
+        for n_page in range(2):
+            page = json.loads(self.client.get(
+                url, {'start': '2019-10-02', 'end': '2019-10-03', 'after': cursor or ''}).content)
+            records += page['records']
+            cursor = page['next']
+
+        self.assertIsNone(cursor)
+        self.assertEqual(records, json.loads(json.dumps(expected)))
+
+    @patch('leanledger.ledger.views.PAGE_SIZE', 2)
+    def test_record_search_json(self):
+        self.create_records(3)
+        url = reverse('record_search_json', args=[self.ledger.pk])
+        expected = [
+            record.as_dict() for record in
+            Record.objects.filter(variations__account=self.account_cash).order_by('-pk')
+        ]
+
+        # Versions, search, records, variations and accounts
+        with self.assertNumQueries(5):
+            first_page = json.loads(self.client.get(url, {'q': 'ca'}).content)
+        second_page = json.loads(self.client.get(url, {'q': 'ca', 'page': 2}).content)
+
+        self.assertEqual(first_page['next'], 2)
+        self.assertIsNone(second_page['next'])
+        self.assertEqual(
+            first_page['records'] + second_page['records'], json.loads(json.dumps(expected)))
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_record_batch_json_invalid(self):
+        url = reverse('record_batch_json', args=[self.ledger.pk])
+        for params in [{}, {'ids': '1,a'}, {'ids': '1', 'start': '2019-10-01'},
+                       {'start': '2019-10-02', 'end': '2019-10-01'},
+                       {'start': '2019-10-01', 'after': 'nonsense'}]:
+            response = self.client.get(url, params)
+
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('errors', json.loads(response.content))
+
+    def create_unbalanced_record(self, day):
+        record = Record.objects.create(date=date(2019, 10, day), ledger=self.ledger)
+        Variation.objects.create(amount=-day, record=record, account=self.account_cash)
+        return record
+
+    def test_unbalanced_records(self):
+        self.create_records(2)
+        unbalanced = [self.create_unbalanced_record(day) for day in (1, 2)]
+        url = reverse('record_unbalanced', args=[self.ledger.pk])
+
+        # Versions, ledger, unbalanced records, variations and accounts
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        self.assertTemplateUsed(response, 'ledger/record_list.html')
+        self.assertEqual(list(response.context['records']), unbalanced[::-1])
+
+    def test_unbalanced_records_json(self):
+        self.create_records(2)
+        record = self.create_unbalanced_record(1)
+        url = reverse('record_unbalanced_json', args=[self.ledger.pk])
+
+        response = json.loads(self.client.get(url).content)
+
+        record = Record.objects.get(pk=record.pk)
+        self.assertEqual(response['records'], [json.loads(json.dumps(record.as_dict()))])
+        self.assertFalse(response['records'][0]['is_balanced'])
+        self.assertIsNone(response['next'])
+
     def test_record_detail_json(self):
         url = reverse('record_detail_json', args=[self.ledger.pk, self.record.pk])
 
@@ -170,7 +333,46 @@ class TestRecordViews(TestCase):
         # Simple sanity check
         self.assertIn("variations", json.loads(response.content))
 
-
+    def test_record_bulk_update_json(self):
+        self.create_records(10)
+        url = reverse('record_bulk_update_json', args=[self.ledger.pk])
+        records = Record.objects.with_variations(
+            Record.objects.filter(ledger=self.ledger).order_by('pk'), self.ledger.pk)
+        states = [record.as_dict() for record in records]
+        for state in states:
+            state['description'] = 'Recategorized'
+            state['variations']['debit'][0]['account_id'] = self.account_expense_two.pk
+
+        response = self.client.post(url, json.dumps(states), content_type='application/json')
+
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['id'] for result in results], [state['id'] for state in states])
+        self.assertEqual([result['record'] for result in results], json.loads(json.dumps([
+            record.as_dict() for record in Record.objects.with_variations(
+                Record.objects.filter(ledger=self.ledger).order_by('pk'), self.ledger.pk)
+        ])))
+        self.assertFalse(Record.objects.exclude(description='Recategorized').exists())
+
+    def test_record_bulk_update_json_invalid(self):
+        url = reverse('record_bulk_update_json', args=[self.ledger.pk])
+        state = self.record.as_dict()
+        state['description'] = 'Not written'
+        states = [state, dict(state, id=0)]
+
+        response = self.client.post(url, json.dumps(states), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['results'], [
+            {'id': self.record.pk, 'errors': []},
+            {'id': 0, 'errors': ['Unknown record: 0']},
+        ])
+        self.assertFalse(Record.objects.filter(description='Not written').exists())
+        for body in ['nope', '{}', '[]']:
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
 class TestAccountViews(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -191,6 +393,9 @@ class TestAccountViews(TestCase):
     def tearDownClass(cls):
         cls.user.delete()
 
+    def setUp(self):
+        cache.clear()
+
     def test_account_list(self):
         url = reverse('account_list', args=[self.ledger.pk])
 
@@ -198,10 +403,38 @@ class TestAccountViews(TestCase):
 
         self.assertTemplateUsed(response, 'ledger/account_list.html')
 
+    def test_account_list_queries(self):
+        url = reverse('account_list', args=[self.ledger.pk])
+
+        # Versions, ledger and accounts tree, however many accounts there are
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertContains(response, 'bank two')
+
+    def test_account_detail(self):
+        url = reverse('account_detail', args=[self.ledger.pk, self.account_wallet.pk])
+
+        # Ledger, accounts tree and variations
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertTemplateUsed(response, 'ledger/account_detail.html')
+        self.assertContains(response, 'bank one')
+
+    def test_account_detail_not_found(self):
+        url = reverse('account_detail', args=[self.ledger.pk, 0])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 404)
+
     def test_account_list_json(self):
         url = reverse("account_list_json", args=[self.ledger.pk])
 
-        response = self.client.get(url)
+        # Versions and accounts, however many and deep they are
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
 
         expected = [
             {
@@ -272,3 +505,201 @@ class TestAccountViews(TestCase):
 
         self.assertTemplateUsed(response, 'ledger/account_list.html')
         self.assertFalse(Account.objects.filter(name='account').exists())
+
+
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
+class TestAccountStatement(TestCase):
+    def setUp(self):
+        create_test_data(self)
+        # Amounts 1.00 to 6.00 on alternate days, newest last
+        for day in range(1, 7):
+            record = Record.objects.create(
+                date=date(2019, 10, (day + 1) // 2), ledger=self.ledger)
+            Variation.objects.create(amount=day * 100, record=record, account=self.account_bank)
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 4)
+    def test_account_detail_statement(self):
+        url = reverse('account_detail', args=[self.ledger.pk, self.account_bank.pk])
+
+        first_page = self.client.get(url)
+        # Ledger, variations and the ones after the page, however deep the page is (the
+        # accounts tree is cached)
+        with self.assertNumQueries(3):
+            second_page = self.client.get(url, {'after': first_page.context['next_cursor']})
+
+        lines = first_page.context['lines'] + second_page.context['lines']
+        self.assertEqual(
+            [line.variation.amount for line in lines], [600, 500, 400, 300, 200, 100])
+        self.assertEqual([line.balance for line in lines], [2100, 1500, 1000, 600, 300, 100])
+        self.assertContains(first_page, '<td class="text-right">21.00</td>')
+        self.assertIsNone(second_page.context['next_cursor'])
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 2)
+    def test_account_statement_json(self):
+        url = reverse('account_statement_json', args=[self.ledger.pk, self.account_bank.pk])
+
+        lines, cursor = [], None
+        for n_page in range(3):
+            # Account, variations and, after the first page, the ones after the page
+            with self.assertNumQueries(3 if cursor else 2):
+                page = json.loads(self.client.get(url, {'after': cursor or ''}).content)
+            lines += page['lines']
+            cursor = page['next']
+
+        self.assertIsNone(cursor)
+        self.assertEqual([line['balance'] for line in lines], [21, 15, 10, 6, 3, 1])
+        self.assertEqual(lines[0]['date'], '2019-10-03')
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 2)
+    def test_account_statement_edit_between_pages(self):
+        url = reverse('account_statement_json', args=[self.ledger.pk, self.account_bank.pk])
+        cursor = json.loads(self.client.get(url).content)['next']
+
+        # A variation of the second page moves the balance of the lines after it
+        variation = self.account_bank.variations.get(amount=300)
+        variation.amount = 1300
+        variation.save()
+
+        page = json.loads(self.client.get(url, {'after': cursor}).content)
+        self.assertEqual([line['balance'] for line in page['lines']], [20, 16])
+
+    def test_account_statement_invalid_cursor(self):
+        url = reverse('account_statement_json', args=[self.ledger.pk, self.account_bank.pk])
+
+        for cursor in ('nope', '2019-10-01', '2019-13-01.1', '2019-10-01.1.100'):
+            response = self.client.get(url, {'after': cursor})
+
+            self.assertEqual(response.status_code, 404)
+
+
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
+class TestVariationFilter(TestCase):
+    def setUp(self):
+        create_test_data(self)
+        self.food = Account.objects.create(
+            name='food', type=Account.ORIGIN, parent=self.account_expense_one, ledger=self.ledger)
+        # Amounts 10.00 to 50.00 on food, a day apart
+        for day in range(1, 6):
+            record = Record.objects.create(date=date(2019, 10, day), ledger=self.ledger)
+            Variation.objects.create(
+                amount=-day * 1000, record=record, account=self.account_cash)
+            Variation.objects.create(amount=-day * 1000, record=record, account=self.food)
+        self.url = reverse('variation_filter_json', args=[self.ledger.pk])
+
+    @patch('leanledger.ledger.pagination.PAGE_SIZE', 2)
+    def test_variation_filter_json(self):
+        params = {
+            'account': self.account_expense_one.pk, 'min_amount': '20', 'direction': 'debit'}
+
+        variations, cursor = [], None
+        for n_page in range(3):
+            # Versions, accounts (cached after the first page) and variations, however deep the
+            # page is
+            with self.assertNumQueries(3 if n_page == 0 else 2):
+                response = self.client.get(self.url, dict(params, after=cursor or ''))
+            page = json.loads(response.content)
+            variations += page['variations']
+            cursor = page['next']
+
+        self.assertIsNone(cursor)
+        self.assertEqual(
+            [(v['date'], v['account_name'], v['amount']) for v in variations],
+            [('2019-10-05', 'food', 50), ('2019-10-04', 'food', 40), ('2019-10-03', 'food', 30),
+             ('2019-10-02', 'food', 20), ('2019-09-14', 'expense one', 40)])
+        self.assertEqual(variations[0]['type'], 'debit')
+
+    def test_variation_filter_json_dates(self):
+        response = self.client.get(self.url, {'start': '2019-10-02', 'end': '2019-10-03'})
+
+        variations = json.loads(response.content)['variations']
+        self.assertEqual(len(variations), 4)
+        self.assertEqual({v['date'] for v in variations}, {'2019-10-02', '2019-10-03'})
+
+    def test_variation_filter_json_invalid(self):
+        other_ledger = Ledger.objects.create(user=self.user, name='Other Ledger')
+        other_account = Account.objects.create(
+            name='cash', type=Account.DESTINATION, ledger=other_ledger)
+        for params in [{'account': other_account.pk}, {'account': 'cash'},
+                       {'start': '2019-10-02', 'end': '2019-10-01'},
+                       {'min_amount': '20', 'max_amount': '10'}, {'min_amount': '-1'},
+                       {'direction': 'both'}, {'after': 'nonsense'}]:
+            response = self.client.get(self.url, params)
+
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('errors', json.loads(response.content))
+
+
+@override_settings(LEDGER_SQL_BUDGET_STRICT=True)
+class TestConditionalRequests(TestCase):
+    def setUp(self):
+        create_test_data(self)
+
+    def get(self, url_name, *args, etag=None):
+        url = reverse(url_name, args=[self.ledger.pk] + list(args))
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else self.client.get(url)
+
+    def test_not_modified(self):
+        for url_name, args in [
+            ('record_list', []),
+            ('record_list_json', []),
+            ('account_list', []),
+            ('account_list_json', []),
+            ('record_detail_json', [self.record.pk]),
+        ]:
+            etag = self.get(url_name, *args)['ETag']
+
+            # Just the versions
+            with self.assertNumQueries(1):
+                response = self.get(url_name, *args, etag=etag)
+
+            self.assertEqual(response.status_code, 304, url_name)
+
+    def test_record_change(self):
+        record_etag = self.get('record_detail_json', self.record.pk)['ETag']
+        list_etag = self.get('record_list_json')['ETag']
+        accounts_etag = self.get('account_list_json')['ETag']
+
+        self.variation_cash.amount = -9000
+        self.variation_cash.save()
+
+        self.assertEqual(
+            self.get('record_detail_json', self.record.pk, etag=record_etag).status_code, 200)
+        self.assertEqual(self.get('record_list_json', etag=list_etag).status_code, 200)
+        self.assertEqual(self.get('account_list_json', etag=accounts_etag).status_code, 304)
+
+    def test_account_change(self):
+        record_etag = self.get('record_detail_json', self.record.pk)['ETag']
+        accounts_etag = self.get('account_list_json')['ETag']
+
+        self.account_cash.name = 'wallet'
+        self.account_cash.save()
+
+        self.assertEqual(
+            self.get('record_detail_json', self.record.pk, etag=record_etag).status_code, 200)
+        self.assertEqual(self.get('account_list_json', etag=accounts_etag).status_code, 200)
+
+    def test_not_found(self):
+        other_ledger = Ledger.objects.create(user=self.user, name='Other Ledger')
+        response = self.client.get(
+            reverse('record_detail_json', args=[other_ledger.pk, self.record.pk]))
+        self.assertEqual(response.status_code, 404)
+
+        missing_pk = other_ledger.pk + 1
+        for url_name in ['record_list_json', 'record_unbalanced_json', 'record_batch_json',
+                         'record_search_json', 'variation_filter_json', 'account_list_json']:
+            response = self.client.get(
+                reverse(url_name, args=[missing_pk]), {'q': 'cash', 'ids': self.record.pk})
+            self.assertEqual(response.status_code, 404, url_name)
+
+    def test_no_last_modified(self):
+        response = self.get('record_list')
+
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        # A write in the same second as the previous read isn't hidden
+        self.variation_cash.amount = -9000
+        self.variation_cash.save()
+        response = self.client.get(
+            reverse('record_list_json', args=[self.ledger.pk]),
+            HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
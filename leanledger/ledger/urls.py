@@ -1,11 +1,14 @@
 from django.urls import path
 
 from .views import (
-    ledger_list, ledger_create, ledger_update, ledger_delete,
-    record_detail, record_detail_json, record_list,
-    record_create, record_update_json,
+    ledger_list, ledger_create, ledger_update, ledger_delete, ledger_export,
+    ledger_report, ledger_report_json,
+    record_batch_json, record_bulk_update_json, record_detail, record_detail_json, record_list,
+    record_list_json, record_create, record_import, record_unbalanced, record_unbalanced_json,
+    record_search_json, record_update_json,
+    variation_filter_json,
     account_detail, account_create, account_delete, account_list,
-    account_list_json,
+    account_list_json, account_statement_json,
 )
 
 
@@ -15,10 +18,28 @@ urlpatterns = [
     path('create/', ledger_create, name='ledger_create'),
     path('<int:ledger_pk>/delete/', ledger_delete, name='ledger_delete'),
     path('<int:ledger_pk>/update/', ledger_update, name='ledger_update'),
+    path('<int:ledger_pk>/export/', ledger_export, name='ledger_export'),
+    path('<int:ledger_pk>/report/', ledger_report, name='ledger_report'),
+    path('<int:ledger_pk>/report.json', ledger_report_json, name='ledger_report_json'),
 
     # Record
     path('<int:ledger_pk>/record/', record_list, name='record_list'),
+    path('<int:ledger_pk>/record.json', record_list_json, name='record_list_json'),
     path('<int:ledger_pk>/record/create/', record_create, name='record_create'),
+    path('<int:ledger_pk>/record/import/', record_import, name='record_import'),
+    path('<int:ledger_pk>/record/unbalanced/', record_unbalanced, name='record_unbalanced'),
+    path(
+        '<int:ledger_pk>/record/unbalanced.json',
+        record_unbalanced_json,
+        name='record_unbalanced_json',
+    ),
+    path('<int:ledger_pk>/record/batch.json', record_batch_json, name='record_batch_json'),
+    path('<int:ledger_pk>/record/search.json', record_search_json, name='record_search_json'),
+    path(
+        '<int:ledger_pk>/record/update.json',
+        record_bulk_update_json,
+        name='record_bulk_update_json',
+    ),
     path('<int:ledger_pk>/record/<int:record_pk>/', record_detail, name='record_detail'),
     path(
         '<int:ledger_pk>/record/<int:record_pk>.json',
@@ -31,10 +52,22 @@ urlpatterns = [
         name="record_update_json",
     ),
 
+    # Variation
+    path(
+        '<int:ledger_pk>/variation/filter.json',
+        variation_filter_json,
+        name='variation_filter_json',
+    ),
+
     # Account
     path('<int:ledger_pk>/account/', account_list, name='account_list'),
     path('<int:ledger_pk>/account.json', account_list_json, name='account_list_json'),
     path('<int:ledger_pk>/account/create/', account_create, name='account_create'),
     path('<int:ledger_pk>/account/<int:account_pk>/', account_detail, name='account_detail'),
+    path(
+        '<int:ledger_pk>/account/<int:account_pk>/statement.json',
+        account_statement_json,
+        name='account_statement_json',
+    ),
     path('<int:ledger_pk>/account/<int:account_pk>/delete/', account_delete, name='account_delete'),
 ]
@@ -1,13 +1,87 @@
+import codecs
 import json
 from collections import namedtuple
 
 from django.contrib.auth.models import AnonymousUser, User
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 
-from .forms import AccountForm, LedgerForm, RecordForm, VariationForm
+from . import cache, search
+from .core import json_amount
+from .export import FORMATS, export_lines
+from .forms import (
+    AccountForm, LedgerForm, RecordBatchForm, RecordForm, RecordSearchForm, ReportForm,
+    VariationFilterForm, VariationForm,
+)
+from .importer import FORMATS as IMPORT_FORMATS, import_records
+from .middleware import query_budget
 from .models import Ledger, Account, Record, Variation
+from .pagination import (
+    BATCH_PAGE_SIZE, PAGE_SIZE, records_page, statement_page, variations_page,
+)
+from .reports import period_report
+
+# Records of a ``record_bulk_update_json`` request
+MAX_BULK_UPDATE = 500
+
+
+def _versions(request, ledger_pk, record_pk=None):
+    """
+    ``(ledger version, accounts version, record version)`` from the ledger (and record) tables
+    only, once per request, or ``None`` if they don't exist.
+    """
+    key = (ledger_pk, record_pk)
+    if getattr(request, '_versions_key', None) != key:
+        if record_pk is None:
+            versions = Ledger.objects.filter(pk=ledger_pk).values_list(
+                'version', 'accounts_version')
+        else:
+            versions = Record.objects.filter(pk=record_pk, ledger=ledger_pk).values_list(
+                'ledger__version', 'ledger__accounts_version', 'version')
+        versions = versions.first()
+        request._versions_key, request._versions = key, versions
+    return request._versions
+
+
+def _existing_versions(request, ledger_pk, record_pk=None):
+    """``_versions``, raising ``Http404`` if the ledger (or the record in it) doesn't exist."""
+    versions = _versions(request, ledger_pk, record_pk)
+    if versions is None:
+        raise Http404
+    return versions
+
+
+def _ledger_etag(request, ledger_pk, **kwargs):
+    versions = _versions(request, ledger_pk)
+    return versions and 'ledger-{}'.format(versions[0])
+
+
+def _accounts_etag(request, ledger_pk, **kwargs):
+    versions = _versions(request, ledger_pk)
+    return versions and 'accounts-{}'.format(versions[1])
+
+
+def _record_etag(request, ledger_pk, record_pk):
+    # The record has the names of its accounts. Its version is a version of the ledger, so it
+    # isn't reused by a record that reuses the primary key of a deleted one.
+    versions = _versions(request, ledger_pk, record_pk)
+    return versions and 'record-{}-{}'.format(versions[2], versions[1])
+
+
+def _conditional(etag_func):
+    """
+    Answer conditional requests with a 304 when the versions that ``etag_func`` reads didn't
+    change, without running the view. Browsers are asked to always revalidate. No Last-Modified:
+    its one second resolution would hide writes made in the same second as the previous read.
+    """
+    def decorator(view):
+        view = condition(etag_func=etag_func)(view)
+        return cache_control(private=True, no_cache=True)(view)
+    return decorator
 
 
 def ledger_list(request):
@@ -54,52 +128,352 @@ def ledger_delete(request, ledger_pk):
         return render(request, 'ledger/ledger_delete.html', {'ledger': ledger})
 
 
+def ledger_export(request, ledger_pk):
+    """
+    Stream the ledger's records. No ``query_budget``: it runs two queries per chunk of
+    ``export.CHUNK_SIZE`` records, however large the ledger is.
+    """
+    format_ = request.GET.get('format', 'csv')
+    if format_ not in FORMATS:
+        raise Http404('Unknown export format')
+    _existing_versions(request, ledger_pk)
+    _, content_type = FORMATS[format_]
+    response = StreamingHttpResponse(export_lines(ledger_pk, format_), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="ledger-{}.{}"'.format(
+        ledger_pk, format_)
+    return response
+
+
+@query_budget(3)
+def ledger_report(request, ledger_pk):
+    ledger = Ledger.objects.get(pk=ledger_pk)
+    form = ReportForm(request.GET)
+    periods = period_report(ledger_pk, **form.cleaned_data) if form.is_valid() else []
+    return render(request, 'ledger/report.html', {
+        'form': form,
+        'periods': periods,
+        'ledger': ledger,
+    })
+
+
+@query_budget(2)
+def ledger_report_json(request, ledger_pk):
+    form = ReportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    periods = period_report(ledger_pk, **form.cleaned_data)
+    return JsonResponse({'periods': [period.as_dict() for period in periods]})
+
+
+@require_POST
+def record_import(request, ledger_pk):
+    """Import the request body, in one of the export formats, as new records."""
+    format_ = request.GET.get('format', 'csv')
+    if format_ not in IMPORT_FORMATS:
+        raise Http404('Unknown import format')
+    _existing_versions(request, ledger_pk)
+    errors = []
+    n_imported = import_records(
+        ledger_pk, IMPORT_FORMATS[format_](codecs.iterdecode(request, 'utf-8')), errors.append)
+    return JsonResponse({
+        'imported': n_imported,
+        'errors': [{'line': error.line, 'errors': error.errors} for error in errors],
+    })
+
+
 def record_detail(request, ledger_pk, record_pk):
     ledger = Ledger.objects.get(pk=ledger_pk)
     record = Record.objects.get(pk=record_pk)  # TODO replace for get_or_404
     return render(request, 'ledger/record_detail.html', {'record': record, 'ledger': ledger})
 
 
+@query_budget(4)
+@_conditional(_record_etag)
 def record_detail_json(request, ledger_pk, record_pk):
-    return JsonResponse(Record.objects.get(pk=record_pk).as_dict())
+    accounts_version = _existing_versions(request, ledger_pk, record_pk)[1]
+    record = Record.objects.get(pk=record_pk)
+    return JsonResponse(cache.record_dicts([record], ledger_pk, accounts_version)[0])
 
 
+@query_budget(18)
 def record_update_json(request, ledger_pk, record_pk):
     new_record_state = json.loads(request.body)
     updated_record = Record.objects.get(pk=record_pk).update_from_dict(new_record_state)
     return JsonResponse(updated_record.as_dict())
 
 
+@query_budget(20)
+@require_POST
+def record_bulk_update_json(request, ledger_pk):
+    """
+    Apply a list of record states (what ``record_update_json`` takes) in one transaction, all of
+    them or, if any is invalid, none. Returns the result of every state, in order: the updated
+    record, or its errors (and a 400).
+    """
+    try:
+        states = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'errors': ['Invalid JSON']}, status=400)
+    if not isinstance(states, list) or not states:
+        return JsonResponse({'errors': ['Expected a list of records']}, status=400)
+    if len(states) > MAX_BULK_UPDATE:
+        return JsonResponse(
+            {'errors': ['At most {} records at once'.format(MAX_BULK_UPDATE)]}, status=400)
+
+    records, errors = Record.objects.update_from_dicts(ledger_pk, states)
+    if errors:
+        return JsonResponse({'results': [
+            {
+                'id': state.get('id') if isinstance(state, dict) else None,
+                'errors': errors.get(index, []),
+            }
+            for index, state in enumerate(states)
+        ]}, status=400)
+    return JsonResponse({'results': [
+        {'id': record.pk, 'record': record.as_dict()} for record in records
+    ]})
+
+
+def _records_page(request, ledger_pk, records=None):
+    if records is None:
+        records = Record.objects.filter(ledger=ledger_pk)
+    try:
+        return records_page(records, request.GET.get('after'))
+    except ValueError:
+        raise Http404('Invalid cursor')
+
+
+def _records_page_html(request, ledger_pk, records=None):
+    page = _records_page(request, ledger_pk, records)
+    accounts = cache.account_tree(ledger_pk, _existing_versions(request, ledger_pk)[0])
+    return page._replace(
+        records=Record.objects.with_variations(page.records, ledger_pk, accounts))
+
+
+def _records_page_json(request, ledger_pk, records=None):
+    page = _records_page(request, ledger_pk, records)
+    accounts_version = _existing_versions(request, ledger_pk)[1]
+    return JsonResponse({
+        'records': cache.record_dicts(page.records, ledger_pk, accounts_version),
+        'next': page.next_cursor,
+    })
+
+
+@query_budget(5)
+@_conditional(_ledger_etag)
 def record_list(request, ledger_pk):
     ledger = Ledger.objects.get(pk=ledger_pk)
-    records = Record.objects.filter(ledger=ledger_pk).order_by('-date')
-    context = {'records': records, 'ledger': ledger}
+    page = _records_page_html(request, ledger_pk)
+    context = {'records': page.records, 'next_cursor': page.next_cursor, 'ledger': ledger}
     return render(request, 'ledger/record_list.html', context)
 
 
+@query_budget(4)
+@_conditional(_ledger_etag)
+def record_list_json(request, ledger_pk):
+    return _records_page_json(request, ledger_pk)
+
+
+@query_budget(5)
+@_conditional(_ledger_etag)
+def record_unbalanced(request, ledger_pk):
+    ledger = Ledger.objects.get(pk=ledger_pk)
+    page = _records_page_html(request, ledger_pk, Record.objects.unbalanced(ledger_pk))
+    context = {
+        'records': page.records,
+        'next_cursor': page.next_cursor,
+        'ledger': ledger,
+        'active': 'unbalanced',
+    }
+    return render(request, 'ledger/record_list.html', context)
+
+
+@query_budget(4)
+@_conditional(_ledger_etag)
+def record_unbalanced_json(request, ledger_pk):
+    return _records_page_json(request, ledger_pk, Record.objects.unbalanced(ledger_pk))
+
+
+@query_budget(4)
+@_conditional(_ledger_etag)
+def record_batch_json(request, ledger_pk):
+    """
+    ``as_dict`` of many records, in the same number of queries however many they are: the ones
+    in ``ids`` in that order (``missing`` lists the ones not found), or a page of the ones from
+    ``start`` to ``end``, newest first (``next`` is the ``after`` of the next page).
+    """
+    form = RecordBatchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    accounts_version = _existing_versions(request, ledger_pk)[1]
+    records = Record.objects.filter(ledger=ledger_pk)
+
+    ids = form.cleaned_data['ids']
+    if ids is not None:
+        found = records.in_bulk(ids)
+        return JsonResponse({
+            'records': cache.record_dicts(
+                [found[pk] for pk in ids if pk in found], ledger_pk, accounts_version),
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+    if form.cleaned_data['start'] is not None:
+        records = records.filter(date__gte=form.cleaned_data['start'])
+    if form.cleaned_data['end'] is not None:
+        records = records.filter(date__lte=form.cleaned_data['end'])
+    try:
+        page = records_page(records, form.cleaned_data['after'], BATCH_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'errors': {'after': ['Invalid cursor']}}, status=400)
+    return JsonResponse({
+        'records': cache.record_dicts(page.records, ledger_pk, accounts_version),
+        'next': page.next_cursor,
+    })
+
+
+@query_budget(5)
+@_conditional(_ledger_etag)
+def record_search_json(request, ledger_pk):
+    """
+    Records whose description or account full names have words starting with every word of
+    ``q``, best matches first, by pages (``page``, from 1; ``next`` is the next one or null).
+    """
+    form = RecordSearchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    accounts_version = _existing_versions(request, ledger_pk)[1]
+    page = form.cleaned_data['page']
+    pks, has_next = search.search(ledger_pk, form.cleaned_data['q'], page, PAGE_SIZE)
+    found = Record.objects.in_bulk(pks)
+    return JsonResponse({
+        'records': cache.record_dicts([found[pk] for pk in pks], ledger_pk, accounts_version),
+        'next': page + 1 if has_next else None,
+    })
+
+
 def record_create(request, ledger_pk):
     pass
 
 
+@query_budget(3)
+@_conditional(_ledger_etag)
+def variation_filter_json(request, ledger_pk):
+    """
+    Page of the variations that match the filters of ``VariationFilterForm``, newest first, with
+    the date and description of their records (``next`` is the ``after`` of the next page).
+    """
+    form = VariationFilterForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    filters = dict(form.cleaned_data)
+    account_pk, after = filters.pop('account'), filters.pop('after')
+    accounts = cache.account_tree(ledger_pk, _existing_versions(request, ledger_pk)[0])
+    if account_pk is None:
+        subtree = None
+    elif account_pk in accounts:
+        subtree = accounts[account_pk].subtree()
+    else:
+        return JsonResponse({'errors': {'account': ['Unknown account']}}, status=400)
+
+    variations = Variation.objects.matching(ledger_pk, subtree, **filters)
+    try:
+        page = variations_page(variations, after)
+    except ValueError:
+        return JsonResponse({'errors': {'after': ['Invalid cursor']}}, status=400)
+    for variation in page.variations:
+        variation.account = accounts[variation.account_id]
+    return JsonResponse({
+        'variations': [
+            {
+                'id': variation.pk,
+                'record_id': variation.record_id,
+                'date': variation.date,
+                'description': variation.record.description,
+                'account_id': variation.account_id,
+                'account_name': variation.account.name,
+                'type': variation.type,
+                'amount': json_amount(abs(variation.amount)),
+            }
+            for variation in page.variations
+        ],
+        'next': page.next_cursor,
+    })
+
+
+def _statement_page(request, account):
+    try:
+        return statement_page(account, request.GET.get('after'))
+    except ValueError:
+        raise Http404('Invalid cursor')
+
+
+@query_budget(4)
 def account_detail(request, ledger_pk, account_pk):
     ledger = Ledger.objects.get(pk=ledger_pk)
-    account = Account.objects.get(pk=account_pk)  # TODO replace for get_or_404
-    return render(request, 'ledger/account_detail.html', {'account': account, 'ledger': ledger})
+    accounts = cache.account_tree(ledger_pk, ledger.version)
+    if account_pk not in accounts:
+        raise Http404
+    account = accounts[account_pk]
+    page = _statement_page(request, account)
+    return render(request, 'ledger/account_detail.html', {
+        'account': account,
+        'lines': page.lines,
+        'next_cursor': page.next_cursor,
+        'ledger': ledger,
+    })
+
+
+@query_budget(3)
+def account_statement_json(request, ledger_pk, account_pk):
+    try:
+        account = Account.objects.select_related('balance').get(pk=account_pk, ledger=ledger_pk)
+    except Account.DoesNotExist:
+        raise Http404
+    page = _statement_page(request, account)
+    return JsonResponse({
+        'lines': [
+            {
+                'id': variation.pk,
+                'record_id': variation.record_id,
+                'date': variation.date,
+                'description': variation.record.description,
+                'amount': json_amount(variation.amount),
+                'balance': json_amount(balance),
+            }
+            for variation, balance in page.lines
+        ],
+        'next': page.next_cursor,
+    })
 
 
+@query_budget(3)
+@_conditional(_ledger_etag)
 def account_list(request, ledger_pk):
     ledger = Ledger.objects.get(pk=ledger_pk)
-    destination_accounts = Account.objects.destination_accounts(ledger_pk)
-    origin_accounts = Account.objects.origin_accounts(ledger_pk)
+
+    def render_accounts():
+        root_accounts = [
+            account for account in cache.account_tree(ledger_pk, ledger.version).values()
+            if account.parent_id is None
+        ]
+        return render_to_string('ledger/accounts_by_type.html', {
+            'destination_accounts': [a for a in root_accounts if a.type == Account.DESTINATION],
+            'origin_accounts': [a for a in root_accounts if a.type == Account.ORIGIN],
+            'ledger': ledger,
+        })
+
+    accounts_html = cache.get_or_set('account_list', (ledger_pk, ledger.version), render_accounts)
     return render(request, 'ledger/account_list.html', {
-        'destination_accounts': destination_accounts,
-        'origin_accounts': origin_accounts,
+        'accounts_html': accounts_html,
         'ledger': ledger,
     })
 
 
+@query_budget(2)
+@_conditional(_accounts_etag)
 def account_list_json(request, ledger_pk):
-    return JsonResponse(Account.objects.all_as_dict(ledger_pk), safe=False)
+    accounts_version = _existing_versions(request, ledger_pk)[1]
+    return JsonResponse(cache.accounts_dicts(ledger_pk, accounts_version), safe=False)
 
 
 def account_create(request, ledger_pk):